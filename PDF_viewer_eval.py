@@ -1,13 +1,26 @@
 from config import OPENAI_API_KEY
 from config import ANTHROPIC_API_KEY
 import os
+import glob
+import multiprocessing
 import pandas as pd
-import openai
-import anthropic
-from llama_index.core import SimpleDirectoryReader
-from llama_index.core import GPTVectorStoreIndex
+from index_cache import (DEFAULT_CHUNK_OVERLAP, INDEX_CACHE_DIR, build_index, chunk_configs, chunking_key,
+                         is_index_current, load_or_build_index, retrieve_contexts)
+from text_store import get_text_store
+from vector_index import VectorIndex, load_or_build_vector_index
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from llm_cache import cached_completion, print_llm_cache_stats
+from resilience import OutputGuard, print_retry_stats, with_retries
+from streaming import stream_anthropic, stream_openai
+from tracing import default_trace_path, tracer
+from results_sink import ResultSink, result_paths
+import argparse
 from datetime import datetime
-from typing import Dict
+from typing import TYPE_CHECKING, Dict, Iterable, Optional
+
+# Heavy SDKs are imported on first use so that --help and imports stay fast
+if TYPE_CHECKING:
+    from llama_index.core import GPTVectorStoreIndex
 
 def create_client(model_choice: str = "gpt-4o"):
     """
@@ -22,58 +35,177 @@ def create_client(model_choice: str = "gpt-4o"):
         raise ValueError("model_choice must be either 'gpt-4o' or 'claude'")
         
     if model_choice == "gpt-4o":
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
+        import openai
+        client = openai.OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
     else:
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        import anthropic
+        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY, max_retries=0)
     
     return client, MODEL_MAPPING[model_choice]
 
-def query_llm(client, model: str, prompt: str) -> str:
+def query_llm(client, model: str, prompt: str, stage: str = "answer", on_token=None) -> str:
     """
     Query the LLM with a given prompt and return the response text.
+    The call is traced as a span of `stage` ("answer" or "judge") and retried on rate limits and
+    transient errors. With `on_token`, the response is streamed to it as it is generated; a cached
+    response is delivered in one piece.
     """
-    if isinstance(client, openai.OpenAI):
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content
-    else:  # Anthropic
-        message = client.messages.create(
-            model=model,
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return message.content
+    import openai
+    guard = OutputGuard(on_token) if on_token is not None else None
+    with tracer.span(stage, model=model, llm_cache_hit=True) as span:
+        if isinstance(client, openai.OpenAI):
+            def call():
+                messages = [{"role": "user", "content": prompt}]
+                if guard is not None:
+                    text, usage = with_retries("openai", model, lambda: stream_openai(client, guard, model=model, messages=messages), guard)
+                else:
+                    response = with_retries("openai", model, lambda: client.chat.completions.create(model=model, messages=messages))
+                    text, usage = response.choices[0].message.content, response.usage
+                span.set(llm_cache_hit=False)
+                span.set_usage(usage)
+                return text
+            text = cached_completion("openai", model, {}, prompt, call)
+        else:  # Anthropic
+            def call():
+                params = dict(model=model, max_tokens=1024, messages=[{"role": "user", "content": prompt}])
+                if guard is not None:
+                    message = with_retries("anthropic", model, lambda: stream_anthropic(client, guard, **params), guard)
+                else:
+                    message = with_retries("anthropic", model, lambda: client.messages.create(**params))
+                span.set(llm_cache_hit=False)
+                span.set_usage(message.usage)
+                return "".join(block.text for block in message.content if block.type == "text")
+            text = cached_completion("anthropic", model, {"max_tokens": 1024}, prompt, call)
+        if on_token is not None and span.attrs['llm_cache_hit'] and text:
+            on_token(text)
+        return text
 
-def build_index_for_pdf(pdf_path: str, chunk_size: int = 1024) -> GPTVectorStoreIndex:
+def build_index_for_pdf(pdf_path: str, chunk_size: int = 1024,
+                        chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> "GPTVectorStoreIndex":
     """
     Build a GPTVectorStoreIndex for a single PDF file.
     """
-    documents = SimpleDirectoryReader(input_files=[pdf_path]).load_data()
-    index = GPTVectorStoreIndex.from_documents(documents)
-    return index
+    return build_index([pdf_path], chunk_size, chunk_overlap)
 
-def build_all_indices(pdf_folder: str, chunk_size: int = 1024) -> Dict[str, GPTVectorStoreIndex]:
+def guideline_pdf_path(pdf_folder: str, guideline: str) -> Optional[str]:
     """
-    Build indices for all PDF files in the folder and return a dictionary mapping filenames to indices.
+    Find the PDF for a guideline key, either `<key>.pdf` or `<key>_*.pdf`.
+    """
+    pdf_path = os.path.join(pdf_folder, f'{guideline}.pdf')
+    if os.path.exists(pdf_path):
+        return pdf_path
+    matching_files = sorted(glob.glob(os.path.join(pdf_folder, f'{guideline}_*.pdf')))
+    return matching_files[0] if matching_files else None
+
+def guideline_index_dir(guideline: str, chunk_size: int = 1024, chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> str:
     """
+    Directory where the persisted index for a single guideline lives.
+    """
+    return os.path.join(INDEX_CACHE_DIR, f"pdf_{chunking_key(chunk_size, chunk_overlap)}", guideline)
+
+def _persist_index_for_pdf(pdf_path: str, persist_dir: str, chunk_size: int, chunk_overlap: int) -> str:
+    """
+    Process pool worker: build the index for one PDF and persist it to disk.
+    Indices are not picklable, so the parent process loads the result from `persist_dir`.
+    """
+    load_or_build_index([pdf_path], persist_dir, chunk_size, chunk_overlap)
+    return persist_dir
+
+def build_indices_for_guidelines(pdf_folder: str, guidelines: Iterable[str], chunk_size: int = 1024,
+                                 max_workers: int = 4, backend: str = "llama_index",
+                                 embedding: str = "local",
+                                 chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> "Dict[str, GPTVectorStoreIndex]":
+    """
+    Build (or load from index_cache/) the indices for the given guideline keys only.
+    Missing or outdated llama_index indices are built in parallel across a process pool; the numpy
+    backend builds local VectorIndex instances embedded with `embedding`.
+    """
+    pdf_paths = {}
+    for guideline in sorted(set(guidelines)):
+        pdf_path = guideline_pdf_path(pdf_folder, guideline)
+        if pdf_path is None:
+            print(f"Warning: No PDF found for guideline {guideline}")
+            continue
+        pdf_paths[guideline] = pdf_path
+
+    if backend == "numpy":
+        get_text_store().update(list(pdf_paths.values()))
+        return {
+            guideline: load_or_build_vector_index(
+                [pdf_path],
+                os.path.join(INDEX_CACHE_DIR, f"pdf_vec_{embedding}_{chunking_key(chunk_size, chunk_overlap)}", guideline),
+                chunk_size,
+                embedding,
+                chunk_overlap
+            )
+            for guideline, pdf_path in pdf_paths.items()
+        }
+
+    to_build = [
+        guideline for guideline, pdf_path in pdf_paths.items()
+        if not is_index_current([pdf_path], guideline_index_dir(guideline, chunk_size, chunk_overlap))
+    ]
+    print(f"{len(pdf_paths) - len(to_build)} cached indices, building {len(to_build)}...")
+
+    if to_build:
+        # extract the text once here, so the pool workers only read the shared store
+        get_text_store().update([pdf_paths[guideline] for guideline in to_build])
+        # spawned, not forked: an earlier config may have opened the SQLite embedding store in this
+        # process, and a connection must not be carried across fork
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {
+                executor.submit(
+                    _persist_index_for_pdf,
+                    pdf_paths[guideline],
+                    guideline_index_dir(guideline, chunk_size, chunk_overlap),
+                    chunk_size,
+                    chunk_overlap
+                ): guideline
+                for guideline in to_build
+            }
+            for future in as_completed(futures):
+                future.result()
+                print(f"Built index for {futures[future]}")
+
     indices = {}
-    for filename in os.listdir(pdf_folder):
-        if filename.endswith('.pdf'):
-            pdf_path = os.path.join(pdf_folder, filename)
-            guideline_name = filename[:-4]  # Remove .pdf extension
-            print(f"Building index for {filename}...")
-            indices[guideline_name] = build_index_for_pdf(pdf_path, chunk_size)
+    for guideline, pdf_path in pdf_paths.items():
+        indices[guideline] = load_or_build_index(
+            [pdf_path], guideline_index_dir(guideline, chunk_size, chunk_overlap), chunk_size, chunk_overlap
+        )
     return indices
 
-def query_index(index: GPTVectorStoreIndex, question: str) -> str:
+def build_all_indices(pdf_folder: str, chunk_size: int = 1024, max_workers: int = 4,
+                      chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> "Dict[str, GPTVectorStoreIndex]":
+    """
+    Build indices for all PDF files in the folder and return a dictionary mapping filenames to indices.
+    """
+    guidelines = [filename[:-4] for filename in os.listdir(pdf_folder) if filename.endswith('.pdf')]
+    return build_indices_for_guidelines(pdf_folder, guidelines, chunk_size, max_workers, chunk_overlap=chunk_overlap)
+
+def query_index(index: "GPTVectorStoreIndex", question: str) -> str:
+    """
+    Query the index with a given question and return the response text.
+    A llama_index index answers through its query engine (retrieval plus an LLM synthesis step);
+    a local VectorIndex returns the retrieved chunks themselves.
+    """
+    if isinstance(index, VectorIndex):
+        with tracer.span("retrieval", backend="numpy"):
+            return index.context(question)
+    with tracer.span("retrieval", backend="llama_index"):
+        query_engine = index.as_query_engine()
+        response = query_engine.query(question)
+        return str(response)
+
+def retrieve_batch(index: "GPTVectorStoreIndex", questions: list) -> list:
     """
-    Query the LlamaIndex with a given question and return the response text.
+    Retrieved chunks for all questions at once: the questions are embedded in one batch, one retriever
+    serves them all and no synthesis LLM call is made, so each context goes straight into the answer prompt.
     """
-    query_engine = index.as_query_engine()
-    response = query_engine.query(question)
-    return str(response)
+    backend = "numpy" if isinstance(index, VectorIndex) else "llama_index"
+    with tracer.span("retrieval", backend=backend, mode="batch", questions=len(questions)):
+        if isinstance(index, VectorIndex):
+            return index.contexts(questions)
+        return retrieve_contexts(index, questions)
 
 def evaluate_answer(client, model: str, question: str, generated_answer: str, expected_answer: str) -> str:
     """
@@ -89,7 +221,7 @@ def evaluate_answer(client, model: str, question: str, generated_answer: str, ex
     Respond with only 'YES' or 'NO'.
     """
     
-    return query_llm(client, model, prompt)
+    return query_llm(client, model, prompt, stage="judge")
 
 def main(
     pdf_folder: str = "pdfs",
@@ -98,25 +230,35 @@ def main(
     end_idx: int = 9,
     model_choice: str = "gpt-4o",
     chunk_size: int = 1024,
-    output_csv: str = None
-):
+    output_csv: str = None,
+    max_workers: int = 4,
+    resume: str = None,
+    backend: str = "llama_index",
+    embedding: str = "local",
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    retrieval: str = "query_engine"
+) -> dict:
     """
     Build separate indices for each PDF and evaluate questions using the corresponding PDF.
+
+    :return: dict with the output CSV path, matches and number of evaluated answers
     """
     # Set default output_csv path if none provided
     if output_csv is None:
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         output_csv = f"results/q_a_answered_PDF_{model_choice}_{timestamp}.csv"
 
+    # Each answered row is appended to a JSONL sink next to the CSV; `resume` continues an earlier run
+    output_csv, sink_path = result_paths(output_csv, resume)
+    sink = ResultSink(sink_path)
+    done = sink.completed()
+    if done:
+        print(f"Resuming from {sink_path}: {len(done)} questions already answered")
+
     # Create API clients
     client, model = create_client(model_choice)
     eval_client, eval_model = create_client("gpt-4o")  # Always use GPT-4 for evaluation
 
-    # Build indices for all PDFs
-    print("Building indices for all PDFs...")
-    indices = build_all_indices(pdf_folder, chunk_size)
-    print("All indices built successfully.\n")
-
     # Read CSV of questions
     df = pd.read_csv(csv_path)
     
@@ -124,71 +266,146 @@ def main(
     for col in required_columns:
         if col not in df.columns:
             raise ValueError(f"CSV file must contain a column named '{col}'")
+
+    # Build indices only for the guidelines used in the requested range
+    end_idx = min(end_idx, len(df) - 1)
+    pending_rows = [i for i in range(start_idx, end_idx + 1) if i not in done]
+    needed_guidelines = df.loc[pending_rows, 'Guideline'].dropna().unique()
+    print(f"Building indices for {len(needed_guidelines)} guidelines...")
+    print(f"Chunk size {chunk_size}, overlap {chunk_overlap}")
+    indices = build_indices_for_guidelines(pdf_folder, needed_guidelines, chunk_size, max_workers, backend, embedding,
+                                           chunk_overlap)
+    print("Indices ready.\n")
+
+    # In batch mode, the questions of each guideline are retrieved together from its index
+    contexts = {}
+    if retrieval == "batch":
+        print(f"Retrieving context for {len(pending_rows)} questions in batches per guideline ...")
+        for guideline, rows in df.loc[pending_rows].groupby('Guideline').groups.items():
+            if guideline in indices:
+                rows = list(rows)
+                contexts.update(zip(rows, retrieve_batch(indices[guideline], df.loc[rows, 'Question'].tolist())))
         
     # Add columns for generated answer and evaluation
     df['Generated_answer'] = ""
     df['Matches_Expected'] = ""
+    for i, record in done.items():
+        df.loc[i, "Generated_answer"] = record['Generated_answer']
+        df.loc[i, "Matches_Expected"] = record['Matches_Expected']
 
     # Process questions
-    end_idx = min(end_idx, len(df) - 1)
     for i in range(start_idx, end_idx + 1):
-        question = df.loc[i, 'Question']
-        guideline = df.loc[i, 'Guideline']
+        if i in done:
+            continue
+        with tracer.context(question_index=i), tracer.span("question"):
+            question = df.loc[i, 'Question']
+            guideline = df.loc[i, 'Guideline']
         
-        print(f"\nProcessing row {i}:")
-        print(f"Question: {question}")
-        print(f"Using guideline: {guideline}")
+            print(f"\nProcessing row {i}:")
+            print(f"Question: {question}")
+            print(f"Using guideline: {guideline}")
         
-        if guideline not in indices:
-            print(f"Warning: No index found for guideline {guideline}")
-            continue
+            if guideline not in indices:
+                print(f"Warning: No index found for guideline {guideline}")
+                continue
             
-        # Get context from the specific index
-        context = query_index(indices[guideline], question)
-        print(f"\nRetrieved Context:\n{context}\n")
+            # Get context from the specific index
+            context = contexts[i] if i in contexts else query_index(indices[guideline], question)
+            print(f"\nRetrieved Context:\n{context}\n")
         
-        # Create prompt with context
-        prompt = f"""Based on the following context, please answer the question. Please provide a short and concise answer. If the answer is not found in the context, please say so.
+            # Create prompt with context
+            prompt = f"""Based on the following context, please answer the question. Please provide a short and concise answer. If the answer is not found in the context, please say so.
                     Context: {context}
                     Question: {question}
                     Answer:"""
         
-        # Query LLM with context and question
-        answer = query_llm(client, model, prompt)
-        df.loc[i, "Generated_answer"] = answer
-        print(f"Generated Answer: {answer}\n")
-
-        # Evaluate the answer if there's an expected answer
-        if df.loc[i, "Answer"]:
-            evaluation = evaluate_answer(
-                eval_client, 
-                eval_model,
-                question, 
-                answer, 
-                df.loc[i, "Answer"]
-            )
-            df.loc[i, "Matches_Expected"] = evaluation
-            print(f"Matches Expected Answer: {evaluation}\n")
+            # Query LLM with context and question
+            answer = query_llm(client, model, prompt)
+            df.loc[i, "Generated_answer"] = answer
+            print(f"Generated Answer: {answer}\n")
 
-        print("-" * 80)
+            # Evaluate the answer if there's an expected answer
+            if df.loc[i, "Answer"]:
+                evaluation = evaluate_answer(
+                    eval_client, 
+                    eval_model,
+                    question, 
+                    answer, 
+                    df.loc[i, "Answer"]
+                )
+                df.loc[i, "Matches_Expected"] = evaluation
+                print(f"Matches Expected Answer: {evaluation}\n")
+
+            sink.append({
+                'question_index': i,
+                'Generated_answer': answer,
+                'Matches_Expected': df.loc[i, "Matches_Expected"]
+            })
+            print("-" * 80)
 
     # Save results
     df.to_csv(output_csv, index=False)
     print(f"\nAnswers written to {output_csv}")
     
     # Print summary statistics
-    if 'Matches_Expected' in df.columns:
-        matches = (df['Matches_Expected'] == 'YES').sum()
-        total_evaluated = df['Matches_Expected'].notna().sum()
-        print(f"\nEvaluation Summary:")
-        print(f"Matches: {matches}/{total_evaluated} ({(matches/total_evaluated*100):.1f}% match rate)")
+    matches = (df['Matches_Expected'] == 'YES').sum()
+    total_evaluated = df['Matches_Expected'].notna().sum()
+    print(f"\nEvaluation Summary:")
+    print(f"Matches: {matches}/{total_evaluated} ({(matches/total_evaluated*100):.1f}% match rate)")
+
+    print_llm_cache_stats()
+    print_retry_stats()
+    tracer.finish(default_trace_path())
+    return {'output_csv': output_csv, 'matches': int(matches), 'evaluated': int(total_evaluated)}
 
 if __name__ == "__main__":
-    main(
-        pdf_folder="pdfs",
-        csv_path="data/q_a.csv",
-        start_idx=0,
-        end_idx=99,
-        model_choice="gpt-4o",
-        chunk_size=1024
-    )
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Evaluate questions against per-guideline PDF indices')
+    parser.add_argument('--pdf_folder', type=str, default="pdfs", help='Directory containing PDF guidelines')
+    parser.add_argument('--csv_path', type=str, default="data/q_a.csv", help='Path to questions CSV')
+    parser.add_argument('--start', type=int, default=0, help='Starting index of questions (inclusive)')
+    parser.add_argument('--end', type=int, default=99, help='Ending index of questions (inclusive)')
+    parser.add_argument('--model_choice', type=str, default="gpt-4o", help='"gpt-4o" or "claude"')
+    parser.add_argument('--chunk_size', type=str, default="1024", help='Chunk size in tokens, or a comma-separated list to sweep (e.g. 256,512,1024)')
+    parser.add_argument('--chunk_overlap', type=str, default=str(DEFAULT_CHUNK_OVERLAP), help=f'Chunk overlap in tokens, or a comma-separated list to sweep (default: {DEFAULT_CHUNK_OVERLAP})')
+    parser.add_argument('--max_workers', type=int, default=4, help='Processes used to build missing indices')
+    parser.add_argument('--resume', type=str, default=None, help='Results file (.jsonl or .csv) of an interrupted run to continue')
+    parser.add_argument('--backend', type=str, default="llama_index", choices=["llama_index", "numpy"], help='Retrieval engine (default: llama_index)')
+    parser.add_argument('--embedding', type=str, default="local", choices=["local", "openai"], help='Embedder of the numpy backend; local runs offline (default: local)')
+    parser.add_argument('--retrieval', type=str, default="query_engine", choices=["query_engine", "batch"], help='query_engine: one query engine call (retrieval and synthesis) per question; batch: retrieve chunks for all questions at once and answer from them directly (default: query_engine)')
+    args = parser.parse_args()
+
+    configs = chunk_configs(args.chunk_size, args.chunk_overlap)
+    if not configs:
+        parser.error("No valid chunk size/overlap combination")
+    if len(configs) > 1 and args.resume:
+        parser.error("--resume continues a single run; give one chunk size and overlap")
+
+    # One run per chunking; the text is extracted once and shared chunk embeddings are reused
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    summaries = []
+    for chunk_size, chunk_overlap in configs:
+        output_csv = None
+        if len(configs) > 1:
+            output_csv = f"results/q_a_answered_PDF_{args.model_choice}_chunk{chunk_size}-{chunk_overlap}_{timestamp}.csv"
+        summaries.append(main(
+            pdf_folder=args.pdf_folder,
+            csv_path=args.csv_path,
+            start_idx=args.start,
+            end_idx=args.end,
+            model_choice=args.model_choice,
+            chunk_size=chunk_size,
+            output_csv=output_csv,
+            max_workers=args.max_workers,
+            resume=args.resume,
+            backend=args.backend,
+            embedding=args.embedding,
+            chunk_overlap=chunk_overlap,
+            retrieval=args.retrieval
+        ))
+        tracer.reset()
+
+    if len(configs) > 1:
+        print(f"\n{'chunk size':>10}{'overlap':>9}{'matches':>10}{'rate':>8}  results")
+        for (chunk_size, chunk_overlap), summary in zip(configs, summaries):
+            rate = summary['matches'] / summary['evaluated'] * 100 if summary['evaluated'] else 0.0
+            print(f"{chunk_size:>10}{chunk_overlap:>9}{summary['matches']:>6}/{summary['evaluated']:<3}{rate:>7.1f}%  {summary['output_csv']}")
@@ -2,11 +2,22 @@ from config import OPENAI_API_KEY
 from config import ANTHROPIC_API_KEY
 import os
 import pandas as pd
-import openai
-import anthropic
-from llama_index.core import SimpleDirectoryReader
-from llama_index.core import GPTVectorStoreIndex
+from index_cache import (DEFAULT_CHUNK_OVERLAP, INDEX_CACHE_DIR, build_index, chunk_configs, chunking_key,
+                         load_or_build_index, retrieve_contexts)
+from llm_cache import cached_completion, print_llm_cache_stats
+from resilience import OutputGuard, print_retry_stats, with_retries
+from streaming import stream_anthropic, stream_openai
+from vector_index import VectorIndex, load_or_build_vector_index
+from tracing import default_trace_path, tracer
+from results_sink import ResultSink, result_paths
+import argparse
+import tempfile
 from datetime import datetime
+from typing import TYPE_CHECKING
+
+# Heavy SDKs are imported on first use so that --help and imports stay fast
+if TYPE_CHECKING:
+    from llama_index.core import GPTVectorStoreIndex
 
 def create_client(model_choice: str = "gpt-4o"):
     """
@@ -25,45 +36,123 @@ def create_client(model_choice: str = "gpt-4o"):
         raise ValueError("model_choice must be either 'gpt-4o' or 'claude'")
         
     if model_choice == "gpt-4o":
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
+        import openai
+        client = openai.OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
     else:
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        import anthropic
+        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY, max_retries=0)
     
     return client, MODEL_MAPPING[model_choice]
 
-def query_llm(client, model: str, prompt: str) -> str:
+def query_llm(client, model: str, prompt: str, stage: str = "answer", on_token=None) -> str:
     """
     Query the LLM with a given prompt and return the response text.
+    The call is traced as a span of `stage` ("answer" or "judge") and retried on rate limits and
+    transient errors. With `on_token`, the response is streamed to it as it is generated; a cached
+    response is delivered in one piece.
+    """
+    import openai
+    guard = OutputGuard(on_token) if on_token is not None else None
+    with tracer.span(stage, model=model, llm_cache_hit=True) as span:
+        if isinstance(client, openai.OpenAI):
+            def call():
+                messages = [{"role": "user", "content": prompt}]
+                if guard is not None:
+                    text, usage = with_retries("openai", model, lambda: stream_openai(client, guard, model=model, messages=messages), guard)
+                else:
+                    response = with_retries("openai", model, lambda: client.chat.completions.create(model=model, messages=messages))
+                    text, usage = response.choices[0].message.content, response.usage
+                span.set(llm_cache_hit=False)
+                span.set_usage(usage)
+                return text
+            text = cached_completion("openai", model, {}, prompt, call)
+        else:  # Anthropic
+            def call():
+                params = dict(model=model, max_tokens=1024, messages=[{"role": "user", "content": prompt}])
+                if guard is not None:
+                    message = with_retries("anthropic", model, lambda: stream_anthropic(client, guard, **params), guard)
+                else:
+                    message = with_retries("anthropic", model, lambda: client.messages.create(**params))
+                span.set(llm_cache_hit=False)
+                span.set_usage(message.usage)
+                return "".join(block.text for block in message.content if block.type == "text")
+            text = cached_completion("anthropic", model, {"max_tokens": 1024}, prompt, call)
+        if on_token is not None and span.attrs['llm_cache_hit'] and text:
+            on_token(text)
+        return text
+
+def build_index_from_pdfs(pdf_folder: str, chunk_size: int = 1024, use_cache: bool = True,
+                          backend: str = "llama_index", embedding: str = "local",
+                          chunk_overlap: int = DEFAULT_CHUNK_OVERLAP):
+    """
+    Build a GPTVectorStoreIndex (backend "llama_index") or a local VectorIndex (backend "numpy",
+    embedded with `embedding`) from the PDF files in `pdf_folder`, split into chunks of `chunk_size`
+    tokens that overlap by `chunk_overlap`.
+    With `use_cache`, the index is persisted under index_cache/ and only new or changed PDFs are re-embedded;
+    without it, nothing is read from or written to the index cache or the embedding store.
     """
-    if isinstance(client, openai.OpenAI):
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content
-    else:  # Anthropic
-        message = client.messages.create(
-            model=model,
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return message.content
+    pdf_paths = sorted(
+        os.path.join(pdf_folder, filename)
+        for filename in os.listdir(pdf_folder)
+        if filename.endswith('.pdf')
+    )
+    if backend == "numpy":
+        if use_cache:
+            persist_dir = os.path.join(INDEX_CACHE_DIR, f"rag_vec_{embedding}_{chunking_key(chunk_size, chunk_overlap)}")
+        else:
+            persist_dir = tempfile.mkdtemp(prefix="rag_vec_")
+        return load_or_build_vector_index(pdf_paths, persist_dir, chunk_size, embedding, chunk_overlap,
+                                          use_store=use_cache)
+    if not use_cache:
+        return build_index(pdf_paths, chunk_size, chunk_overlap, use_store=False)
 
-def build_index_from_pdfs(pdf_folder: str, chunk_size: int = 1024) -> GPTVectorStoreIndex:
+    persist_dir = os.path.join(INDEX_CACHE_DIR, f"rag_{chunking_key(chunk_size, chunk_overlap)}")
+    return load_or_build_index(pdf_paths, persist_dir, chunk_size, chunk_overlap)
+
+def query_index(index: "GPTVectorStoreIndex", question: str) -> str:
     """
-    Build a GPTVectorStoreIndex from the PDF files in `pdf_folder`.
+    Query the index with a given question and return the response text.
+    A llama_index index answers through its query engine (retrieval plus an LLM synthesis step);
+    a local VectorIndex returns the retrieved chunks themselves.
     """
-    documents = SimpleDirectoryReader(pdf_folder, required_exts=[".pdf"]).load_data()
-    index = GPTVectorStoreIndex.from_documents(documents)
-    return index
+    if isinstance(index, VectorIndex):
+        with tracer.span("retrieval", backend="numpy"):
+            return index.context(question)
+    with tracer.span("retrieval", backend="llama_index"):
+        query_engine = index.as_query_engine()
+        response = query_engine.query(question)
+        return str(response)
 
-def query_index(index: GPTVectorStoreIndex, question: str) -> str:
+def retrieve_batch(index: "GPTVectorStoreIndex", questions: list) -> list:
+    """
+    Retrieved chunks for all questions at once: the questions are embedded in one batch, one retriever
+    serves them all and no synthesis LLM call is made, so each context goes straight into the answer prompt.
     """
-    Query the LlamaIndex with a given question and return the response text.
+    backend = "numpy" if isinstance(index, VectorIndex) else "llama_index"
+    with tracer.span("retrieval", backend=backend, mode="batch", questions=len(questions)):
+        if isinstance(index, VectorIndex):
+            return index.contexts(questions)
+        return retrieve_contexts(index, questions)
+
+def answer_question(index: "GPTVectorStoreIndex", client, model: str, question: str, on_token=None,
+                    context: str = None):
     """
-    query_engine = index.as_query_engine()
-    response = query_engine.query(question)
-    return str(response)
+    Retrieve context for the question (unless already retrieved) and have the LLM answer from it.
+    With `on_token`, the answer is streamed to it as it is generated.
+
+    :return: (context, answer)
+    """
+    if context is None:
+        context = query_index(index, question)
+
+    # Create prompt with context
+    prompt = f"""Based on the following context, please answer the question. Please provide a short and concise answer. If the answer is not found in the context, please say so.
+                    Context: {context}
+                    Question: {question}
+                    Answer:"""
+
+    # Query LLM with context and question
+    return context, query_llm(client, model, prompt, on_token=on_token)
 
 def evaluate_answer(client, model: str, question: str, generated_answer: str, expected_answer: str) -> str:
     """
@@ -79,7 +168,7 @@ def evaluate_answer(client, model: str, question: str, generated_answer: str, ex
     Respond with only 'YES' or 'NO'.
     """
     
-    return query_llm(client, model, prompt)
+    return query_llm(client, model, prompt, stage="judge")
 
 def main(
     pdf_folder: str = "pdfs",
@@ -88,23 +177,39 @@ def main(
     end_idx: int = 9,
     model_choice: str = "gpt-4o",
     chunk_size: int = 1024,
-    output_csv: str = None  # Remove the f-string from default parameter
-):
+    output_csv: str = None,  # Remove the f-string from default parameter
+    use_index_cache: bool = True,
+    resume: str = None,
+    backend: str = "llama_index",
+    embedding: str = "local",
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    retrieval: str = "query_engine"
+) -> dict:
     """
     Build the RAG pipeline using direct API calls to OpenAI/Anthropic
+
+    :return: dict with the output CSV path, matches and number of evaluated answers
     """
     # Set default output_csv path if none provided
     if output_csv is None:
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         output_csv = f"results/q_a_answered_RAG_{model_choice}_{timestamp}.csv"
 
+    # Each answered row is appended to a JSONL sink next to the CSV; `resume` continues an earlier run
+    output_csv, sink_path = result_paths(output_csv, resume)
+    sink = ResultSink(sink_path)
+    done = sink.completed()
+    if done:
+        print(f"Resuming from {sink_path}: {len(done)} questions already answered")
+
     # Step 1: Create the API clients
     client, model = create_client(model_choice)
     eval_client, eval_model = create_client("gpt-4o")  # Always use GPT-4 for evaluation
 
     # Step 2: Build an index from the PDFs
-    print(f"Building index from PDFs in '{pdf_folder}' with chunk size {chunk_size} ...")
-    index = build_index_from_pdfs(pdf_folder, chunk_size)
+    print(f"Building {backend} index from PDFs in '{pdf_folder}' with chunk size {chunk_size} and overlap {chunk_overlap} ...")
+    index = build_index_from_pdfs(pdf_folder, chunk_size, use_cache=use_index_cache, backend=backend,
+                                  embedding=embedding, chunk_overlap=chunk_overlap)
     print("Index built successfully.\n")
 
     # Step 3: Read CSV of questions
@@ -119,67 +224,108 @@ def main(
     # Add columns for generated answer and evaluation
     df['Generated_answer'] = ""
     df['Matches_Expected'] = ""
+    for i, record in done.items():
+        df.loc[i, "Generated_answer"] = record['Generated_answer']
+        df.loc[i, "Matches_Expected"] = record['Matches_Expected']
 
     # Step 4: Query for each question in [start_idx, end_idx]
     end_idx = min(end_idx, len(df) - 1)
-    for i in range(start_idx, end_idx + 1):
-        question = df.loc[i, "Question"]
-        print(f"\nQuerying index for row {i} -> Question: {question}")
+    pending_rows = [i for i in range(start_idx, end_idx + 1) if i not in done]
+    contexts = {}
+    if retrieval == "batch":
+        print(f"Retrieving context for {len(pending_rows)} questions in one batch ...")
+        contexts = dict(zip(pending_rows, retrieve_batch(index, df.loc[pending_rows, "Question"].tolist())))
+    for i in pending_rows:
+        with tracer.context(question_index=i), tracer.span("question"):
+            question = df.loc[i, "Question"]
+            print(f"\nQuerying index for row {i} -> Question: {question}")
 
-        # Get context from the index
-        context = query_index(index, question)
-        print(f"\nRetrieved Context:\n{context}\n")
-        
-        # Create prompt with context
-        prompt = f"""Based on the following context, please answer the question. Please provide a short and concise answer. If the answer is not found in the context, please say so.
-                    Context: {context}
-                    Question: {question}
-                    Answer:"""
-        
-        # Query LLM with context and question
-        answer = query_llm(client, model, prompt)
-        df.loc[i, "Generated_answer"] = answer
-        print(f"Generated Answer: {answer}\n")
-
-        # Evaluate the answer if there's an expected answer
-        if df.loc[i, "Answer"]:
-            evaluation = evaluate_answer(
-                eval_client, 
-                eval_model,
-                question, 
-                answer, 
-                df.loc[i, "Answer"]
-            )
-            df.loc[i, "Matches_Expected"] = evaluation
-            print(f"Matches Expected Answer: {evaluation}\n")
-
-        print("-" * 80)
+            # Retrieve context and answer the question with it
+            context, answer = answer_question(index, client, model, question, context=contexts.get(i))
+            print(f"\nRetrieved Context:\n{context}\n")
+            df.loc[i, "Generated_answer"] = answer
+            print(f"Generated Answer: {answer}\n")
+
+            # Evaluate the answer if there's an expected answer
+            if df.loc[i, "Answer"]:
+                evaluation = evaluate_answer(
+                    eval_client, 
+                    eval_model,
+                    question, 
+                    answer, 
+                    df.loc[i, "Answer"]
+                )
+                df.loc[i, "Matches_Expected"] = evaluation
+                print(f"Matches Expected Answer: {evaluation}\n")
+
+            sink.append({
+                'question_index': i,
+                'Generated_answer': answer,
+                'Matches_Expected': df.loc[i, "Matches_Expected"]
+            })
+            print("-" * 80)
 
     # Step 5: Save updated CSV
     df.to_csv(output_csv, index=False)
     print(f"\nAnswers written to {output_csv}")
     
     # Print summary statistics
-    if 'Matches_Expected' in df.columns:
-        matches = (df['Matches_Expected'] == 'YES').sum()
-        total_evaluated = df['Matches_Expected'].notna().sum()
-        print(f"\nEvaluation Summary:")
-        print(f"Matches: {matches}/{total_evaluated} ({(matches/total_evaluated*100):.1f}% match rate)")
+    matches = (df['Matches_Expected'] == 'YES').sum()
+    total_evaluated = df['Matches_Expected'].notna().sum()
+    print(f"\nEvaluation Summary:")
+    print(f"Matches: {matches}/{total_evaluated} ({(matches/total_evaluated*100):.1f}% match rate)")
+
+    print_llm_cache_stats()
+    print_retry_stats()
+    tracer.finish(default_trace_path())
+    return {'output_csv': output_csv, 'matches': int(matches), 'evaluated': int(total_evaluated)}
 
 if __name__ == "__main__":
-    # Example usage:
-    #  - PDF folder: pdfs/
-    #  - CSV path: data/q_a.csv
-    #  - Indices from 0 to 9
-    #  - Use GPT-4o as the model
-    #  - Save output to results/q_a_answered.csv
-
-    main(
-        pdf_folder="pdfs",
-        csv_path="data/q_a.csv",
-        start_idx=0,
-        end_idx=99,
-        #model_choice="gpt-4o",  
-        model_choice="claude",
-        chunk_size=1024
-    )
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='RAG evaluation over a single index of all PDF guidelines')
+    parser.add_argument('--pdf_folder', type=str, default="pdfs", help='Directory containing PDF guidelines')
+    parser.add_argument('--csv_path', type=str, default="data/q_a.csv", help='Path to questions CSV')
+    parser.add_argument('--start', type=int, default=0, help='Starting index of questions (inclusive)')
+    parser.add_argument('--end', type=int, default=99, help='Ending index of questions (inclusive)')
+    parser.add_argument('--model_choice', type=str, default="claude", help='"gpt-4o" or "claude"')
+    parser.add_argument('--chunk_size', type=str, default="1024", help='Chunk size in tokens, or a comma-separated list to sweep (e.g. 256,512,1024)')
+    parser.add_argument('--chunk_overlap', type=str, default=str(DEFAULT_CHUNK_OVERLAP), help=f'Chunk overlap in tokens, or a comma-separated list to sweep (default: {DEFAULT_CHUNK_OVERLAP})')
+    parser.add_argument('--resume', type=str, default=None, help='Results file (.jsonl or .csv) of an interrupted run to continue')
+    parser.add_argument('--backend', type=str, default="llama_index", choices=["llama_index", "numpy"], help='Retrieval engine (default: llama_index)')
+    parser.add_argument('--embedding', type=str, default="local", choices=["local", "openai"], help='Embedder of the numpy backend; local runs offline (default: local)')
+    parser.add_argument('--retrieval', type=str, default="query_engine", choices=["query_engine", "batch"], help='query_engine: one query engine call (retrieval and synthesis) per question; batch: retrieve chunks for all questions at once and answer from them directly (default: query_engine)')
+    args = parser.parse_args()
+
+    configs = chunk_configs(args.chunk_size, args.chunk_overlap)
+    if not configs:
+        parser.error("No valid chunk size/overlap combination")
+    if len(configs) > 1 and args.resume:
+        parser.error("--resume continues a single run; give one chunk size and overlap")
+
+    # One run per chunking; the text is extracted once and shared chunk embeddings are reused
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    summaries = []
+    for chunk_size, chunk_overlap in configs:
+        output_csv = None
+        if len(configs) > 1:
+            output_csv = f"results/q_a_answered_RAG_{args.model_choice}_chunk{chunk_size}-{chunk_overlap}_{timestamp}.csv"
+        summaries.append(main(
+            pdf_folder=args.pdf_folder,
+            csv_path=args.csv_path,
+            start_idx=args.start,
+            end_idx=args.end,
+            model_choice=args.model_choice,
+            chunk_size=chunk_size,
+            output_csv=output_csv,
+            resume=args.resume,
+            backend=args.backend,
+            embedding=args.embedding,
+            chunk_overlap=chunk_overlap,
+            retrieval=args.retrieval
+        ))
+        tracer.reset()
+
+    if len(configs) > 1:
+        print(f"\n{'chunk size':>10}{'overlap':>9}{'matches':>10}{'rate':>8}  results")
+        for (chunk_size, chunk_overlap), summary in zip(configs, summaries):
+            rate = summary['matches'] / summary['evaluated'] * 100 if summary['evaluated'] else 0.0
+            print(f"{chunk_size:>10}{chunk_overlap:>9}{summary['matches']:>6}/{summary['evaluated']:<3}{rate:>7.1f}%  {summary['output_csv']}")
@@ -1,10 +1,34 @@
-from evaluate_answers import AnswerEvaluator
+from evaluate_answers import AnswerEvaluator, configure_page_slicing, is_error_result
+from rate_limiter import RateLimiter
+from token_ledger import ledger
+from tracing import tracer
+from llm_cache import print_llm_cache_stats
+from resilience import print_retry_stats
+from results_sink import ResultSink, result_paths
+from scheduler import ORDERS
 import argparse
 from datetime import datetime
 import os
 import pandas as pd
 import time
 
+def print_progress(all_results):
+    """
+    Print the running guideline-match and answer-correct tallies
+    """
+    total = len(all_results)
+    correct_guidelines = sum(1 for r in all_results if r.get('guideline_match', False))
+    correct_answers = sum(1 for r in all_results 
+                        if r.get('answer_correct') 
+                        and r['answer_correct'].startswith('YES'))
+    
+    print("\nCurrent Progress:")
+    print("-" * 50)
+    print(f"Questions evaluated: {total}")
+    if total > 0:
+        print(f"Correct guidelines: {correct_guidelines}/{total} ({correct_guidelines/total*100:.1f}%)")
+        print(f"Correct answers: {correct_answers}/{total} ({correct_answers/total*100:.1f}%)")
+
 def main():
     # Create results directory if it doesn't exist
     os.makedirs('results', exist_ok=True)
@@ -14,51 +38,92 @@ def main():
     parser.add_argument('--start', type=int, default=0, help='Starting index of questions (inclusive)')
     parser.add_argument('--end', type=int, default=5, help='Ending index of questions (exclusive)')
     parser.add_argument('--seed', type=int, default=42, help='Cache seed for openai chat')
-    parser.add_argument('--interval', type=int, default=90, help='Time between evaluations in seconds (default: 90)')
+    parser.add_argument('--interval', type=int, default=0, help='Extra pause between evaluations in seconds when --workers is 1; rate limits are retried with backoff (default: 0)')
+    parser.add_argument('--resume', type=str, default=None, help='Results file (.jsonl or .csv) of an interrupted run to continue')
+    parser.add_argument('--router', action='store_true', help='Skip the coordinator LLM turn when the local guideline router is confident')
+    parser.add_argument('--speaker_mode', type=str, default='groupchat', choices=['groupchat', 'state_machine'], help='How the next agent is chosen: GroupChatManager or the fixed state machine (default: groupchat)')
+    parser.add_argument('--order', type=str, default='row', choices=ORDERS, help='Question order: row, or grouped by expected or routed guideline so questions on one guideline reuse its cached PDF (default: row)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of questions evaluated concurrently; above 1 the rate limiter replaces --interval (default: 1)')
+    parser.add_argument('--rpm', type=float, default=50, help='Requests per minute budget for concurrent mode (default: 50)')
+    parser.add_argument('--itpm', type=float, default=80000, help='Input tokens per minute budget for concurrent mode (default: 80000)')
+    parser.add_argument('--requests_per_question', type=int, default=4, help='Model requests charged per question in concurrent mode (default: 4)')
+    parser.add_argument('--tokens_per_question', type=int, default=60000, help='Estimated input tokens per question in concurrent mode (default: 60000)')
     args = parser.parse_args()
 
+    # Every result is appended to the JSONL sink as soon as it is produced
+    run_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_path, sink_path = result_paths(f'results/evaluation_results_{run_timestamp}.csv', args.resume)
+    sink = ResultSink(sink_path)
+    done = {idx: r for idx, r in sink.completed().items() if not is_error_result(r)}
+    if done:
+        print(f"Resuming from {sink_path}: {len(done)} questions already evaluated")
+
+    configure_page_slicing(args.order)
+
     # Initialize evaluator
     print(f"Initializing evaluator with seed {args.seed}")
-    evaluator = AnswerEvaluator(cache_seed=args.seed)
+    evaluator = AnswerEvaluator(cache_seed=args.seed, use_router=args.router, speaker_mode=args.speaker_mode)
     
-    all_results = []
-    current_idx = args.start
+    all_results = [r for idx, r in sorted(done.items()) if args.start <= idx < args.end]
     
-    while current_idx < args.end:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"\n[{timestamp}] Evaluating question {current_idx}")
-        
-        # Run evaluation for single question
-        results = evaluator.run_evaluation(start_idx=current_idx, end_idx=current_idx + 1)
-        all_results.extend(results)
-        
-        # Print interim results
-        total = len(all_results)
-        correct_guidelines = sum(1 for r in all_results if r.get('guideline_match', False))
-        correct_answers = sum(1 for r in all_results 
-                            if r.get('answer_correct') 
-                            and r['answer_correct'].startswith('YES'))
-        
-        print("\nCurrent Progress:")
-        print("-" * 50)
-        print(f"Questions evaluated: {total}")
-        if total > 0:
-            print(f"Correct guidelines: {correct_guidelines}/{total} ({correct_guidelines/total*100:.1f}%)")
-            print(f"Correct answers: {correct_answers}/{total} ({correct_answers/total*100:.1f}%)")
-        
-        current_idx += 1
+    if args.workers > 1:
+        print(f"Evaluating questions {args.start}-{args.end} with {args.workers} workers "
+              f"({args.rpm:g} requests/min, {args.itpm:g} input tokens/min)")
+        rate_limiter = RateLimiter(requests_per_minute=args.rpm, input_tokens_per_minute=args.itpm)
+
+        def on_result(idx, result):
+            sink.append(result)
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print(f"\n[{timestamp}] Finished question {idx}")
+            all_results.append(result)
+            print_progress(all_results)
+
+        evaluator.run_evaluation_concurrent(
+            start_idx=args.start,
+            end_idx=args.end,
+            max_workers=args.workers,
+            rate_limiter=rate_limiter,
+            requests_per_question=args.requests_per_question,
+            tokens_per_question=args.tokens_per_question,
+            skip_indices=done.keys(),
+            on_result=on_result,
+            order=args.order
+        )
+    else:
+        pending = [idx for idx in range(args.start, min(args.end, len(evaluator.qa_df))) if idx not in done]
+        pending = [idx for group in evaluator.question_groups(pending, args.order) for idx in group]
         
-        # Wait before next evaluation (unless it's the last one)
-        if current_idx < args.end:
-            print(f"\nWaiting {args.interval} seconds before next evaluation...")
-            time.sleep(args.interval)
+        for position, current_idx in enumerate(pending):
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print(f"\n[{timestamp}] Evaluating question {current_idx}")
+            
+            # Run evaluation for single question
+            results = evaluator.run_evaluation(start_idx=current_idx, end_idx=current_idx + 1)
+            for result in results:
+                sink.append(result)
+            all_results.extend(results)
+            
+            # Print interim results
+            print_progress(all_results)
+            
+            # Wait before next evaluation (unless it's the last one)
+            if args.interval > 0 and position < len(pending) - 1:
+                print(f"\nWaiting {args.interval} seconds before next evaluation...")
+                time.sleep(args.interval)
     
-    # Save final results to CSV
-    results_df = pd.DataFrame(all_results)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    csv_path = f'results/evaluation_results_{timestamp}.csv'
+    # Save final results to CSV, in question order
+    results = [r for r in sink.records() if args.start <= r['question_index'] < args.end]
+    results_df = pd.DataFrame(results)
     results_df.to_csv(csv_path, index=False)
     print(f"\nFinal results saved to: {csv_path}")
 
+    ledger.print_summary()
+    print_llm_cache_stats()
+    print_retry_stats()
+    ledger_path = f'results/token_ledger_{run_timestamp}.jsonl'
+    ledger.save(ledger_path)
+    print(f"Token ledger saved to: {ledger_path}")
+    tracer.finish(f'results/trace_{run_timestamp}.jsonl')
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
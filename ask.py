@@ -0,0 +1,65 @@
+"""
+Interactive Question Answering
+Answers one question with the multi-agent framework or a baseline and prints the answer as it is
+generated, followed by the time to first token, output tokens per second and total latency.
+
+    python ask.py "How should adjuvant pembrolizumab be given with radiation therapy?"
+    python ask.py "..." --pipeline non_agent --model claude-3-7
+    python ask.py "..." --pipeline rag --model gpt-4o
+"""
+
+import argparse
+import sys
+import time
+from tracing import tracer
+
+PIPELINES = ('agent', 'non_agent', 'rag')
+
+
+def answer_stream(args):
+    """
+    TokenStream over the answer of the selected pipeline.
+    """
+    from streaming import TokenStream
+    if args.pipeline == 'agent':
+        from claude_autogen import ClaudeChat
+        claude_chat = ClaudeChat(cache_seed=None, use_router=args.router, speaker_mode=args.speaker_mode)
+        return claude_chat.stream(args.question)
+    if args.pipeline == 'non_agent':
+        from non_agent_eval import NonAgentEval
+        return NonAgentEval(None).stream_answer(args.question, args.model)
+    from RAG_eval import answer_question, build_index_from_pdfs, create_client
+    client, model = create_client(args.model)
+    index = build_index_from_pdfs(args.pdf_folder, args.chunk_size)
+    return TokenStream(lambda on_token: answer_question(index, client, model, args.question, on_token=on_token))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Answer one question and stream the answer as it is generated')
+    parser.add_argument('question', type=str, help='Question to answer')
+    parser.add_argument('--pipeline', type=str, default='agent', choices=PIPELINES, help='Pipeline that answers (default: agent)')
+    parser.add_argument('--model', type=str, default='gpt-4o', help='Model for the non_agent (gpt-4o, claude-3-7, gemini-2.5-flash, DeepSeek-R1) or rag (gpt-4o, claude) pipeline (default: gpt-4o)')
+    parser.add_argument('--router', action='store_true', help='Use the local guideline router in the agent pipeline')
+    parser.add_argument('--speaker_mode', type=str, default='groupchat', choices=['groupchat', 'state_machine'], help='Speaker selection for the agent pipeline (default: groupchat)')
+    parser.add_argument('--pdf_folder', type=str, default='pdfs', help='Guideline PDFs for the rag pipeline')
+    parser.add_argument('--chunk_size', type=int, default=1024, help='Chunk size for the rag index')
+    args = parser.parse_args()
+
+    stream = answer_stream(args)
+    start = time.perf_counter()
+    first_token = None
+    for text in stream:
+        if first_token is None:
+            first_token = time.perf_counter()
+        sys.stdout.write(text)
+        sys.stdout.flush()
+    end = time.perf_counter()
+    print()
+
+    if first_token is not None:
+        print(f"\nFirst token after {first_token - start:.2f}s, answer complete after {end - start:.2f}s")
+    tracer.print_summary()
+
+
+if __name__ == "__main__":
+    main()
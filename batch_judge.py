@@ -0,0 +1,282 @@
+"""
+Batched Judging
+Packs many (question, generated answer, expected answer) triples into one structured-output
+GPT-4o request and reads back a JSON array of YES/NO verdicts. Items that are missing from the
+reply or fail to parse are judged again one at a time. Alternatively the whole workload can be
+submitted as an offline OpenAI batch job.
+
+Re-score an existing results CSV:
+    python batch_judge.py --results results/evaluation_results_20251105_165452.csv --mode batch
+"""
+
+import argparse
+import json
+import time
+from llm_cache import cached_completion, lookup_completion, store_completion
+from resilience import print_retry_stats, with_retries
+from tracing import tracer
+
+JUDGE_MODEL = "gpt-4o-2024-11-20"
+JUDGE_PARAMS = {"temperature": 0.0}
+DEFAULT_BATCH_SIZE = 20
+
+VERDICT_SCHEMA = {
+    "name": "verdicts",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "verdicts": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        "verdict": {"type": "string", "enum": ["YES", "NO"]},
+                    },
+                    "required": ["id", "verdict"],
+                    "additionalProperties": False,
+                },
+            }
+        },
+        "required": ["verdicts"],
+        "additionalProperties": False,
+    },
+}
+
+
+def judge_prompt(question, generated_answer, expected_answer):
+    """
+    The single-item judge prompt shared by AnswerEvaluator and NonAgentEval.
+    """
+    return f"""
+        Compare these two answers to the question: "{question}"
+        
+        Generated answer: {generated_answer}
+        Expected answer: {expected_answer}
+        
+        Does the generated answer contain the same key information as the expected answer? 
+        Respond with only 'YES' or 'NO'.
+        """
+
+
+def judge_single(client, question, generated_answer, expected_answer):
+    """
+    Judge one item with its own request (cached).
+    """
+    prompt = judge_prompt(question, generated_answer, expected_answer)
+
+    with tracer.span("judge", model=JUDGE_MODEL, llm_cache_hit=True) as span:
+        def call():
+            response = with_retries("openai", JUDGE_MODEL, lambda: client.chat.completions.create(
+                model=JUDGE_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                **JUDGE_PARAMS
+            ))
+            span.set(llm_cache_hit=False)
+            span.set_usage(response.usage)
+            return response.choices[0].message.content
+
+        return cached_completion("openai", JUDGE_MODEL, JUDGE_PARAMS, prompt, call)
+
+
+def batch_prompt(items):
+    """
+    One prompt covering several items; each item keeps its position in `items` as its id.
+    """
+    payload = [
+        {"id": i, "question": item["question"], "generated_answer": item["generated_answer"],
+         "expected_answer": item["expected_answer"]}
+        for i, item in enumerate(items)
+    ]
+    return (
+        "For each item below, compare the generated answer with the expected answer to the question.\n"
+        "Does the generated answer contain the same key information as the expected answer?\n"
+        "Return one verdict per item id: 'YES' or 'NO'.\n\n"
+        f"Items:\n{json.dumps(payload, ensure_ascii=False, default=str, indent=1)}"
+    )
+
+
+def parse_verdicts(text, count):
+    """
+    Verdicts by item id from a structured reply; ids that are missing or malformed map to None.
+    """
+    verdicts = [None] * count
+    try:
+        entries = json.loads(text)["verdicts"]
+    except (TypeError, ValueError, KeyError):
+        return verdicts
+    for entry in entries:
+        try:
+            item_id, verdict = int(entry["id"]), str(entry["verdict"]).strip().upper()
+        except (TypeError, ValueError, KeyError):
+            continue
+        if 0 <= item_id < count and verdict in ("YES", "NO"):
+            verdicts[item_id] = verdict
+    return verdicts
+
+
+def judge_batch(client, items, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Judge items `batch_size` at a time with structured-output requests, falling back to
+    single-item calls for anything the batched reply did not cover.
+
+    Args:
+        client: OpenAI client
+        items (list): Dicts with question, generated_answer and expected_answer
+
+    Returns:
+        list: 'YES'/'NO' verdicts aligned with `items`
+    """
+    verdicts = []
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        prompt = batch_prompt(chunk)
+        params = dict(JUDGE_PARAMS, response_format="verdicts_v1")
+
+        with tracer.span("judge_batch", model=JUDGE_MODEL, items=len(chunk), llm_cache_hit=True) as span:
+            def call():
+                response = with_retries("openai", JUDGE_MODEL, lambda: client.chat.completions.create(
+                    model=JUDGE_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    response_format={"type": "json_schema", "json_schema": VERDICT_SCHEMA},
+                    **JUDGE_PARAMS
+                ))
+                span.set(llm_cache_hit=False)
+                span.set_usage(response.usage)
+                return response.choices[0].message.content
+
+            try:
+                chunk_verdicts = parse_verdicts(cached_completion("openai", JUDGE_MODEL, params, prompt, call), len(chunk))
+            except Exception as e:
+                print(f"Batched judge request failed ({str(e)}); judging {len(chunk)} items individually")
+                span.error = f"{type(e).__name__}: {e}"
+                chunk_verdicts = [None] * len(chunk)
+
+        missing = sum(v is None for v in chunk_verdicts)
+        if missing:
+            print(f"{missing}/{len(chunk)} verdicts missing from batched reply; judging them individually")
+        for item, verdict in zip(chunk, chunk_verdicts):
+            if verdict is None:
+                verdict = judge_single(client, item["question"], item["generated_answer"], item["expected_answer"])
+            verdicts.append(verdict)
+    return verdicts
+
+
+def judge_offline(client, items, poll_interval=30, timeout=24 * 3600):
+    """
+    Submit the single-item judge prompts as one OpenAI batch job and wait for it to finish.
+    Prompts already in the LLM cache are answered from it and not submitted. Results are written to
+    the cache under the same keys as judge_single, so later runs reuse them; items the job did not
+    return are judged individually.
+
+    Returns:
+        list: 'YES'/'NO' verdicts aligned with `items`
+    """
+    prompts = [judge_prompt(item["question"], item["generated_answer"], item["expected_answer"]) for item in items]
+    cached = {}
+    for i, prompt in enumerate(prompts):
+        response = lookup_completion("openai", JUDGE_MODEL, JUDGE_PARAMS, prompt)
+        if response is not None:
+            cached[i] = response
+    todo = [i for i in range(len(items)) if i not in cached]
+    if cached:
+        print(f"{len(cached)} of {len(items)} verdicts read from the response cache")
+    if not todo:
+        return [cached[i] for i in range(len(items))]
+
+    lines = [
+        json.dumps({
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": JUDGE_MODEL, "messages": [{"role": "user", "content": prompts[i]}], **JUDGE_PARAMS},
+        })
+        for i in todo
+    ]
+    with tracer.span("judge_offline", model=JUDGE_MODEL, items=len(todo)):
+        upload = with_retries("openai", "batch", lambda: client.files.create(
+            file=("judge_batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch"))
+        batch = with_retries("openai", "batch", lambda: client.batches.create(
+            input_file_id=upload.id, endpoint="/v1/chat/completions", completion_window="24h"))
+        print(f"Submitted batch job {batch.id} with {len(todo)} judge requests")
+
+        deadline = time.monotonic() + timeout
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Batch job {batch.id} still {batch.status} after {timeout} s")
+            time.sleep(poll_interval)
+            batch = with_retries("openai", "batch", lambda: client.batches.retrieve(batch.id))
+            print(f"Batch job {batch.id}: {batch.status}")
+
+        answers = {}
+        if batch.status == "completed" and batch.output_file_id:
+            output = with_retries("openai", "batch", lambda: client.files.content(batch.output_file_id))
+            for line in output.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") != 200:
+                    continue
+                answers[int(record["custom_id"])] = response["body"]["choices"][0]["message"]["content"]
+        else:
+            print(f"Batch job {batch.id} ended as {batch.status}; judging individually")
+
+    verdicts = []
+    for i, item in enumerate(items):
+        if i in cached:
+            verdicts.append(cached[i])
+        elif i in answers:
+            store_completion("openai", JUDGE_MODEL, JUDGE_PARAMS, prompts[i], answers[i])
+            verdicts.append(answers[i])
+        else:
+            verdicts.append(judge_single(client, item["question"], item["generated_answer"], item["expected_answer"]))
+    return verdicts
+
+
+def judge_items(client, items, mode="batch", batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Judge items with the given mode: 'single', 'batch' or 'offline'.
+    """
+    if mode == "single":
+        return [judge_single(client, item["question"], item["generated_answer"], item["expected_answer"]) for item in items]
+    if mode == "batch":
+        return judge_batch(client, items, batch_size)
+    if mode == "offline":
+        return judge_offline(client, items)
+    raise ValueError(f"Unsupported judge mode: {mode}")
+
+
+def main():
+    import pandas as pd
+    from openai import OpenAI
+    from config import OPENAI_API_KEY
+
+    parser = argparse.ArgumentParser(description='Re-score a results CSV with the batched judge')
+    parser.add_argument('--results', type=str, required=True, help='Results CSV with question, expected and generated answers')
+    parser.add_argument('--mode', type=str, default='batch', choices=['single', 'batch', 'offline'], help='Judge mode (default: batch)')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE, help='Items per batched request (default: 20)')
+    parser.add_argument('--answer_column', type=str, default='generated_answer', help='Column holding the generated answers')
+    parser.add_argument('--verdict_column', type=str, default='answer_correct', help='Column the verdicts are written to')
+    parser.add_argument('--output', type=str, default=None, help='Output CSV (default: overwrite --results)')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.results)
+    items = [
+        {"question": row['question'], "generated_answer": row[args.answer_column], "expected_answer": row['expected_answer']}
+        for _, row in df.iterrows()
+    ]
+    client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    df[args.verdict_column] = judge_items(client, items, args.mode, args.batch_size)
+    output = args.output or args.results
+    df.to_csv(output, index=False)
+
+    correct = df[args.verdict_column].astype(str).str.startswith('YES').sum()
+    print(f"Correct answers: {correct}/{len(df)} ({correct/len(df)*100:.1f}%)")
+    print(f"Results written to {output}")
+    print_retry_stats()
+
+
+if __name__ == "__main__":
+    main()
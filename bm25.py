@@ -0,0 +1,85 @@
+"""
+BM25 Scoring
+Small NumPy implementation of Okapi BM25 used to score guideline pages and summaries locally.
+Document weights are precomputed into one matrix, so scoring any number of queries is a single matrix product.
+"""
+
+import re
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for', 'from', 'has', 'have',
+    'how', 'if', 'in', 'is', 'it', 'its', 'of', 'on', 'or', 'should', 'that', 'the', 'their', 'there',
+    'these', 'this', 'to', 'was', 'what', 'when', 'which', 'who', 'with', 'within', 'would',
+    # suffix the coordinator appends to every process_pdf prompt
+    'must', 'also', 'include', 'exact', 'context', 'each', 'point',
+}
+
+
+def tokenize(text: str) -> list:
+    """
+    Lowercase word tokens with stopwords removed; hyphenated terms such as pd-l1 are kept whole.
+    """
+    return [token for token in TOKEN_PATTERN.findall(str(text).lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    BM25 index over a fixed list of documents.
+
+    Args:
+        documents (list): Document texts
+        k1 (float): Term frequency saturation
+        b (float): Length normalization
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        tokenized = [tokenize(doc) for doc in documents]
+        self.vocab = {}
+        for tokens in tokenized:
+            for token in tokens:
+                self.vocab.setdefault(token, len(self.vocab))
+
+        tf = np.zeros((len(tokenized), max(len(self.vocab), 1)), dtype=np.float32)
+        for row, tokens in enumerate(tokenized):
+            for token in tokens:
+                tf[row, self.vocab[token]] += 1
+
+        n_docs = max(len(tokenized), 1)
+        df = (tf > 0).sum(axis=0)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        doc_len = tf.sum(axis=1, keepdims=True)
+        avg_len = max(float(doc_len.mean()), 1.0) if len(tokenized) else 1.0
+        norm = k1 * (1 - b + b * doc_len / avg_len)
+        self.weights = self.idf * tf * (k1 + 1) / (tf + norm)
+        self.k1 = k1
+
+    def query_matrix(self, queries) -> np.ndarray:
+        """
+        Binary term-presence matrix (n_queries x n_terms) for the given queries.
+        """
+        matrix = np.zeros((len(queries), self.weights.shape[1]), dtype=np.float32)
+        for row, query in enumerate(queries):
+            for token in tokenize(query):
+                column = self.vocab.get(token)
+                if column is not None:
+                    matrix[row, column] = 1.0
+        return matrix
+
+    def score_batch(self, queries) -> np.ndarray:
+        """
+        Scores of every query against every document (n_queries x n_documents), in one pass.
+        """
+        return self.query_matrix(queries) @ self.weights.T
+
+    def scores(self, query: str) -> np.ndarray:
+        return self.score_batch([query])[0]
+
+    def max_scores(self, queries) -> np.ndarray:
+        """
+        Upper bound of each query's score, reached if every query term saturated one document.
+        Used to turn raw scores into a 0-1 confidence.
+        """
+        return self.query_matrix(queries) @ (self.idf * (self.k1 + 1))
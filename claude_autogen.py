@@ -1,24 +1,115 @@
 import os
 import autogen
-import anthropic
-import base64
-import time
-import glob
 import json
+import threading
+import uuid
+from contextlib import contextmanager
 from autogen import register_function
+from autogen.oai.anthropic import AnthropicClient
 from config import ANTHROPIC_API_KEY
-from utils import download_and_rename_pdf, process_pdf
-from data.asco_guidelines import guideline_urls as asco_guideline_url
+from utils import process_pdf
 from data.asco_guidelines import guideline_summaries as asco_guideline_summary
+from guideline_router import GuidelineRouter
+from resilience import OutputGuard, with_retries
+from streaming import TokenStream, stream_anthropic
+from token_ledger import ledger
+from tracing import tracer
 
-# check and download all the pdfs
-for key, value in asco_guideline_url.items():
-    pdf_url = value[1]
-    download_and_rename_pdf(pdf_url, key)
+# Guideline PDFs are downloaded by an explicit step: python sync_guidelines.py
 
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# "groupchat": GroupChatManager picks each speaker from the allowed transitions (with an LLM call where the
+# graph branches). "state_machine": the transitions are followed in code and the conversation only branches
+# on what the agents themselves replied.
+SPEAKER_MODES = ("groupchat", "state_machine")
+
+# on_token callback of the agent turn running on this thread, if its reply should be streamed
+_stream_target = threading.local()
+
+
+def format_guideline_catalog(summaries):
+    """
+    Compact, deterministic catalog text: one `key: description` line per guideline, in catalog
+    order, with whitespace collapsed. Equal summary sets always give byte-identical text.
+    """
+    return "\n".join(f"{key}: {' '.join(str(summary).split())}" for key, summary in summaries.items())
+
+
+def with_cache_breakpoints(params):
+    """
+    Anthropic request parameters with prompt-cache breakpoints on the stable prefix: the last tool
+    definition, the system prompt (which carries the guideline catalog) and the newest message, so each
+    turn reads the prefix written by the previous one.
+    """
+    params = dict(params)
+    if params.get("tools"):
+        params["tools"] = params["tools"][:-1] + [dict(params["tools"][-1], cache_control=CACHE_CONTROL)]
+    if isinstance(params.get("system"), str) and params["system"]:
+        params["system"] = [{"type": "text", "text": params["system"], "cache_control": CACHE_CONTROL}]
+    messages = list(params.get("messages") or [])
+    if messages:
+        last = dict(messages[-1])
+        content = last.get("content")
+        if isinstance(content, str) and content:
+            last["content"] = [{"type": "text", "text": content, "cache_control": CACHE_CONTROL}]
+        elif isinstance(content, list) and content and isinstance(content[-1], dict):
+            last["content"] = content[:-1] + [dict(content[-1], cache_control=CACHE_CONTROL)]
+        messages[-1] = last
+        params["messages"] = messages
+    return params
+
+
+class _CachingMessages:
+    """
+    Stand-in for `Anthropic.messages` that adds cache breakpoints and records the full usage
+    (including cache reads and writes) in the token ledger and the current tracing span.
+    Turns with a streaming target on this thread are streamed instead. Calls are retried on rate
+    limits and transient errors (resilience.with_retries); a stream only until its first text arrived.
+    """
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, **params):
+        on_token = getattr(_stream_target, "on_token", None)
+        request = with_cache_breakpoints(params)
+        if on_token is not None:
+            guard = OutputGuard(on_token)
+            response = with_retries("anthropic", params.get("model"),
+                                    lambda: stream_anthropic(self._client, guard, **request), guard)
+        else:
+            response = with_retries("anthropic", params.get("model"), lambda: self._client.messages.create(**request))
+        span = tracer.current()
+        ledger.record(span.stage if span is not None else "autogen", params.get("model"), response.usage,
+                      **tracer.context_attrs())
+        tracer.record_usage(response.usage)
+        return response
+
+
+class _CachingAnthropic:
+    def __init__(self, client):
+        self.messages = _CachingMessages(client)
+
+
+class PromptCachingAnthropicClient(AnthropicClient):
+    """
+    autogen model client for Claude that uses Anthropic prompt caching (see with_cache_breakpoints).
+    Selected through "model_client_cls" in the config list and registered on every agent.
+    """
+    def __init__(self, config, **kwargs):
+        super().__init__(api_key=config.get("api_key"))
+        # retries go through resilience.with_retries, not the SDK's own
+        self._client = _CachingAnthropic(self._client.with_options(max_retries=0))
 
 class ClaudeChat:
-    def __init__(self, cache_seed, custom_guideline_summaries=None):
+    def __init__(self, cache_seed, custom_guideline_summaries=None, use_router=False,
+                 speaker_mode="groupchat", max_revisions=1):
+        if speaker_mode not in SPEAKER_MODES:
+            raise ValueError(f"Unknown speaker mode: {speaker_mode} (expected one of {', '.join(SPEAKER_MODES)})")
+        self.speaker_mode = speaker_mode
+        self.max_revisions = max_revisions
+        self.revisions = 0
+        self.tool_error = None
 
         os.environ["ANTHROPIC_API_KEY"] = ANTHROPIC_API_KEY
 
@@ -30,7 +121,7 @@ class ClaudeChat:
                 # "model": "claude-3-5-sonnet-20241022",
                 "model": "claude-3-7-sonnet-20250219",
                 "api_key": os.getenv("ANTHROPIC_API_KEY"),
-                "api_type": "anthropic",
+                "model_client_cls": "PromptCachingAnthropicClient",
             }
         ]
 
@@ -53,7 +144,8 @@ class ClaudeChat:
             system_message=
             f'''
             You are a coordinator who can help the user find the correct corresponding ASCO guidelines.
-            You have access to a dictionary whose keys are the guideline numbers and values are descriptions of the guidelines: {guidelines_to_use}
+            You have access to a catalog of guidelines, one per line as "key: description":
+{format_guideline_catalog(guidelines_to_use)}
             Based on the user's prompt, you will determine which ASCO guideline to use, 
             and then return the key as a string (e.g. breast_cancer_8) and the user prompt, and ask pdf_viewer to retrieve information from the pdf.
             If none of the ASCO guidelines are relevant, return "none" and ask User_proxy to terminate.
@@ -94,9 +186,19 @@ class ClaudeChat:
             llm_config=llm_config,
         )
 
-        # Register the Claude PDF processing tool
+        # Route confidently-matched questions locally instead of asking the coordinator LLM
+        self.router = GuidelineRouter(guidelines_to_use) if use_router else None
+        self.routed = None
+        if self.router is not None:
+            self.coordinator.register_reply([autogen.Agent, None], self._routed_reply, position=0)
+
+        # Register the Claude PDF processing tool; autogen tags the function it registers, so it gets
+        # a plain function rather than the bound method
+        def pdf_tool(key: str, prompt: str) -> str:
+            return self._process_pdf(key, prompt)
+
         register_function(
-            process_pdf, 
+            pdf_tool,
             caller=self.coordinator,
             executor=self.pdf_viewer,
             name="process_pdf", 
@@ -108,17 +210,246 @@ class ClaudeChat:
             self.pdf_viewer: [self.reviewer],
         }
 
-        self.groupchat = autogen.GroupChat(
-            agents=[self.user_proxy, self.coordinator, self.pdf_viewer, self.reviewer], 
-            allowed_or_disallowed_speaker_transitions=self.allowed_transitions,
-            speaker_transitions_type="allowed",
-            messages=[],
-            max_round=6,
-        )
-        self.manager = autogen.GroupChatManager(groupchat=self.groupchat, llm_config=llm_config)
+        if speaker_mode == "state_machine":
+            self.groupchat = autogen.GroupChat(
+                agents=[self.user_proxy, self.coordinator, self.pdf_viewer, self.reviewer],
+                speaker_selection_method=self._next_speaker,
+                messages=[],
+                # the question, then coordinator -> pdf_viewer -> reviewer once plus once per revision
+                max_round=1 + 3 * (1 + max_revisions),
+            )
+            # the manager only relays messages; it never selects a speaker with an LLM
+            self.manager = autogen.GroupChatManager(groupchat=self.groupchat, llm_config=False)
+            llm_agents = (self.coordinator, self.pdf_viewer, self.reviewer)
+        else:
+            self.groupchat = autogen.GroupChat(
+                agents=[self.user_proxy, self.coordinator, self.pdf_viewer, self.reviewer], 
+                allowed_or_disallowed_speaker_transitions=self.allowed_transitions,
+                speaker_transitions_type="allowed",
+                messages=[],
+                max_round=6,
+                # speaker selection runs on an internal agent, which needs the custom client registered too
+                select_speaker_auto_llm_config=llm_config,
+                select_speaker_auto_model_client_cls=PromptCachingAnthropicClient,
+            )
+            self.manager = autogen.GroupChatManager(groupchat=self.groupchat, llm_config=llm_config)
+            llm_agents = (self.coordinator, self.pdf_viewer, self.reviewer, self.manager)
+        for agent in llm_agents:
+            agent.register_model_client(model_client_cls=PromptCachingAnthropicClient)
+
+        # Stream the reviewer's answer when chat() is given an on_token callback
+        self.on_token = None
+        self.reviewer.generate_reply = self._streamed_reply(self.reviewer.generate_reply)
+
+        # Time every agent turn and every speaker selection as tracing spans
+        for agent in (self.user_proxy, self.coordinator, self.pdf_viewer, self.reviewer):
+            agent.generate_reply = self._traced_reply(agent, config_list_claude[0]["model"])
+        self.groupchat.select_speaker = tracer.traced("speaker_selection", self.groupchat.select_speaker)
+
+    def _process_pdf(self, key: str, prompt: str) -> str:
+        """
+        process_pdf as the agents' tool. autogen hands a tool's exception to the agents as an "Error: ..."
+        message, so it is also kept here and chat() raises it once the conversation is over.
+        """
+        try:
+            return process_pdf(key, prompt)
+        except Exception as e:
+            self.tool_error = e
+            raise
 
-    def chat(self, message):
-        return self.user_proxy.initiate_chat(self.manager, message=message)
+    def _streamed_reply(self, generate_reply):
+        """
+        Wrap the reviewer's generate_reply so its LLM response is streamed to self.on_token. A reply that
+        did not stream (e.g. answered from the autogen cache) is delivered in one piece.
+        """
+        def streamed_generate_reply(*args, **kwargs):
+            if self.on_token is None:
+                return generate_reply(*args, **kwargs)
+            delivered = []
+
+            def on_token(text):
+                delivered.append(text)
+                self.on_token(text)
+
+            _stream_target.on_token = on_token
+            try:
+                reply = generate_reply(*args, **kwargs)
+            finally:
+                _stream_target.on_token = None
+            content = reply.get("content") if isinstance(reply, dict) else reply
+            if not delivered and content:
+                self.on_token(content)
+            return reply
+
+        return streamed_generate_reply
+
+    @staticmethod
+    def _traced_reply(agent, model):
+        """
+        Wrap an agent's generate_reply in a "turn:<agent>" span; its LLM client adds the token usage.
+        """
+        return tracer.traced(f"turn:{agent.name}", agent.generate_reply,
+                             agent=agent.name, model=model if agent.llm_config else None)
+
+    def _next_speaker(self, last_speaker, groupchat):
+        """
+        State-machine speaker selection: user_proxy -> coordinator -> pdf_viewer -> reviewer, decided in
+        code from the last message. The only branches are the ones the agents' own replies encode:
+        - the coordinator ends the conversation when it calls no tool (no relevant guideline)
+        - a failed process_pdf call ends it, as chat() will raise the error
+        - the reviewer ends it with TERMINATE, or otherwise sends the question back to the coordinator
+          (which holds the process_pdf tool) for a new retrieval, at most `max_revisions` times
+        Returning None ends the conversation.
+        """
+        message = groupchat.messages[-1] if groupchat.messages else {}
+        if self.tool_error is not None:
+            return None
+        if last_speaker is self.user_proxy:
+            return self.coordinator
+        if last_speaker is self.coordinator:
+            return self.pdf_viewer if message.get("tool_calls") else None
+        if last_speaker is self.pdf_viewer:
+            return self.reviewer
+        if last_speaker is self.reviewer:
+            content = (message.get("content") or "").rstrip()
+            if content.endswith("TERMINATE") or self.revisions >= self.max_revisions:
+                return None
+            self.revisions += 1
+            span = tracer.current()
+            if span is not None:
+                span.set(revision=self.revisions)
+            return self.coordinator
+        return None
+
+    def _routed_reply(self, recipient, messages=None, sender=None, config=None):
+        """
+        Coordinator reply that calls process_pdf directly when the local router is confident.
+        Falls through to the coordinator LLM otherwise, and on any later coordinator turn.
+        """
+        if not messages or self.routed is not None or any(msg.get("tool_calls") for msg in messages):
+            return False, None
+
+        question = messages[0].get("content", "")
+        ranked = self.router.route(question)
+        if not self.router.is_confident(ranked):
+            self.routed = False
+            return False, None
+
+        key, score = ranked[0]
+        self.routed = key
+        span = tracer.current()
+        if span is not None:
+            span.set(routed=key)
+        arguments = {"key": key, "prompt": f"{question} must also include the exact context of each point."}
+        return True, {
+            "role": "assistant",
+            "content": f"guideline_key: {key} (local router score {score:.2f})",
+            "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex}",
+                "type": "function",
+                "function": {"name": "process_pdf", "arguments": json.dumps(arguments)},
+            }],
+        }
+
+    def reset(self):
+        """
+        Clear all conversation state so the instance can be reused for another question.
+        """
+        self.groupchat.reset()
+        for agent in (self.user_proxy, self.coordinator, self.pdf_viewer, self.reviewer, self.manager):
+            agent.reset()
+        self.routed = None
+        self.revisions = 0
+        self.tool_error = None
+
+    def chat(self, message, on_token=None):
+        """
+        Run one conversation. With `on_token`, the reviewer's answer is passed to it piece by piece as it
+        is generated. Raises the error of a process_pdf call that failed after its retries.
+        """
+        self.reset()
+        self.on_token = on_token
+        try:
+            with tracer.span("conversation", speaker_mode=self.speaker_mode):
+                result = self.user_proxy.initiate_chat(self.manager, message=message)
+                if self.tool_error is not None:
+                    raise self.tool_error
+                return result
+        finally:
+            self.on_token = None
+
+    def stream(self, message):
+        """
+        Run one conversation and iterate over the reviewer's answer as it is generated;
+        the ChatResult is available as `.result` once the iterator is exhausted.
+        """
+        return TokenStream(lambda on_token: self.chat(message, on_token=on_token))
+
+
+class ClaudeChatPool:
+    """
+    Pool of pre-built, resettable ClaudeChat instances.
+    Each concurrent worker checks out its own instance, and instances are kept per guideline
+    summary set, so custom sets such as the leave-one-out masks are only built once.
+    """
+    def __init__(self, cache_seed, use_router=False, speaker_mode="groupchat"):
+        self.cache_seed = cache_seed
+        self.use_router = use_router
+        self.speaker_mode = speaker_mode
+        self.idle = {}
+        self.created = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def summaries_key(custom_guideline_summaries):
+        if custom_guideline_summaries is None:
+            return None
+        return tuple(sorted(custom_guideline_summaries.items()))
+
+    @contextmanager
+    def checkout(self, custom_guideline_summaries=None):
+        """
+        Borrow a ClaudeChat for one conversation; it is reset and returned to the pool afterwards.
+        """
+        key = self.summaries_key(custom_guideline_summaries)
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            claude_chat = idle.pop() if idle else None
+            if claude_chat is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if claude_chat is None:
+            claude_chat = ClaudeChat(
+                cache_seed=self.cache_seed,
+                custom_guideline_summaries=custom_guideline_summaries,
+                use_router=self.use_router,
+                speaker_mode=self.speaker_mode
+            )
+        try:
+            yield claude_chat
+        finally:
+            claude_chat.reset()
+            with self.lock:
+                self.idle[key].append(claude_chat)
+
+    def prebuild(self, count, custom_guideline_summaries=None):
+        """
+        Build `count` instances up front, e.g. one per concurrent worker.
+        """
+        chats = [
+            ClaudeChat(
+                cache_seed=self.cache_seed,
+                custom_guideline_summaries=custom_guideline_summaries,
+                use_router=self.use_router,
+                speaker_mode=self.speaker_mode
+            )
+            for _ in range(count)
+        ]
+        with self.lock:
+            self.idle.setdefault(self.summaries_key(custom_guideline_summaries), []).extend(chats)
+            self.created += count
 
 # Usage:
 # claude_chat = ClaudeChat()
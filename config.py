@@ -8,4 +8,39 @@ load_dotenv()
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY') 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-AZURE_API_KEY = os.getenv('AZURE_API_KEY')
\ No newline at end of file
+AZURE_API_KEY = os.getenv('AZURE_API_KEY')
+
+# Opt-in: make an extra count_tokens call per process_pdf request for exact pre-counting
+COUNT_PDF_TOKENS = os.getenv('COUNT_PDF_TOKENS', '').lower() in ('1', 'true', 'yes')
+
+# Send process_pdf only the guideline pages relevant to the prompt (falls back to the full PDF on weak matches)
+PDF_PAGE_SLICING = os.getenv('PDF_PAGE_SLICING', '1').lower() in ('1', 'true', 'yes')
+
+# Shared on-disk cache for the judge and baseline LLM calls
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE', '1').lower() in ('1', 'true', 'yes')
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join('cache', 'llm_cache.sqlite'))
+LLM_CACHE_MAX_MB = int(os.getenv('LLM_CACHE_MAX_MB', '512'))
+
+# Content-addressed store of chunk embeddings shared by the RAG and PDF viewer indices; the benchmarks
+# point it at their temporary folder so stand-in vectors never reach the real store
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join('index_cache', 'embeddings.sqlite'))
+
+# Shared store of extracted guideline text (text_store.py); the benchmarks point it at their temporary
+# folder so their PDFs are never written into, or collected from, the real store
+TEXT_STORE_DIR = os.getenv('TEXT_STORE_DIR', os.path.join('index_cache', 'text'))
+
+# Guideline PDFs read by process_pdf
+PDF_FOLDER = os.getenv('PDF_FOLDER', 'pdfs')
+
+# Endpoint overrides, e.g. for the offline stand-in (llm_standin.py). OpenAI and Anthropic read
+# OPENAI_BASE_URL / ANTHROPIC_BASE_URL directly.
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL')
+AZURE_INFERENCE_ENDPOINT = os.getenv('AZURE_INFERENCE_ENDPOINT', 'https://aistudioaiservices636633355478.services.ai.azure.com/models')
+
+# Retries of rate-limited or failed provider calls (resilience.py), and the adaptive concurrency
+# limit per provider and model: it starts at LLM_CONCURRENCY_INITIAL and moves within [1, LLM_CONCURRENCY_MAX]
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '6'))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '1.0'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '60'))
+LLM_CONCURRENCY_INITIAL = int(os.getenv('LLM_CONCURRENCY_INITIAL', '4'))
+LLM_CONCURRENCY_MAX = int(os.getenv('LLM_CONCURRENCY_MAX', '32'))
@@ -0,0 +1,268 @@
+"""
+Download Benchmark
+Runs downloader.py against a local stand-in file server, so no request leaves the machine. It first checks
+the failure handling on three kinds of URL (a valid PDF, a response cut off before its Content-Length and
+an HTML page that needs the browser fallback), then downloads --files PDFs with each --workers setting
+and reports the wall time, files per second and how many connections the pooled client opened.
+
+    python download_bench.py --files 40 --workers 1,4,8 --latency_ms 200 --kb 500
+
+Stand-in paths (any file name):
+- /pdf/<name>.pdf: a text PDF of about --kb KB
+- /truncated/<name>.pdf: the same PDF with a Content-Length 1 KB larger than the body, then the connection closes
+- /html/<name>.pdf: a text/html page, as served by a login or bot-check wall
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import httpx
+from downloader import ChecksumManifest, NeedsBrowser, download_guideline, download_guidelines, file_digest
+from throughput_bench import write_text_pdf
+
+HTML_PAGE = b"<html><head><title>Sign in</title></head><body>Please sign in to continue.</body></html>"
+
+
+class FileStandIn:
+    """
+    Threaded HTTP/1.1 file server with keep-alive, serving one PDF under the paths listed above.
+
+    Args:
+        pdf_bytes (bytes): Body of every /pdf/ and /truncated/ response
+        port (int): Port to listen on, 0 for any free port
+        latency_ms (float): Delay before each response
+        chunk_bytes (int): Size of the blocks the body is written in
+    """
+
+    def __init__(self, pdf_bytes, port=0, latency_ms=0.0, chunk_bytes=64 * 1024):
+        self.pdf_bytes = pdf_bytes
+        self.latency_ms = latency_ms
+        self.chunk_bytes = chunk_bytes
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def stats(self, reset=False) -> dict:
+        with self.lock:
+            counts = dict(self.counts)
+            if reset:
+                self.counts = {}
+        return counts
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                server._count('connections')
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, request):
+        kind = urlsplit(request.path).path.strip('/').split('/')[0]
+        self._count(kind)
+        time.sleep(self.latency_ms / 1000)
+        if kind == 'pdf':
+            self._send(request, self.pdf_bytes, 'application/pdf', len(self.pdf_bytes))
+        elif kind == 'truncated':
+            self._send(request, self.pdf_bytes, 'application/pdf', len(self.pdf_bytes) + 1024)
+            # the promised bytes never come, so the client sees the connection close mid-body
+            request.close_connection = True
+        elif kind == 'html':
+            self._send(request, HTML_PAGE, 'text/html; charset=utf-8', len(HTML_PAGE))
+        else:
+            message = f"Unknown stand-in path: {request.path}".encode('utf-8')
+            self._send(request, message, 'text/plain', len(message), status=404)
+
+    def _send(self, request, data, content_type, content_length, status=200):
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(content_length))
+        request.end_headers()
+        for start in range(0, len(data), self.chunk_bytes):
+            request.wfile.write(data[start:start + self.chunk_bytes])
+
+
+def synthetic_pdf(kb) -> bytes:
+    """
+    A text PDF of roughly `kb` kilobytes.
+    """
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    os.close(fd)
+    try:
+        write_text_pdf(path, 'Stand-in guideline', 'recommendation ' * max(1, int(kb * 1024 / 16)))
+        with open(path, 'rb') as file:
+            return file.read()
+    finally:
+        os.remove(path)
+
+
+def check_cases(server):
+    """
+    Run download_guideline once per kind of URL and compare the outcome with the expected one.
+
+    Returns:
+        list: (case, passed, detail) per check
+    """
+    checks = []
+    expected_digest = (len(server.pdf_bytes), hashlib.sha256(server.pdf_bytes).hexdigest())
+    with tempfile.TemporaryDirectory(prefix='download_check_') as folder, \
+            httpx.Client(timeout=30, follow_redirects=True) as client:
+        manifest = ChecksumManifest(folder)
+
+        def leftovers():
+            return sorted(os.path.basename(path) for path in glob.glob(os.path.join(folder, '*.part')))
+
+        status = download_guideline(client, manifest, 'valid', f"{server.url}/pdf/valid.pdf", folder, use_browser_fallback=False)
+        path = os.path.join(folder, 'valid.pdf')
+        passed = status == 'downloaded' and file_digest(path) == expected_digest \
+            and manifest.get('valid.pdf') == {'size': expected_digest[0], 'sha256': expected_digest[1]}
+        checks.append(('pdf', passed, f"status {status}, checksum recorded"))
+
+        status = download_guideline(client, manifest, 'valid', f"{server.url}/pdf/valid.pdf", folder, use_browser_fallback=False)
+        checks.append(('pdf cached', status == 'cached', f"status {status}"))
+
+        with open(path, 'r+b') as file:
+            file.seek(len(server.pdf_bytes) // 2)
+            file.write(b'corrupted')
+        status = download_guideline(client, manifest, 'valid', f"{server.url}/pdf/valid.pdf", folder, use_browser_fallback=False)
+        checks.append(('pdf corrupted', status == 'downloaded' and file_digest(path) == expected_digest,
+                       f"status {status}, checksum mismatch detected"))
+
+        for case, kind, expected_error in (('truncated', 'truncated', (IOError, httpx.TransportError)),
+                                           ('non-PDF', 'html', NeedsBrowser)):
+            try:
+                status = download_guideline(client, manifest, kind, f"{server.url}/{kind}/{kind}.pdf", folder,
+                                            use_browser_fallback=False)
+                passed, detail = False, f"status {status}, expected an error"
+            except expected_error as e:
+                passed, detail = True, f"{type(e).__name__}: {e}"
+            except Exception as e:
+                passed, detail = False, f"unexpected {type(e).__name__}: {e}"
+            left = leftovers()
+            if os.path.exists(os.path.join(folder, f'{kind}.pdf')) or left or manifest.get(f'{kind}.pdf'):
+                passed, detail = False, f"{detail}; left files behind: {left or kind + '.pdf'}"
+            checks.append((case, passed, detail))
+    return checks
+
+
+def run_downloads(server, files, workers):
+    """
+    Download `files` PDFs into a fresh folder with `workers` concurrent connections, then once more
+    to check that every file is found cached.
+    """
+    urls = {f'guideline_{i:03d}': f"{server.url}/pdf/guideline_{i:03d}.pdf" for i in range(files)}
+    with tempfile.TemporaryDirectory(prefix='download_bench_') as folder:
+        server.stats(reset=True)
+        start = time.perf_counter()
+        statuses = download_guidelines(urls, folder, max_workers=workers, use_browser_fallback=False)
+        wall_time = time.perf_counter() - start
+        counts = server.stats(reset=True)
+        cached = download_guidelines(urls, folder, max_workers=workers, use_browser_fallback=False)
+        rerun_requests = server.stats(reset=True).get('pdf', 0)
+    downloaded = sum(status == 'downloaded' for status in statuses.values())
+    return {
+        'workers': workers,
+        'files': files,
+        'downloaded': downloaded,
+        'errors': sum(status.startswith('error') for status in statuses.values()),
+        'wall_s': round(wall_time, 3),
+        'files_per_s': round(downloaded / wall_time, 2) if wall_time else 0.0,
+        'mb_per_s': round(downloaded * len(server.pdf_bytes) / 1024 / 1024 / wall_time, 2) if wall_time else 0.0,
+        'requests': counts.get('pdf', 0),
+        'connections': counts.get('connections', 0),
+        'rerun_cached': sum(status == 'cached' for status in cached.values()),
+        'rerun_requests': rerun_requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark the guideline downloader against a local stand-in server')
+    parser.add_argument('--files', type=int, default=40, help='PDFs per download run (default: 40)')
+    parser.add_argument('--workers', type=str, default='1,4,8', help='Comma-separated concurrency settings (default: 1,4,8)')
+    parser.add_argument('--latency_ms', type=float, default=200.0, help='Delay before each response in ms (default: 200)')
+    parser.add_argument('--kb', type=float, default=500.0, help='Approximate size of the served PDF in KB (default: 500)')
+    parser.add_argument('--port', type=int, default=0, help='Port for the stand-in (default: any free port)')
+    parser.add_argument('--output', type=str, default=None, help='JSON report path (default: results/download_<timestamp>.json)')
+    args = parser.parse_args()
+
+    worker_counts = [int(w) for w in args.workers.split(',') if w.strip()]
+    with FileStandIn(synthetic_pdf(args.kb), port=args.port, latency_ms=args.latency_ms) as server:
+        print(f"File stand-in at {server.url} ({len(server.pdf_bytes) / 1024:.0f} KB PDF, {args.latency_ms:g} ms latency)")
+        checks = check_cases(server)
+        runs = []
+        for workers in worker_counts:
+            print(f"Downloading {args.files} PDFs with {workers} workers...")
+            runs.append(run_downloads(server, args.files, workers))
+
+    print(f"\n{'case':<16}{'result':<8}detail")
+    print("-" * 79)
+    for case, passed, detail in checks:
+        print(f"{case:<16}{'ok' if passed else 'FAILED':<8}{detail}")
+
+    print(f"\n{'workers':>8}{'done':>6}{'errors':>8}{'wall (s)':>10}{'files/s':>9}{'MB/s':>8}{'connections':>13}{'rerun cached':>14}")
+    print("-" * 76)
+    for run in runs:
+        print(f"{run['workers']:>8}{run['downloaded']:>6}{run['errors']:>8}{run['wall_s']:>10.2f}{run['files_per_s']:>9.1f}"
+              f"{run['mb_per_s']:>8.1f}{run['connections']:>13}{run['rerun_cached']:>14}")
+
+    output = args.output or f"results/download_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'args': vars(args), 'pdf_bytes': len(server.pdf_bytes),
+                   'checks': [{'case': case, 'passed': passed, 'detail': detail} for case, passed, detail in checks],
+                   'runs': runs}, file, indent=2)
+    print(f"Report saved to {output}")
+
+    failed = [case for case, passed, _ in checks if not passed]
+    failed += [f"{run['workers']} workers" for run in runs
+               if run['errors'] or run['rerun_cached'] != run['files'] or run['rerun_requests']]
+    if failed:
+        raise SystemExit(f"Failed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Guideline Downloader
+Downloads guideline PDFs concurrently over a pooled keep-alive HTTP client. Each file is streamed to a
+temporary file, checked (Content-Length, PDF header, optional SHA-256) and atomically renamed into place.
+URLs that only serve a PDF to a real browser fall back to Selenium, one isolated download directory per file.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
+
+CHECKSUM_FILE = 'checksums.json'
+PDF_MAGIC = b'%PDF-'
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'
+
+
+class NeedsBrowser(Exception):
+    """
+    The URL answered, but not with a PDF (e.g. a login or bot-check page).
+    """
+
+
+class ChecksumManifest:
+    """
+    Thread-safe record of the size and SHA-256 of every downloaded PDF, stored in pdfs/checksums.json.
+    """
+
+    def __init__(self, pdf_folder):
+        self.path = os.path.join(pdf_folder, CHECKSUM_FILE)
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.entries = json.load(file)
+
+    def get(self, filename):
+        with self.lock:
+            return self.entries.get(filename)
+
+    def set(self, filename, size, sha256):
+        with self.lock:
+            self.entries[filename] = {'size': size, 'sha256': sha256}
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(self.entries, file, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def file_digest(path):
+    """
+    Size and SHA-256 of a file on disk.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+            size += len(block)
+    return size, digest.hexdigest()
+
+
+def is_valid_pdf(path, expected=None):
+    """
+    True if `path` starts with a PDF header and matches the expected size and hash, when given.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, 'rb') as file:
+        if not file.read(len(PDF_MAGIC)) == PDF_MAGIC:
+            return False
+    if expected is None:
+        return True
+    return file_digest(path) == (expected['size'], expected['sha256'])
+
+
+def http_download(client, url, dest_path):
+    """
+    Stream `url` into a temporary file next to `dest_path`, verify it and rename it into place.
+
+    Returns:
+        tuple: (size, sha256) of the downloaded file
+    """
+    folder = os.path.dirname(dest_path) or '.'
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as file, client.stream('GET', url) as response:
+            if response.status_code in (401, 403) or response.status_code >= 500:
+                raise NeedsBrowser(f"HTTP {response.status_code} for {url}")
+            response.raise_for_status()
+            head = b''
+            for block in response.iter_bytes():
+                if len(head) < len(PDF_MAGIC):
+                    head += block[:len(PDF_MAGIC)]
+                    if len(head) >= len(PDF_MAGIC) and not head.startswith(PDF_MAGIC):
+                        raise NeedsBrowser(f"{url} returned {response.headers.get('content-type', 'non-PDF content')}")
+                file.write(block)
+                digest.update(block)
+                size += len(block)
+            expected_length = response.headers.get('content-length')
+            # Content-Length describes the encoded body, so only compare it for unencoded responses
+            if expected_length is not None and 'content-encoding' not in response.headers and int(expected_length) != size:
+                raise IOError(f"Incomplete download of {url}: {size} of {expected_length} bytes")
+        if size < len(PDF_MAGIC):
+            raise NeedsBrowser(f"{url} returned an empty or truncated body")
+        os.replace(tmp_path, dest_path)
+        return size, digest.hexdigest()
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def browser_download(url, dest_path, timeout=120):
+    """
+    Selenium fallback: download into a private directory, wait until Chrome has finished
+    writing the file, verify it and rename it into place.
+    """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    folder = os.path.dirname(dest_path) or '.'
+    download_dir = tempfile.mkdtemp(dir=folder, prefix='.browser_')
+    chrome_options = Options()
+    chrome_options.add_experimental_option("prefs", {
+        "download.default_directory": os.path.abspath(download_dir),
+        "download.prompt_for_download": False,
+        "plugins.always_open_pdf_externally": True
+    })
+    driver = webdriver.Chrome(options=chrome_options)
+    try:
+        driver.get(url)
+        deadline = time.monotonic() + timeout
+        downloaded = None
+        last_size = -1
+        while time.monotonic() < deadline:
+            files = [f for f in os.listdir(download_dir) if not f.endswith('.crdownload')]
+            in_progress = [f for f in os.listdir(download_dir) if f.endswith('.crdownload')]
+            if files and not in_progress:
+                candidate = os.path.join(download_dir, files[0])
+                size = os.path.getsize(candidate)
+                # finished once the file exists without a partial marker and stops growing
+                if size > 0 and size == last_size:
+                    downloaded = candidate
+                    break
+                last_size = size
+            time.sleep(0.5)
+        if downloaded is None:
+            raise TimeoutError(f"Browser download of {url} did not finish within {timeout} s")
+        if not is_valid_pdf(downloaded):
+            raise IOError(f"Browser download of {url} is not a PDF")
+        size, sha256 = file_digest(downloaded)
+        os.replace(downloaded, dest_path)
+        return size, sha256
+    finally:
+        driver.quit()
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+
+def download_guideline(client, manifest, key, url, pdf_folder='pdfs', use_browser_fallback=True):
+    """
+    Make sure pdfs/<key>.pdf exists and is valid, downloading it if needed.
+
+    Returns:
+        str: 'cached', 'downloaded' or 'browser'
+    """
+    filename = f'{key}.pdf'
+    dest_path = os.path.join(pdf_folder, filename)
+    expected = manifest.get(filename)
+    if is_valid_pdf(dest_path, expected):
+        if expected is None:
+            manifest.set(filename, *file_digest(dest_path))
+        return 'cached'
+
+    try:
+        size, sha256 = http_download(client, url, dest_path)
+        status = 'downloaded'
+    except NeedsBrowser as e:
+        if not use_browser_fallback:
+            raise
+        print(f"{key}: {e}; falling back to browser download")
+        size, sha256 = browser_download(url, dest_path)
+        status = 'browser'
+    manifest.set(filename, size, sha256)
+    return status
+
+
+def download_guidelines(guideline_urls, pdf_folder='pdfs', max_workers=4, timeout=60, use_browser_fallback=True):
+    """
+    Download all guideline PDFs concurrently.
+
+    Args:
+        guideline_urls (dict): Guideline key -> URL, or key -> [year, URL] as in data/asco_guidelines.py
+        pdf_folder (str): Destination directory
+        max_workers (int): Concurrent downloads (and pooled connections)
+        timeout (float): Per-request timeout in seconds
+        use_browser_fallback (bool): Retry URLs that do not serve a PDF with Selenium
+
+    Returns:
+        dict: Guideline key -> status ('cached', 'downloaded', 'browser' or 'error: ...')
+    """
+    os.makedirs(pdf_folder, exist_ok=True)
+    manifest = ChecksumManifest(pdf_folder)
+    urls = {key: value[1] if isinstance(value, (list, tuple)) else value for key, value in guideline_urls.items()}
+
+    limits = httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers)
+    statuses = {}
+    with httpx.Client(limits=limits, timeout=timeout, follow_redirects=True,
+                      headers={'User-Agent': USER_AGENT, 'Accept': 'application/pdf'}) as client:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(download_guideline, client, manifest, key, url, pdf_folder, use_browser_fallback): key
+                for key, url in urls.items()
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    statuses[key] = future.result()
+                except Exception as e:
+                    statuses[key] = f'error: {e}'
+                if statuses[key] != 'cached':
+                    print(f"{key}: {statuses[key]}")
+
+    counts = {}
+    for status in statuses.values():
+        counts[status.split(':')[0]] = counts.get(status.split(':')[0], 0) + 1
+    print(f"Guideline PDFs: {', '.join(f'{count} {status}' for status, count in sorted(counts.items()))}")
+    return statuses
@@ -1,40 +1,57 @@
 import pandas as pd
-from openai import OpenAI
 import os
-from config import OPENAI_API_KEY
+from config import OPENAI_API_KEY, PDF_PAGE_SLICING
+from llm_cache import print_llm_cache_stats
+from resilience import print_retry_stats
+from batch_judge import judge_single
+from results_sink import ResultSink, result_paths
+from scheduler import ORDERS, describe_groups, guideline_groups, run_grouped
+from token_ledger import ledger
+from tracing import default_trace_path, tracer
 import re
 from datetime import datetime
-from claude_autogen import ClaudeChat
 import argparse
+import threading
 
 class AnswerEvaluator:
-    def __init__(self, cache_seed):
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+    def __init__(self, cache_seed, use_router=False, speaker_mode="groupchat"):
+        self._client = None
+        self._chat_pool = None
+        self._chat_pool_lock = threading.Lock()
         self.qa_df = pd.read_csv('data/q_a.csv')
         self.cache_seed = cache_seed
+        self.use_router = use_router
+        self.speaker_mode = speaker_mode
+
+    @property
+    def client(self):
+        """
+        OpenAI judge client, created on first use so importing this module stays cheap
+        """
+        if self._client is None:
+            from openai import OpenAI
+            # retries go through resilience.with_retries
+            self._client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        return self._client
+
+    @property
+    def chat_pool(self):
+        """
+        Pool of reusable ClaudeChat instances, created on first use
+        """
+        with self._chat_pool_lock:
+            if self._chat_pool is None:
+                # Import here so the autogen stack is only loaded when a chat actually runs
+                from claude_autogen import ClaudeChatPool
+                self._chat_pool = ClaudeChatPool(cache_seed=self.cache_seed, use_router=self.use_router,
+                                                 speaker_mode=self.speaker_mode)
+            return self._chat_pool
 
     def evaluate_single_answer(self, question, generated_answer, expected_answer):
         """
         Send the comparison task to GPT-4o to evaluate if the answers match in meaning
         """
-        prompt = f"""
-        Compare these two answers to the question: "{question}"
-        
-        Generated answer: {generated_answer}
-        Expected answer: {expected_answer}
-        
-        Does the generated answer contain the same key information as the expected answer? 
-        Respond with only 'YES' or 'NO'.
-        """
-        
-        response = self.client.chat.completions.create(
-            model="gpt-4o-2024-11-20",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0
-        )
-        
-        # Extract just the text from the response
-        return response.choices[0].message.content
+        return judge_single(self.client, question, generated_answer, expected_answer)
     
     def extract_guideline_from_chat(self, chat_messages):
         """
@@ -49,76 +66,219 @@ class AnswerEvaluator:
                     return match.group(0)
         return None
 
-    def run_evaluation(self, start_idx=0, end_idx=5):
+    def question_groups(self, indices, order="row"):
         """
-        Run evaluation on a range of questions from start_idx to end_idx
-        
+        Question indices grouped by guideline for scheduling (see scheduler.guideline_groups)
+        """
+        return prepare_groups(guideline_groups(self.qa_df, indices, order), order)
+
+    def evaluate_question(self, row):
+        """
+        Run the multi-agent chat for a single question row and judge the answer
+
         Args:
-            start_idx (int): Starting index of questions (inclusive)
-            end_idx (int): Ending index of questions (exclusive)
+            row (pd.Series): Row from the QA dataframe with Question, Answer and Guideline
+
+        Returns:
+            dict: Evaluation result for the question
         """
-        results = []
-        
-        # Get specific range of questions
-        selected_qa = self.qa_df.iloc[start_idx:end_idx]
-        
-        for _, row in selected_qa.iterrows():
-            question = row['Question']
-            expected_answer = row['Answer']
-            expected_guideline = row['Guideline']
-            
+        question = row['Question']
+        expected_answer = row['Answer']
+        expected_guideline = row['Guideline']
+
+        with tracer.context(question_index=int(row.name)), tracer.span("question"):
             print(f"\nEvaluating question: {question}")
-            
-            claude_chat = ClaudeChat(cache_seed=self.cache_seed)
-            chat_result = claude_chat.chat(question)
-            
+
+            with self.chat_pool.checkout() as claude_chat:
+                chat_result = claude_chat.chat(question)
+
             # Access the messages from the ChatResult object
             chat_messages = chat_result.chat_history
-            
+
             # Extract the generated answer and guideline
             generated_answer = None
             for msg in reversed(chat_messages):
                 if msg.get("name") == "reviewer":
                     generated_answer = msg.get("content")
                     break
-                    
+
             generated_guideline = self.extract_guideline_from_chat(chat_messages)
-            
+
             # Evaluate the answer
             if generated_answer:
                 evaluation = self.evaluate_single_answer(
-                    question, 
-                    generated_answer, 
+                    question,
+                    generated_answer,
                     expected_answer
                 )
             else:
                 evaluation = "NO - No answer generated"
+
+        return {
+            'question_index': int(row.name),
+            'question': question,
+            'expected_answer': expected_answer,
+            'generated_answer': generated_answer,
+            'expected_guideline': expected_guideline,
+            'generated_guideline': generated_guideline,
+            'guideline_match': expected_guideline == generated_guideline,
+            'answer_correct': evaluation
+        }
+
+    def run_evaluation(self, start_idx=0, end_idx=5, skip_indices=(), on_result=None, order="row"):
+        """
+        Run evaluation on a range of questions from start_idx to end_idx
+        
+        Args:
+            start_idx (int): Starting index of questions (inclusive)
+            end_idx (int): Ending index of questions (exclusive)
+            skip_indices (iterable): Question indices already evaluated (e.g. by a resumed run)
+            on_result (callable): Called as on_result(idx, result) as each question finishes
+            order (str): "row", or "expected"/"routed" to run questions grouped by guideline
+
+        Returns:
+            list: Results in question order
+        """
+        results = {}
+        
+        # Get specific range of questions
+        selected_qa = self.qa_df.iloc[start_idx:end_idx]
+        selected_qa = selected_qa[~selected_qa.index.isin(list(skip_indices))]
+        
+        for group in self.question_groups(selected_qa.index, order):
+            for idx in group:
+                try:
+                    result = self.evaluate_question(selected_qa.loc[idx])
+                except Exception as e:
+                    print(f"Error evaluating question {idx}: {str(e)}")
+                    result = error_result(selected_qa.loc[idx], e)
+                results[idx] = result
+                if on_result is not None:
+                    on_result(idx, result)
             
-            # Store results
-            results.append({
-                'question': question,
-                'expected_answer': expected_answer,
-                'generated_answer': generated_answer,
-                'expected_guideline': expected_guideline,
-                'generated_guideline': generated_guideline,
-                'guideline_match': expected_guideline == generated_guideline,
-                'answer_correct': evaluation
-            })
-            
-        return results
+        return [results[idx] for idx in selected_qa.index]
+
+    def run_evaluation_concurrent(self, start_idx=0, end_idx=5, max_workers=4, rate_limiter=None,
+                                  requests_per_question=1, tokens_per_question=0, skip_indices=(), on_result=None,
+                                  order="row"):
+        """
+        Run evaluation on a range of questions with several questions in flight at once
+
+        Args:
+            start_idx (int): Starting index of questions (inclusive)
+            end_idx (int): Ending index of questions (exclusive)
+            max_workers (int): Number of questions evaluated concurrently
+            rate_limiter (RateLimiter): Shared limiter acquired before each question starts
+            requests_per_question (int): Requests charged to the limiter per question
+            tokens_per_question (int): Estimated input tokens charged to the limiter per question; once the
+                question is done, the difference to its actual input tokens in the ledger is settled
+            skip_indices (iterable): Question indices already evaluated (e.g. by a resumed run)
+            on_result (callable): Called as on_result(idx, result) as each question finishes
+            order (str): "row", or "expected"/"routed" to run questions grouped by guideline; the first
+                question of a group warms the PDF cache before the rest of the group starts
+
+        Returns:
+            list: Results in question order
+        """
+        selected_qa = self.qa_df.iloc[start_idx:end_idx]
+        selected_qa = selected_qa[~selected_qa.index.isin(list(skip_indices))]
+        self.chat_pool.prebuild(min(max_workers, len(selected_qa)))
+
+        def worker(idx):
+            if rate_limiter is None:
+                return self.evaluate_question(selected_qa.loc[idx])
+            rate_limiter.acquire(requests=requests_per_question, tokens=tokens_per_question)
+            try:
+                return self.evaluate_question(selected_qa.loc[idx])
+            finally:
+                # a question over the estimate puts the bucket into debt, one under it gives tokens back
+                actual = ledger.rate_limited_input_tokens(question_index=int(idx))
+                rate_limiter.adjust_tokens(actual - tokens_per_question)
+
+        results = {}
+
+        def on_done(idx, future):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error evaluating question {idx}: {str(e)}")
+                result = error_result(selected_qa.loc[idx], e)
+            results[idx] = result
+            if on_result is not None:
+                on_result(idx, result)
+
+        run_grouped(self.question_groups(selected_qa.index, order), worker, max_workers, on_done)
+        return [results[idx] for idx in selected_qa.index]
+
+def prepare_groups(groups, order):
+    """
+    Announce a grouped schedule. Page slicing is set separately by the CLI drivers (configure_page_slicing).
+    """
+    if order != "row":
+        print(f"Scheduling by {order} guideline: {describe_groups(groups)}")
+    return groups
+
+def configure_page_slicing(order):
+    """
+    Set process_pdf's page slicing for a run from its --order, once, in the CLI drivers. Grouped orders
+    send whole guideline PDFs: only the full document carries a prompt-cache breakpoint, so page slices
+    would get nothing from running a group together. "row" keeps the PDF_PAGE_SLICING setting.
+    """
+    from utils import set_page_slicing
+    set_page_slicing(PDF_PAGE_SLICING and order == "row")
+    if PDF_PAGE_SLICING and order != "row":
+        print(f"Page slicing off for the {order} order, so each group reads the cached PDF")
+
+def error_result(row, error):
+    """
+    Result recording that a question failed, e.g. on an API error left after the retries.
+    """
+    return {
+        'question_index': int(row.name),
+        'question': row['Question'],
+        'expected_answer': row['Answer'],
+        'generated_answer': None,
+        'expected_guideline': row['Guideline'],
+        'generated_guideline': None,
+        'guideline_match': False,
+        'answer_correct': f"ERROR - {str(error)}"
+    }
+
+def is_error_result(result):
+    """
+    True for results recording a failed evaluation, which a resumed run should retry.
+    """
+    return str(result.get('answer_correct', '')).startswith('ERROR')
 
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Evaluate answers with specified index range')
     parser.add_argument('--start', type=int, default=1, help='Starting index for evaluation (inclusive)')
     parser.add_argument('--end', type=int, default=20, help='Ending index for evaluation (exclusive)')
+    parser.add_argument('--resume', type=str, default=None, help='Results file (.jsonl or .csv) of an interrupted run to continue')
+    parser.add_argument('--order', type=str, default='row', choices=ORDERS, help='Question order: row, or grouped by expected or routed guideline to reuse the PDF prompt cache (default: row)')
     args = parser.parse_args()
 
     # Create results directory if it doesn't exist
     os.makedirs('results', exist_ok=True)
     
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_path, sink_path = result_paths(f'results/evaluation_results_{timestamp}.csv', args.resume)
+    sink = ResultSink(sink_path)
+    done = {idx: r for idx, r in sink.completed().items() if not is_error_result(r)}
+    if done:
+        print(f"Resuming from {sink_path}: {len(done)} questions already evaluated")
+
+    configure_page_slicing(args.order)
     evaluator = AnswerEvaluator(cache_seed=42)
-    results = evaluator.run_evaluation(start_idx=args.start, end_idx=args.end)
+    evaluator.run_evaluation(
+        start_idx=args.start,
+        end_idx=args.end,
+        skip_indices=done.keys(),
+        on_result=lambda idx, result: sink.append(result),
+        order=args.order
+    )
+    results = [r for r in sink.records() if args.start <= r['question_index'] < args.end]
     
     # Print results
     for i, result in enumerate(results, 1):
@@ -133,8 +293,11 @@ def main():
 
     # save results to csv
     results_df = pd.DataFrame(results)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    results_df.to_csv(f'results/evaluation_results_{timestamp}.csv', index=False)
+    results_df.to_csv(csv_path, index=False)
+    print_llm_cache_stats()
+    print_retry_stats()
+    ledger.print_summary()
+    tracer.finish(default_trace_path())
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
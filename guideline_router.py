@@ -0,0 +1,99 @@
+"""
+Local Guideline Router
+Scores questions against the guideline summaries with BM25 and returns the best guideline keys.
+When the top key clearly beats the rest, ClaudeChat can skip the coordinator LLM turn.
+
+Benchmark against the Guideline column of the QA dataset:
+    python guideline_router.py --k 3 --margin 1.5
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+from bm25 import BM25Index
+from data.asco_guidelines import guideline_summaries
+
+# the top score must be at least this multiple of the runner-up to skip the coordinator
+DEFAULT_MARGIN = 1.5
+
+
+class GuidelineRouter:
+    """
+    BM25 router over guideline summaries.
+
+    Args:
+        summaries (dict): Guideline key -> summary, defaults to all ASCO guideline summaries
+        margin (float): Required ratio between the top and second score for a confident route
+    """
+
+    def __init__(self, summaries=None, margin=DEFAULT_MARGIN):
+        summaries = summaries if summaries is not None else guideline_summaries
+        self.keys = list(summaries.keys())
+        # the key itself names the disease site (e.g. "breast cancer"), which the summaries often omit
+        documents = [f"{key.rsplit('_', 1)[0].replace('_', ' ')} {summary}" for key, summary in summaries.items()]
+        self.bm25 = BM25Index(documents)
+        self.margin = margin
+
+    def route_batch(self, questions, k=3):
+        """
+        Top-k (key, score) pairs for each question, scored in one matrix pass.
+        """
+        if not self.keys:
+            return [[] for _ in questions]
+        scores = self.bm25.score_batch(list(questions))
+        top = np.argsort(-scores, axis=1)[:, :k]
+        return [
+            [(self.keys[col], float(scores[row, col])) for col in top[row]]
+            for row in range(len(top))
+        ]
+
+    def route(self, question, k=3):
+        return self.route_batch([question], k)[0]
+
+    def is_confident(self, ranked):
+        """
+        True when the top-ranked key clearly beats the runner-up.
+        """
+        if not ranked or ranked[0][1] <= 0:
+            return False
+        if len(ranked) == 1:
+            return True
+        return ranked[0][1] >= self.margin * ranked[1][1]
+
+
+def benchmark(csv_path='data/q_a.csv', k=3, margin=DEFAULT_MARGIN):
+    """
+    Report routing accuracy against the Guideline column of the QA dataset.
+    """
+    qa_df = pd.read_csv(csv_path)
+    router = GuidelineRouter(margin=margin)
+    routes = router.route_batch(qa_df['Question'].tolist(), k=k)
+
+    known = qa_df['Guideline'].isin(router.keys)
+    total = int(known.sum())
+    top1 = topk = confident = confident_correct = 0
+    for ranked, expected, is_known in zip(routes, qa_df['Guideline'], known):
+        if not is_known:
+            continue
+        keys = [key for key, _ in ranked]
+        top1 += keys[0] == expected
+        topk += expected in keys
+        if router.is_confident(ranked):
+            confident += 1
+            confident_correct += keys[0] == expected
+
+    print(f"Questions with a known guideline: {total}/{len(qa_df)}")
+    print(f"Top-1 accuracy: {top1}/{total} ({top1/total*100:.1f}%)")
+    print(f"Top-{k} accuracy: {topk}/{total} ({topk/total*100:.1f}%)")
+    print(f"Confident routes (margin {margin}): {confident}/{total} ({confident/total*100:.1f}%)")
+    if confident:
+        print(f"Accuracy when confident: {confident_correct}/{confident} ({confident_correct/confident*100:.1f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the local guideline router')
+    parser.add_argument('--csv_path', type=str, default='data/q_a.csv', help='Path to questions CSV')
+    parser.add_argument('--k', type=int, default=3, help='Number of keys returned per question (default: 3)')
+    parser.add_argument('--margin', type=float, default=DEFAULT_MARGIN, help='Top/second score ratio for a confident route')
+    args = parser.parse_args()
+    benchmark(args.csv_path, args.k, args.margin)
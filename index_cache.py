@@ -0,0 +1,330 @@
+"""
+Persistent vector index cache
+Indices are persisted under index_cache/ and keyed by the chunking parameters. A manifest records the
+SHA-256 of every PDF in the index, so only added or changed PDFs are chunked and embedded again.
+Chunk embeddings are kept in a content-addressed store (EMBEDDING_CACHE_PATH, by default
+index_cache/embeddings.sqlite), so indices of other chunk sizes or overlaps only embed the chunks whose
+text they do not share. Entries are keyed by model and API endpoint, so vectors from the offline
+stand-in never serve a build against the real API.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import TYPE_CHECKING
+import numpy as np
+from config import EMBEDDING_CACHE_PATH
+
+# llama_index is imported on first use so that importing the eval scripts stays fast
+if TYPE_CHECKING:
+    from llama_index.core import GPTVectorStoreIndex
+
+INDEX_CACHE_DIR = 'index_cache'
+MANIFEST_FILE = 'manifest.json'
+DEFAULT_OPENAI_BASE = 'https://api.openai.com/v1'
+# the defaults of llama_index's SentenceSplitter, in tokens
+DEFAULT_CHUNK_SIZE = 1024
+DEFAULT_CHUNK_OVERLAP = 200
+# chunks retrieved per question; the same as llama_index's default similarity_top_k
+DEFAULT_TOP_K = 2
+
+
+def file_sha256(path: str) -> str:
+    """
+    Hash a file's bytes without reading it into memory at once.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunking_key(chunk_size: int, chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> str:
+    """
+    Short, stable key for the chunking parameters an index was built with.
+    """
+    params = json.dumps({'chunk_size': chunk_size, 'chunk_overlap': chunk_overlap}, sort_keys=True)
+    return hashlib.sha256(params.encode('utf-8')).hexdigest()[:12]
+
+
+def chunk_configs(chunk_sizes, chunk_overlaps) -> list:
+    """
+    (chunk_size, chunk_overlap) pairs to sweep, from ints or comma-separated strings such as "256,512,1024".
+    Pairs whose overlap is not smaller than the chunk size are skipped.
+    """
+    def values(spec):
+        return [int(value) for value in str(spec).split(',') if value.strip()]
+
+    configs = []
+    for chunk_size in values(chunk_sizes):
+        for chunk_overlap in values(chunk_overlaps):
+            if chunk_overlap >= chunk_size:
+                print(f"Skipping chunk size {chunk_size} with overlap {chunk_overlap}: the overlap must be smaller")
+                continue
+            configs.append((chunk_size, chunk_overlap))
+    return configs
+
+
+def embedding_key(model: str, api_base=None) -> str:
+    """
+    Store key of an embedding model served from `api_base` (the OpenAI API if None).
+    """
+    api_base = api_base or os.getenv('OPENAI_BASE_URL') or DEFAULT_OPENAI_BASE
+    return f"{model}@{str(api_base).rstrip('/')}"
+
+
+class EmbeddingCache:
+    """
+    Thread- and process-safe SQLite store of float32 embeddings keyed by model and a hash of the embedded text.
+
+    Args:
+        path (str): SQLite database file
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT,
+                    text_hash TEXT,
+                    vector BLOB,
+                    PRIMARY KEY (model, text_hash)
+                )
+                """
+            )
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def embed(self, model: str, texts: list, embed_batch) -> np.ndarray:
+        """
+        Embeddings of `texts`, shape (len(texts), dim). Only texts not stored for `model` are passed
+        to `embed_batch(texts) -> list of vectors`, once each, and their vectors are stored.
+        """
+        hashes = [self.text_hash(text) for text in texts]
+        found = {}
+        with self.lock:
+            unique = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    (model, *batch),
+                ).fetchall()
+                found.update((text_hash, np.frombuffer(vector, dtype=np.float32)) for text_hash, vector in rows)
+
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in found:
+                missing.setdefault(text_hash, text)
+        if missing:
+            vectors = embed_batch(list(missing.values()))
+            new = {text_hash: np.asarray(vector, dtype=np.float32) for text_hash, vector in zip(missing, vectors)}
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                    [(model, text_hash, vector.tobytes()) for text_hash, vector in new.items()],
+                )
+            found.update(new)
+        with self.lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        if not texts:
+            return np.zeros((0, 1), dtype=np.float32)
+        return np.stack([found[text_hash] for text_hash in hashes])
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Process-wide embedding store, opened on first use.
+    """
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache()
+        return _embedding_cache
+
+
+def load_documents(pdf_paths: list) -> list:
+    """
+    One llama_index Document per PDF page, built from the shared text store instead of parsing the PDFs.
+    The metadata matches what SimpleDirectoryReader sets for the fields the index uses.
+    """
+    from llama_index.core import Document
+    from text_store import get_text_store
+
+    store = get_text_store()
+    store.update(pdf_paths)
+    documents = []
+    for path in pdf_paths:
+        for page, text in enumerate(store.pages_for_file(path)):
+            documents.append(Document(
+                text=text,
+                metadata={'page_label': str(page + 1), 'file_name': os.path.basename(path)},
+            ))
+    return documents
+
+
+def build_nodes(documents: list, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                chunk_overlap: int = DEFAULT_CHUNK_OVERLAP, use_store: bool = True) -> list:
+    """
+    Split documents into chunks of `chunk_size` tokens overlapping by `chunk_overlap`, with their
+    embeddings filled in from the shared embedding store (only chunks not seen before are embedded).
+    Without `use_store`, every chunk is embedded and nothing is written to the store.
+    """
+    from llama_index.core import Settings
+    from llama_index.core.node_parser import SentenceSplitter
+    from llama_index.core.schema import MetadataMode
+
+    nodes = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).get_nodes_from_documents(documents)
+    embed_model = Settings.embed_model
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    if use_store:
+        cache = get_embedding_cache()
+        misses = cache.misses
+        vectors = cache.embed(
+            embedding_key(f"llama_index/{embed_model.model_name}", getattr(embed_model, 'api_base', None)),
+            texts,
+            embed_model.get_text_embedding_batch,
+        )
+        embedded = cache.misses - misses
+    else:
+        vectors = np.asarray(embed_model.get_text_embedding_batch(texts), dtype=np.float32) if texts else []
+        embedded = len(texts)
+    print(f"{len(nodes)} chunks of {chunk_size} tokens (overlap {chunk_overlap}): "
+          f"{len(nodes) - embedded} embeddings reused, {embedded} embedded")
+    for node, vector in zip(nodes, vectors):
+        node.embedding = vector.tolist()
+    return nodes
+
+
+def build_index(pdf_paths: list, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                chunk_overlap: int = DEFAULT_CHUNK_OVERLAP, use_store: bool = True) -> "GPTVectorStoreIndex":
+    """
+    In-memory GPTVectorStoreIndex over `pdf_paths` with the given chunking; `use_store` as in build_nodes.
+    """
+    from llama_index.core import GPTVectorStoreIndex
+    return GPTVectorStoreIndex(build_nodes(load_documents(pdf_paths), chunk_size, chunk_overlap, use_store))
+
+
+def retrieve_contexts(index: "GPTVectorStoreIndex", questions: list, top_k: int = DEFAULT_TOP_K) -> list:
+    """
+    Retrieved context of every question from a llama_index index, without the query engine's synthesis
+    LLM call. The questions are embedded in one batch and one retriever serves all of them. Question
+    vectors are not kept in the embedding store, which only holds chunks.
+    """
+    from llama_index.core import QueryBundle, Settings
+
+    # OpenAIEmbedding embeds queries and texts the same way
+    vectors = Settings.embed_model.get_text_embedding_batch(list(questions)) if questions else []
+    retriever = index.as_retriever(similarity_top_k=top_k)
+    return [
+        '\n\n'.join(node.get_content() for node in retriever.retrieve(QueryBundle(query_str=question, embedding=list(vector))))
+        for question, vector in zip(questions, vectors)
+    ]
+
+
+def load_manifest(persist_dir: str) -> dict:
+    manifest_path = os.path.join(persist_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {'files': {}}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+
+def save_manifest(persist_dir: str, manifest: dict):
+    manifest_path = os.path.join(persist_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def is_index_current(pdf_paths: list, persist_dir: str) -> bool:
+    """
+    True if `persist_dir` holds an index built from exactly these PDFs with their current contents.
+    """
+    files = load_manifest(persist_dir)['files']
+    hashes = {os.path.basename(path): file_sha256(path) for path in pdf_paths}
+    return (
+        os.path.exists(os.path.join(persist_dir, 'docstore.json'))
+        and {name: entry['sha256'] for name, entry in files.items()} == hashes
+    )
+
+
+def load_or_build_index(pdf_paths: list, persist_dir: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> "GPTVectorStoreIndex":
+    """
+    Load the index persisted in `persist_dir` and bring it up to date with `pdf_paths`.
+
+    PDFs whose hash matches the manifest are reused as-is, removed or changed PDFs are deleted
+    from the index, and added or changed PDFs are chunked and inserted.
+    """
+    from llama_index.core import GPTVectorStoreIndex
+    from llama_index.core import StorageContext, load_index_from_storage
+
+    hashes = {os.path.basename(path): file_sha256(path) for path in pdf_paths}
+    paths = {os.path.basename(path): path for path in pdf_paths}
+
+    manifest = load_manifest(persist_dir)
+    index = None
+    if manifest['files'] and os.path.exists(os.path.join(persist_dir, 'docstore.json')):
+        index = load_index_from_storage(StorageContext.from_defaults(persist_dir=persist_dir))
+    else:
+        manifest = {'files': {}}
+    manifest['chunk_size'] = chunk_size
+    manifest['chunk_overlap'] = chunk_overlap
+    files = manifest['files']
+
+    stale = [name for name, entry in files.items() if hashes.get(name) != entry['sha256']]
+    added = [name for name in hashes if name not in files or name in stale]
+
+    if index is not None and not stale and not added:
+        print(f"Loaded cached index for {len(files)} PDFs from '{persist_dir}'")
+        return index
+
+    for name in stale:
+        for doc_id in files[name]['doc_ids']:
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        del files[name]
+
+    if added:
+        print(f"Indexing {len(added)} new or changed PDFs: {', '.join(sorted(added))}")
+        documents = load_documents([paths[name] for name in added])
+        for name in added:
+            files[name] = {'sha256': hashes[name], 'doc_ids': []}
+        for doc in documents:
+            files[doc.metadata['file_name']]['doc_ids'].append(doc.doc_id)
+
+        nodes = build_nodes(documents, chunk_size, chunk_overlap)
+        if index is None:
+            index = GPTVectorStoreIndex(nodes)
+        else:
+            index.insert_nodes(nodes)
+
+    if index is None:
+        index = GPTVectorStoreIndex.from_documents([])
+
+    os.makedirs(persist_dir, exist_ok=True)
+    index.storage_context.persist(persist_dir=persist_dir)
+    save_manifest(persist_dir, manifest)
+    print(f"Index for {len(files)} PDFs saved to '{persist_dir}'")
+    return index
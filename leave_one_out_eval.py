@@ -3,13 +3,18 @@ Leave-One-Out Evaluation: Tests the multi-agent framework by excluding the corre
 This evaluation measures how well the system performs when the correct guideline is masked from the coordinator.
 """
 
-from evaluate_answers import AnswerEvaluator
+from evaluate_answers import AnswerEvaluator, configure_page_slicing, is_error_result, prepare_groups
 import argparse
 from datetime import datetime
 import os
 import pandas as pd
 import random
 from data.asco_guidelines import guideline_summaries
+from resilience import print_retry_stats
+from token_ledger import ledger
+from tracing import default_trace_path, tracer
+from results_sink import ResultSink, result_paths
+from scheduler import ORDERS, guideline_groups
 
 
 class LeaveOneOutEvaluator(AnswerEvaluator):
@@ -17,8 +22,8 @@ class LeaveOneOutEvaluator(AnswerEvaluator):
     Extends AnswerEvaluator to test performance when correct guideline summary is excluded
     """
     
-    def __init__(self, cache_seed):
-        super().__init__(cache_seed)
+    def __init__(self, cache_seed, speaker_mode="groupchat"):
+        super().__init__(cache_seed, speaker_mode=speaker_mode)
         
     def create_masked_summaries(self, guideline_to_exclude):
         """
@@ -35,19 +40,32 @@ class LeaveOneOutEvaluator(AnswerEvaluator):
         print(f"Available guidelines: {len(masked_summaries)} (original: {len(guideline_summaries)})")
         return masked_summaries
     
-    def run_leave_one_out_evaluation(self, question_indices):
+    def question_groups(self, indices, order="row"):
+        """
+        Question indices grouped by guideline for scheduling. With the correct guideline masked, the
+        coordinator opens some other PDF, so `routed` routes each question against its masked summaries.
+        """
+        groups = guideline_groups(
+            self.qa_df, indices, order,
+            summaries_for=lambda idx: {k: v for k, v in guideline_summaries.items() if k != self.qa_df.loc[idx, 'Guideline']}
+        )
+        return prepare_groups(groups, order)
+
+    def run_leave_one_out_evaluation(self, question_indices, on_result=None, order="row"):
         """
         Run evaluation with correct guideline summaries masked
         
         Args:
             question_indices (list): List of question indices to evaluate
+            on_result (callable): Called as on_result(idx, result) as each question finishes
+            order (str): "row", or "expected"/"routed" to run questions grouped by guideline
         
         Returns:
-            list: Results with evaluation metrics
+            list: Results with evaluation metrics, in the order of question_indices
         """
         results = []
         
-        for idx in question_indices:
+        for idx in [idx for group in self.question_groups(question_indices, order) for idx in group]:
             row = self.qa_df.iloc[idx]
             question = row['Question']
             expected_answer = row['Answer']
@@ -61,62 +79,61 @@ class LeaveOneOutEvaluator(AnswerEvaluator):
             # Create masked summaries excluding the correct guideline
             masked_summaries = self.create_masked_summaries(expected_guideline)
             
-            try:
-                # Import here to create a fresh instance
-                from claude_autogen import ClaudeChat
+            with tracer.context(question_index=int(idx)):
+                try:
+                    # Run evaluation with masked guideline summaries, reusing the pooled chat for this mask
+                    with self.chat_pool.checkout(masked_summaries) as claude_chat:
+                        chat_result = claude_chat.chat(question)
                 
-                # Run evaluation with masked guideline summaries
-                claude_chat = ClaudeChat(
-                    cache_seed=self.cache_seed,
-                    custom_guideline_summaries=masked_summaries
-                )
-                chat_result = claude_chat.chat(question)
+                    # Access chat messages
+                    chat_messages = chat_result.chat_history
                 
-                # Access chat messages
-                chat_messages = chat_result.chat_history
+                    # Extract final answer from reviewer
+                    generated_answer = None
+                    for msg in reversed(chat_messages):
+                        if msg.get("name") == "reviewer":
+                            generated_answer = msg.get("content")
+                            break
                 
-                # Extract final answer from reviewer
-                generated_answer = None
-                for msg in reversed(chat_messages):
-                    if msg.get("name") == "reviewer":
-                        generated_answer = msg.get("content")
-                        break
+                    # Extract guideline chosen by coordinator
+                    generated_guideline = self.extract_guideline_from_chat(chat_messages)
                 
-                # Extract guideline chosen by coordinator
-                generated_guideline = self.extract_guideline_from_chat(chat_messages)
+                    # Evaluate answer correctness
+                    if generated_answer:
+                        evaluation = self.evaluate_single_answer(question, generated_answer, expected_answer)
+                    else:
+                        evaluation = "NO"
                 
-                # Evaluate answer correctness
-                if generated_answer:
-                    evaluation = self.evaluate_single_answer(question, generated_answer, expected_answer)
-                else:
-                    evaluation = "NO"
+                    # Store results
+                    results.append({
+                        'question_index': idx,
+                        'question': question,
+                        'expected_answer': expected_answer,
+                        'generated_answer': generated_answer,
+                        'expected_guideline': expected_guideline,
+                        'generated_guideline': generated_guideline,
+                        'guideline_match': expected_guideline == generated_guideline,
+                        'answer_correct': evaluation
+                    })
                 
-                # Store results
-                results.append({
-                    'question_index': idx,
-                    'question': question,
-                    'expected_answer': expected_answer,
-                    'generated_answer': generated_answer,
-                    'expected_guideline': expected_guideline,
-                    'generated_guideline': generated_guideline,
-                    'guideline_match': expected_guideline == generated_guideline,
-                    'answer_correct': evaluation
-                })
-                
-            except Exception as e:
-                print(f"Error during evaluation: {str(e)}")
-                results.append({
-                    'question_index': idx,
-                    'question': question,
-                    'expected_answer': expected_answer,
-                    'generated_answer': None,
-                    'expected_guideline': expected_guideline,
-                    'generated_guideline': None,
-                    'guideline_match': False,
-                    'answer_correct': f"ERROR - {str(e)}"
-                })
+                except Exception as e:
+                    print(f"Error during evaluation: {str(e)}")
+                    results.append({
+                        'question_index': idx,
+                        'question': question,
+                        'expected_answer': expected_answer,
+                        'generated_answer': None,
+                        'expected_guideline': expected_guideline,
+                        'generated_guideline': None,
+                        'guideline_match': False,
+                        'answer_correct': f"ERROR - {str(e)}"
+                    })
+
+            if on_result is not None:
+                on_result(idx, results[-1])
         
-        return results
+        position = {idx: i for i, idx in enumerate(question_indices)}
+        return sorted(results, key=lambda result: position[result['question_index']])
 
 
 def main():
@@ -148,6 +165,26 @@ def main():
         default=None,
         help='Comma-separated list of specific question indices to evaluate (e.g., "0,5,10")'
     )
+    parser.add_argument(
+        '--speaker_mode',
+        type=str,
+        default='groupchat',
+        choices=['groupchat', 'state_machine'],
+        help='How the next agent is chosen: GroupChatManager or the fixed state machine (default: groupchat)'
+    )
+    parser.add_argument(
+        '--order',
+        type=str,
+        default='row',
+        choices=ORDERS,
+        help='Question order: row, or grouped by expected or routed guideline to reuse the PDF prompt cache (default: row)'
+    )
+    parser.add_argument(
+        '--resume',
+        type=str,
+        default=None,
+        help='Results file (.jsonl or .csv) of an interrupted run to continue'
+    )
     args = parser.parse_args()
 
     # Create results directory if it doesn't exist
@@ -155,7 +192,7 @@ def main():
     
     # Initialize evaluator
     print(f"Initializing leave-one-out evaluator with cache seed {args.cache_seed}")
-    evaluator = LeaveOneOutEvaluator(cache_seed=args.cache_seed)
+    evaluator = LeaveOneOutEvaluator(cache_seed=args.cache_seed, speaker_mode=args.speaker_mode)
     
     # Select questions
     if args.specific_indices:
@@ -175,7 +212,17 @@ def main():
     print("LEAVE-ONE-OUT EVALUATION: Testing with correct guideline summary masked")
     print("="*70)
     
-    results = evaluator.run_leave_one_out_evaluation(question_indices)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_path, sink_path = result_paths(f'results/leave_one_out_evaluation_results_{timestamp}.csv', args.resume)
+    sink = ResultSink(sink_path)
+    done = {idx: r for idx, r in sink.completed().items() if not is_error_result(r)}
+    pending = [idx for idx in question_indices if idx not in done]
+    if done:
+        print(f"Resuming from {sink_path}: {len(question_indices) - len(pending)} questions already evaluated")
+    
+    configure_page_slicing(args.order)
+    evaluator.run_leave_one_out_evaluation(pending, on_result=lambda idx, result: sink.append(result), order=args.order)
+    results = [r for r in sink.records() if r['question_index'] in question_indices]
     
     # Calculate statistics
     total = len(results)
@@ -195,11 +242,12 @@ def main():
     
     # Save results to CSV
     results_df = pd.DataFrame(results)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    csv_path = f'results/leave_one_out_evaluation_results_{timestamp}.csv'
     results_df.to_csv(csv_path, index=False)
     
     print(f"\nResults saved to: {csv_path}")
+    ledger.print_summary()
+    print_retry_stats()
+    tracer.finish(default_trace_path())
     print("\nDetailed Results:")
     print("-" * 70)
     for i, result in enumerate(results, 1):
@@ -0,0 +1,179 @@
+"""
+LLM Response Cache
+Content-addressed SQLite cache for deterministic LLM calls (the judges and the baseline answers).
+Entries are keyed by provider, model, call parameters and a hash of the prompt, and the least
+recently used entries are evicted once the stored responses exceed a size budget.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from config import LLM_CACHE_ENABLED, LLM_CACHE_MAX_MB, LLM_CACHE_PATH
+
+
+class LLMCache:
+    """
+    Thread-safe SQLite response cache.
+
+    Args:
+        path (str): SQLite database file
+        max_bytes (int): Size budget for the stored responses
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    provider TEXT,
+                    model TEXT,
+                    response TEXT,
+                    size INTEGER,
+                    created REAL,
+                    last_access REAL
+                )
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    @staticmethod
+    def make_key(provider: str, model: str, params: dict, prompt) -> str:
+        """
+        Cache key from the provider, model, parameters and a hash of the prompt (a string or message list).
+        """
+        prompt_text = prompt if isinstance(prompt, str) else json.dumps(prompt, sort_keys=True, default=str)
+        prompt_hash = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()
+        payload = json.dumps(
+            {'provider': provider, 'model': model, 'params': params or {}, 'prompt': prompt_hash},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, provider: str, model: str, response: str):
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, response, size, now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def cached_call(self, provider: str, model: str, params: dict, prompt, call):
+        """
+        Return the cached response for this request, or run `call()` and cache its (string) result.
+        """
+        key = self.make_key(provider, model, params, prompt)
+        response = self.get(key)
+        if response is None:
+            response = call()
+            if response is not None:
+                self.put(key, provider, model, response)
+        return response
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+                'bytes': size,
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"\nLLM cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']*100:.1f}% hit rate), {stats['entries']} entries, "
+              f"{stats['bytes'] / 1024 / 1024:.1f} MB")
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Process-wide cache instance, created on first use.
+    """
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCache()
+        return _llm_cache
+
+
+def cached_completion(provider: str, model: str, params: dict, prompt, call):
+    """
+    Route a call through the shared cache, or call straight through when LLM_CACHE is disabled.
+    """
+    if not LLM_CACHE_ENABLED:
+        return call()
+    return get_llm_cache().cached_call(provider, model, params, prompt, call)
+
+
+def lookup_completion(provider: str, model: str, params: dict, prompt):
+    """
+    The cached response for a request, without making it; None on a miss or when LLM_CACHE is disabled.
+    """
+    if not LLM_CACHE_ENABLED:
+        return None
+    cache = get_llm_cache()
+    return cache.get(cache.make_key(provider, model, params, prompt))
+
+
+def store_completion(provider: str, model: str, params: dict, prompt, response: str):
+    """
+    Put a response obtained outside cached_completion (e.g. from a batch job) into the shared cache.
+    """
+    if LLM_CACHE_ENABLED:
+        cache = get_llm_cache()
+        cache.put(cache.make_key(provider, model, params, prompt), provider, model, response)
+
+
+def print_llm_cache_stats():
+    if LLM_CACHE_ENABLED:
+        get_llm_cache().print_stats()
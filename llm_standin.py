@@ -0,0 +1,689 @@
+"""
+Offline LLM Stand-in
+Local HTTP server that speaks the request/response shapes of the OpenAI, Anthropic, Gemini and
+Azure AI Inference APIs used by the evaluation scripts, so pipelines can be run and benchmarked
+without live accounts.
+
+- replay (default): answer from recorded responses, matched by provider, model and request body;
+  unmatched requests get a synthetic response
+- record: forward every request to the real API and save the response for later replay
+
+Streamed requests (`"stream": true`, or Gemini's :streamGenerateContent) are answered with server-sent
+events in each provider's format, built from the same recorded or synthetic response: the first event
+arrives after the base latency, then text follows word by word at --ms_per_output_token. Streamed and
+non-streamed requests share recordings; record mode forwards a streamed request unstreamed.
+
+The OpenAI Files and Batch APIs (/v1/files, /v1/batches) are always served locally: every line of a
+batch input file is answered like a /v1/chat/completions request (from the recordings or synthesized),
+and the batch completes after the configured latency.
+
+Latency, token counts and 429 rate-limit errors can be injected. Point the SDKs at the server with
+the environment variables from `StandInServer.env()`, or run it standalone:
+
+    python llm_standin.py --port 8765 --latency_ms 800 --error_rate 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from config import AZURE_INFERENCE_ENDPOINT
+
+DEFAULT_RECORDINGS = os.path.join('cache', 'standin_recordings.jsonl')
+
+UPSTREAMS = {
+    'openai': 'https://api.openai.com',
+    'anthropic': 'https://api.anthropic.com',
+    'gemini': 'https://generativelanguage.googleapis.com',
+    'azure': AZURE_INFERENCE_ENDPOINT.rsplit('/models', 1)[0],
+}
+
+# a PDF document block is billed like a long prompt; the stand-in cannot see the page count
+DOCUMENT_TOKENS = 20000
+EMBEDDING_DIM = 1536
+
+SYNTHETIC_ANSWER = "Stand-in answer: follow the guideline recommendation for this scenario. TERMINATE"
+
+
+def estimate_tokens(value) -> int:
+    """
+    Rough token count of a request fragment (about four characters per token).
+    """
+    if isinstance(value, str):
+        return max(1, len(value) // 4)
+    if isinstance(value, dict):
+        if value.get('type') == 'document':
+            return DOCUMENT_TOKENS
+        return sum(estimate_tokens(v) for k, v in value.items() if k != 'cache_control')
+    if isinstance(value, list):
+        return sum(estimate_tokens(v) for v in value)
+    return 0
+
+
+def route(method: str, path: str):
+    """
+    Provider and endpoint of a request path, or (None, None) for unknown paths.
+    """
+    if method != 'POST':
+        return None, None
+    if path.endswith('/chat/completions'):
+        return ('azure' if path.startswith('/models') else 'openai'), 'chat'
+    if path.endswith('/embeddings'):
+        return 'openai', 'embeddings'
+    if path.endswith('/messages/count_tokens'):
+        return 'anthropic', 'count_tokens'
+    if path.endswith('/messages'):
+        return 'anthropic', 'messages'
+    if ':generateContent' in path or ':streamGenerateContent' in path:
+        return 'gemini', 'generate'
+    return None, None
+
+
+def unstreamed_path(raw_path: str) -> str:
+    """
+    Request path (with query) of the non-streamed form of a request, for forwarding in record mode.
+    """
+    parts = urlsplit(raw_path)
+    query = '&'.join(param for param in parts.query.split('&') if param and param != 'alt=sse')
+    return parts.path.replace(':streamGenerateContent', ':generateContent') + (f'?{query}' if query else '')
+
+
+class Recordings:
+    """
+    Thread-safe JSONL store of recorded responses, keyed by provider, endpoint, model and request body.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry['key']] = entry
+
+    @staticmethod
+    def make_key(provider, endpoint, model, body) -> str:
+        payload = json.dumps({'provider': provider, 'endpoint': endpoint, 'model': model, 'body': body},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key, provider, endpoint, model, status, response):
+        entry = {'key': key, 'provider': provider, 'endpoint': endpoint, 'model': model,
+                 'status': status, 'response': response}
+        with self.lock:
+            self.entries[key] = entry
+            if self.path:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+class StandInServer:
+    """
+    Threaded stand-in server.
+
+    Args:
+        port (int): Port to listen on, 0 for any free port
+        recordings (str): JSONL file of recorded responses
+        mode (str): 'replay' or 'record'
+        latency_ms (float): Base latency added to every response
+        jitter_ms (float): Uniform random latency added on top
+        ms_per_output_token (float): Extra latency per generated token, to mimic decoding
+        input_tokens (int): Fixed input token count to report, instead of an estimate
+        output_tokens (int): Fixed output token count to report, instead of an estimate
+        error_rate (float): Share of requests answered with a 429
+        retry_after (float): Retry-After seconds sent with injected 429s
+        seed (int): Seed for latency jitter and error injection
+    """
+
+    def __init__(self, port=0, recordings=DEFAULT_RECORDINGS, mode='replay', latency_ms=0.0, jitter_ms=0.0,
+                 ms_per_output_token=0.0, input_tokens=None, output_tokens=None, error_rate=0.0,
+                 retry_after=1.0, seed=0):
+        if mode not in ('replay', 'record'):
+            raise ValueError(f"Unsupported mode: {mode}")
+        self.mode = mode
+        self.recordings = Recordings(recordings)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.ms_per_output_token = ms_per_output_token
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.cache_prefixes = set()
+        self.files = {}
+        self.file_data = {}
+        self.batches = {}
+        self.upstream = None
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> dict:
+        """
+        Environment variables that point the provider SDKs (and config.py) at this server.
+        """
+        return {
+            'OPENAI_BASE_URL': f"{self.url}/v1",
+            'OPENAI_API_BASE': f"{self.url}/v1",
+            'ANTHROPIC_BASE_URL': self.url,
+            'GEMINI_BASE_URL': self.url,
+            'AZURE_INFERENCE_ENDPOINT': f"{self.url}/models",
+        }
+
+    def start(self):
+        if self.mode == 'record':
+            import httpx
+            self.upstream = httpx.Client(timeout=600)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.upstream is not None:
+            self.upstream.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counts)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                server.handle(self)
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, request):
+        path = urlsplit(request.path).path
+        provider, endpoint = route(request.command, path)
+        length = int(request.headers.get('Content-Length') or 0)
+        raw = request.rfile.read(length) if length else b''
+        if path.startswith(('/v1/files', '/v1/batches')):
+            self._handle_batch_api(request, path, raw)
+            return
+        if provider is None:
+            self._send(request, 404, {'error': {'message': f"Unknown stand-in path: {path}"}})
+            return
+        body = json.loads(raw or b'{}')
+        model = body.get('model') or path.split('/models/')[-1].split(':')[0]
+        self._count(f"{provider}.{endpoint}")
+        # streaming only changes the response framing, so it is not part of the recording key
+        streamed = bool(body.pop('stream', False)) or ':streamGenerateContent' in path
+        body.pop('stream_options', None)
+        if streamed:
+            self._count('streamed')
+
+        with self.lock:
+            inject_429 = self.random.random() < self.error_rate
+            delay = (self.latency_ms + self.random.uniform(0, self.jitter_ms)) / 1000
+        if inject_429:
+            self._count('injected_429')
+            time.sleep(delay / 4)
+            self._send(request, 429, rate_limit_error(provider), {'retry-after': f"{self.retry_after:g}"})
+            return
+
+        key = Recordings.make_key(provider, endpoint, model, body)
+        entry = self.recordings.get(key)
+        if entry is None and self.mode == 'record':
+            if streamed:
+                status, response = self._forward(request, provider, json.dumps(body).encode('utf-8'),
+                                                 unstreamed_path(request.path))
+            else:
+                status, response = self._forward(request, provider, raw)
+            if status < 400:
+                self.recordings.put(key, provider, endpoint, model, status, response)
+            self._count('recorded')
+            if streamed and status < 400:
+                self._send_stream(request, provider, response, 0.0)
+            else:
+                self._send(request, status, response)
+            return
+
+        if entry is not None:
+            self._count('replayed')
+            status, response = entry['status'], json.loads(json.dumps(entry['response']))
+        else:
+            self._count('synthetic')
+            status, response = 200, self.synthesize(provider, endpoint, model, body)
+        self._override_usage(provider, endpoint, response)
+        if streamed and status < 400:
+            self._send_stream(request, provider, response, delay)
+            return
+        time.sleep(delay + self.ms_per_output_token * output_token_count(provider, endpoint, response) / 1000)
+        self._send(request, status, response)
+
+    def _forward(self, request, provider, raw, path=None):
+        headers = {name: value for name, value in request.headers.items()
+                   if name.lower() not in ('host', 'content-length', 'accept-encoding', 'connection', 'accept')}
+        upstream = self.upstream.post(UPSTREAMS[provider] + (path or request.path), content=raw, headers=headers)
+        try:
+            return upstream.status_code, upstream.json()
+        except ValueError:
+            return upstream.status_code, {'error': {'message': upstream.text}}
+
+    def _handle_batch_api(self, request, path, raw):
+        """
+        OpenAI Files API (upload, metadata, content) and Batch API (create, retrieve).
+        """
+        parts = path.strip('/').split('/')
+        method = request.command
+        if parts[1] == 'files':
+            if method == 'POST' and len(parts) == 2:
+                self._count('openai.files')
+                filename, purpose, content = parse_multipart(request.headers.get('Content-Type', ''), raw)
+                self._send(request, 200, self._add_file(filename, purpose, content))
+                return
+            if method == 'GET' and len(parts) == 3 and parts[2] in self.files:
+                self._send(request, 200, self.files[parts[2]])
+                return
+            if method == 'GET' and len(parts) == 4 and parts[3] == 'content' and parts[2] in self.file_data:
+                self._send_bytes(request, 200, self.file_data[parts[2]], 'application/octet-stream')
+                return
+        elif parts[1] == 'batches':
+            if method == 'POST' and len(parts) == 2:
+                self._count('openai.batches')
+                body = json.loads(raw or b'{}')
+                if body.get('input_file_id') not in self.file_data:
+                    self._send(request, 400, {'error': {'message': f"Unknown input file: {body.get('input_file_id')}"}})
+                    return
+                self._send(request, 200, self._create_batch(body))
+                return
+            if method == 'GET' and len(parts) == 3 and parts[2] in self.batches:
+                self._send(request, 200, self._batch_view(parts[2]))
+                return
+        self._send(request, 404, {'error': {'message': f"Unknown stand-in path: {path}"}})
+
+    def _add_file(self, filename, purpose, content) -> dict:
+        file = {'id': f"file-{uuid.uuid4().hex[:24]}", 'object': 'file', 'bytes': len(content),
+                'created_at': int(time.time()), 'filename': filename, 'purpose': purpose, 'status': 'processed'}
+        with self.lock:
+            self.files[file['id']] = file
+            self.file_data[file['id']] = content
+        return file
+
+    def _create_batch(self, body) -> dict:
+        """
+        Answer every request line of the input file now; the batch reports completion once the
+        configured latency has passed.
+        """
+        output = []
+        for line in self.file_data[body['input_file_id']].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request_line = json.loads(line)
+            request_body = request_line['body']
+            model = request_body.get('model')
+            entry = self.recordings.get(Recordings.make_key('openai', 'chat', model, request_body))
+            if entry is not None:
+                status, response = entry['status'], json.loads(json.dumps(entry['response']))
+            else:
+                status, response = 200, self.synthesize('openai', 'chat', model, request_body)
+            self._override_usage('openai', 'chat', response)
+            output.append(json.dumps({
+                'id': f"batch_req_{uuid.uuid4().hex[:24]}",
+                'custom_id': request_line['custom_id'],
+                'response': {'status_code': status, 'request_id': f"standin-{uuid.uuid4().hex[:12]}", 'body': response},
+                'error': None,
+            }))
+        output_file = self._add_file('batch_output.jsonl', 'batch_output', '\n'.join(output).encode('utf-8'))
+        now = time.time()
+        batch = {
+            'id': f"batch_{uuid.uuid4().hex[:24]}", 'object': 'batch', 'endpoint': body.get('endpoint'),
+            'input_file_id': body['input_file_id'], 'completion_window': body.get('completion_window', '24h'),
+            'status': 'in_progress', 'created_at': int(now), 'output_file_id': None, 'error_file_id': None,
+            'request_counts': {'total': len(output), 'completed': 0, 'failed': 0},
+        }
+        with self.lock:
+            self.batches[batch['id']] = (batch, output_file['id'], now + self.latency_ms / 1000)
+        return dict(batch)
+
+    def _batch_view(self, batch_id) -> dict:
+        with self.lock:
+            batch, output_file_id, ready_at = self.batches[batch_id]
+        batch = dict(batch)
+        if time.time() >= ready_at:
+            batch.update(status='completed', output_file_id=output_file_id, completed_at=int(ready_at),
+                         request_counts=dict(batch['request_counts'], completed=batch['request_counts']['total']))
+        return batch
+
+    def _send_stream(self, request, provider, response, delay):
+        """
+        Send a complete response as server-sent events in the provider's streaming format. The body
+        ends when the connection closes.
+        """
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/event-stream')
+        request.send_header('Cache-Control', 'no-cache')
+        request.send_header('Connection', 'close')
+        request.send_header('x-request-id', f"standin-{uuid.uuid4().hex[:12]}")
+        request.end_headers()
+        request.close_connection = True
+        time.sleep(delay)
+        for event, data, tokens in stream_events(provider, response):
+            if tokens and self.ms_per_output_token:
+                time.sleep(self.ms_per_output_token * tokens / 1000)
+            frame = (f"event: {event}\n" if event else '') + f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+            request.wfile.write(frame.encode('utf-8'))
+            request.wfile.flush()
+
+    def _send(self, request, status, payload, headers=None):
+        self._send_bytes(request, status, json.dumps(payload).encode('utf-8'), 'application/json', headers)
+
+    def _send_bytes(self, request, status, data, content_type, headers=None):
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(data)))
+        request.send_header('x-request-id', f"standin-{uuid.uuid4().hex[:12]}")
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+    def synthesize(self, provider, endpoint, model, body) -> dict:
+        """
+        Build a well-formed response for a request that has no recording.
+        """
+        if endpoint == 'embeddings':
+            inputs = body.get('input')
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            data = [{'object': 'embedding', 'index': i, 'embedding': pseudo_embedding(text)}
+                    for i, text in enumerate(inputs)]
+            tokens = estimate_tokens(inputs)
+            return {'object': 'list', 'data': data, 'model': model,
+                    'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}}
+
+        if endpoint == 'count_tokens':
+            return {'input_tokens': estimate_tokens(body.get('messages')) + estimate_tokens(body.get('system', ''))}
+
+        if provider == 'gemini':
+            prompt = body.get('contents')
+        else:
+            prompt = body.get('messages')
+        text = synthetic_text(prompt, model)
+        input_tokens = estimate_tokens(prompt) + estimate_tokens(body.get('system', ''))
+        output_tokens = estimate_tokens(text)
+
+        if provider == 'anthropic':
+            cache_write, cache_read = self._prompt_cache_tokens(body)
+            return {
+                'id': f"msg_{uuid.uuid4().hex[:24]}",
+                'type': 'message',
+                'role': 'assistant',
+                'model': model,
+                'content': [{'type': 'text', 'text': text}],
+                'stop_reason': 'end_turn',
+                'stop_sequence': None,
+                'usage': {
+                    'input_tokens': max(1, input_tokens - cache_write - cache_read),
+                    'output_tokens': output_tokens,
+                    'cache_creation_input_tokens': cache_write,
+                    'cache_read_input_tokens': cache_read,
+                },
+            }
+        if provider == 'gemini':
+            return {
+                'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'},
+                                'finishReason': 'STOP', 'index': 0}],
+                'usageMetadata': {'promptTokenCount': input_tokens, 'candidatesTokenCount': output_tokens,
+                                  'totalTokenCount': input_tokens + output_tokens},
+                'modelVersion': model,
+            }
+        return {
+            'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text},
+                         'finish_reason': 'stop', 'logprobs': None}],
+            'usage': {'prompt_tokens': input_tokens, 'completion_tokens': output_tokens,
+                      'total_tokens': input_tokens + output_tokens},
+        }
+
+    def _prompt_cache_tokens(self, body):
+        """
+        Anthropic prompt caching: the prefix up to the last cache_control breakpoint is written
+        on first sight and read on every later request with the same prefix.
+        """
+        blocks = []
+        system = body.get('system')
+        if isinstance(system, list):
+            blocks.extend(system)
+        for message in body.get('messages', []):
+            content = message.get('content')
+            blocks.extend(content if isinstance(content, list) else [{'type': 'text', 'text': content}])
+        last = max((i for i, block in enumerate(blocks) if isinstance(block, dict) and block.get('cache_control')),
+                   default=None)
+        if last is None:
+            return 0, 0
+        prefix = blocks[:last + 1]
+        digest = hashlib.sha256(json.dumps(prefix, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        tokens = estimate_tokens(prefix)
+        with self.lock:
+            seen = digest in self.cache_prefixes
+            self.cache_prefixes.add(digest)
+        return (0, tokens) if seen else (tokens, 0)
+
+    def _override_usage(self, provider, endpoint, response):
+        if endpoint not in ('chat', 'messages', 'generate'):
+            return
+        usage_fields = {
+            'anthropic': ('usage', 'input_tokens', 'output_tokens'),
+            'gemini': ('usageMetadata', 'promptTokenCount', 'candidatesTokenCount'),
+        }.get(provider, ('usage', 'prompt_tokens', 'completion_tokens'))
+        usage = response.setdefault(usage_fields[0], {})
+        if self.input_tokens is not None:
+            usage[usage_fields[1]] = self.input_tokens
+        if self.output_tokens is not None:
+            usage[usage_fields[2]] = self.output_tokens
+
+
+def synthetic_text(prompt, model) -> str:
+    """
+    Deterministic answer text: a verdict for judge prompts, a short answer otherwise.
+    """
+    prompt_text = json.dumps(prompt, default=str)
+    if "Respond with only 'YES' or 'NO'" in prompt_text:
+        digest = hashlib.sha256(prompt_text.encode('utf-8')).digest()
+        return 'YES' if digest[0] % 2 == 0 else 'NO'
+    if 'deepseek' in model.lower():
+        return f"<think>stand-in reasoning</think>{SYNTHETIC_ANSWER}"
+    return SYNTHETIC_ANSWER
+
+
+def text_pieces(text) -> list:
+    """
+    Text split into word-sized deltas (each word with its trailing whitespace), as a stream delivers it.
+    """
+    return re.findall(r'\s*\S+\s*', text or '') or ([text] if text else [])
+
+
+def stream_events(provider, response):
+    """
+    (event name or None, data, output tokens in the delta) of the server-sent events that stream `response`.
+    OpenAI and Azure send chat.completion.chunk objects ending in [DONE], Anthropic the Messages
+    event sequence, Gemini one GenerateContentResponse per delta.
+    """
+    if provider == 'anthropic':
+        message = dict(response, content=[], stop_reason=None, stop_sequence=None,
+                       usage=dict(response.get('usage') or {}, output_tokens=1))
+        yield 'message_start', {'type': 'message_start', 'message': message}, 0
+        for index, block in enumerate(response.get('content') or []):
+            if block.get('type') == 'tool_use':
+                yield 'content_block_start', {'type': 'content_block_start', 'index': index,
+                                              'content_block': dict(block, input={})}, 0
+                partial = json.dumps(block.get('input') or {})
+                yield 'content_block_delta', {'type': 'content_block_delta', 'index': index,
+                                              'delta': {'type': 'input_json_delta', 'partial_json': partial}}, estimate_tokens(partial)
+            else:
+                yield 'content_block_start', {'type': 'content_block_start', 'index': index,
+                                              'content_block': {'type': 'text', 'text': ''}}, 0
+                for piece in text_pieces(block.get('text')):
+                    yield 'content_block_delta', {'type': 'content_block_delta', 'index': index,
+                                                  'delta': {'type': 'text_delta', 'text': piece}}, estimate_tokens(piece)
+            yield 'content_block_stop', {'type': 'content_block_stop', 'index': index}, 0
+        yield 'message_delta', {'type': 'message_delta',
+                                'delta': {'stop_reason': response.get('stop_reason'), 'stop_sequence': response.get('stop_sequence')},
+                                'usage': {'output_tokens': (response.get('usage') or {}).get('output_tokens', 0)}}, 0
+        yield 'message_stop', {'type': 'message_stop'}, 0
+        return
+
+    if provider == 'gemini':
+        candidate = (response.get('candidates') or [{}])[0]
+        text = ''.join(part.get('text', '') for part in (candidate.get('content') or {}).get('parts', []))
+        pieces = text_pieces(text) or ['']
+        for i, piece in enumerate(pieces):
+            chunk = {'candidates': [{'content': {'parts': [{'text': piece}], 'role': 'model'}, 'index': 0}],
+                     'modelVersion': response.get('modelVersion')}
+            if i == len(pieces) - 1:
+                chunk['candidates'][0]['finishReason'] = candidate.get('finishReason', 'STOP')
+                chunk['usageMetadata'] = response.get('usageMetadata')
+            yield None, chunk, estimate_tokens(piece)
+        return
+
+    # OpenAI and Azure AI Inference
+    choice = (response.get('choices') or [{}])[0]
+    base = {'id': response.get('id'), 'object': 'chat.completion.chunk', 'created': response.get('created', int(time.time())),
+            'model': response.get('model')}
+    yield None, dict(base, choices=[{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}]), 0
+    for piece in text_pieces((choice.get('message') or {}).get('content')):
+        yield None, dict(base, choices=[{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]), estimate_tokens(piece)
+    yield None, dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': choice.get('finish_reason', 'stop')}]), 0
+    yield None, dict(base, choices=[], usage=response.get('usage')), 0
+    yield None, '[DONE]', 0
+
+
+def pseudo_embedding(text) -> list:
+    """
+    Unit-length vector derived from a hash of the text, so equal texts embed equally.
+    """
+    import numpy as np
+    seed = int.from_bytes(hashlib.sha256(str(text).encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+def output_token_count(provider, endpoint, response) -> int:
+    usage = response.get('usageMetadata' if provider == 'gemini' else 'usage') or {}
+    return int(usage.get('candidatesTokenCount') or usage.get('output_tokens') or usage.get('completion_tokens') or 0)
+
+
+def parse_multipart(content_type, raw):
+    """
+    (filename, purpose, file bytes) of a multipart/form-data file upload.
+    """
+    from email import policy
+    from email.parser import BytesParser
+    message = BytesParser(policy=policy.default).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + raw)
+    filename, fields = None, {}
+    for part in message.iter_parts():
+        filename = part.get_filename() or filename
+        fields[part.get_param('name', header='content-disposition')] = part.get_payload(decode=True) or b''
+    return filename, fields.get('purpose', b'').decode('utf-8'), fields.get('file', b'')
+
+
+def rate_limit_error(provider) -> dict:
+    if provider == 'anthropic':
+        return {'type': 'error', 'error': {'type': 'rate_limit_error', 'message': 'Stand-in injected rate limit'}}
+    if provider == 'gemini':
+        return {'error': {'code': 429, 'message': 'Stand-in injected rate limit', 'status': 'RESOURCE_EXHAUSTED'}}
+    return {'error': {'message': 'Stand-in injected rate limit', 'type': 'requests', 'code': 'rate_limit_exceeded'}}
+
+
+def add_server_arguments(parser):
+    """
+    Stand-in options shared by this CLI and the throughput benchmark.
+    """
+    parser.add_argument('--recordings', type=str, default=DEFAULT_RECORDINGS, help='JSONL file of recorded responses')
+    parser.add_argument('--mode', type=str, default='replay', choices=['replay', 'record'], help='Replay recordings or record from the real APIs (default: replay)')
+    parser.add_argument('--latency_ms', type=float, default=500.0, help='Base latency per response in ms (default: 500)')
+    parser.add_argument('--jitter_ms', type=float, default=250.0, help='Uniform random extra latency in ms (default: 250)')
+    parser.add_argument('--ms_per_output_token', type=float, default=0.0, help='Extra latency per output token in ms')
+    parser.add_argument('--input_tokens', type=int, default=None, help='Report this many input tokens per response')
+    parser.add_argument('--output_tokens', type=int, default=None, help='Report this many output tokens per response')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Share of requests answered with HTTP 429 (default: 0)')
+    parser.add_argument('--retry_after', type=float, default=1.0, help='Retry-After seconds on injected 429s (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for jitter and error injection')
+
+
+def server_from_args(args, port=0):
+    return StandInServer(
+        port=port,
+        recordings=args.recordings,
+        mode=args.mode,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        ms_per_output_token=args.ms_per_output_token,
+        input_tokens=args.input_tokens,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline stand-in for the OpenAI, Anthropic, Gemini and Azure APIs')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on (default: 8765)')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = server_from_args(args, port=args.port).start()
+    print(f"Stand-in listening on {server.url} ({args.mode} mode). Point the SDKs at it with:")
+    for name, value in server.env().items():
+        print(f"  export {name}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"\nRequests: {server.stats()}")
+        server.stop()
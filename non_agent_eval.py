@@ -2,26 +2,71 @@
 # evalute both Claude 3.5 Sonnet and GPT-4o, using Claude 3.5 Sonnet as the judge 
 
 from dotenv import load_dotenv
-from openai import OpenAI
-from google import genai
-from azure.ai.inference import ChatCompletionsClient
-from azure.ai.inference.models import SystemMessage, UserMessage
-from azure.core.credentials import AzureKeyCredential
-import anthropic
+from functools import lru_cache
+from llm_cache import print_llm_cache_stats
+from batch_judge import DEFAULT_BATCH_SIZE, judge_items, judge_single
+from results_sink import ResultSink, result_paths
+from config import AZURE_INFERENCE_ENDPOINT, GEMINI_BASE_URL
+from streaming import TokenStream, stream_anthropic, stream_azure, stream_gemini, stream_openai
+from resilience import OutputGuard, print_retry_stats, with_retries
+from tracing import default_trace_path, tracer
 import pandas as pd
 import os
+import time
 import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
 
 load_dotenv()
-oai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-claude_client = anthropic.Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
-gemini_client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
-azure_client = ChatCompletionsClient(
-    endpoint="https://aistudioaiservices636633355478.services.ai.azure.com/models",
-    credential=AzureKeyCredential(os.getenv('AZURE_API_KEY'))
-)
+
+# provider behind each generated-answer model, and its column name in significance_test.R
+MODEL_PROVIDERS = {
+    "gpt-4o": "openai",
+    "claude-3-7": "anthropic",
+    "gemini-2.5-flash": "gemini",
+    "DeepSeek-R1": "azure",
+}
+SIGNIFICANCE_COLUMNS = {
+    "gpt-4o": "gpt_4o",
+    "claude-3-7": "claude_3_7",
+    "gemini-2.5-flash": "gemini_2_5",
+    "DeepSeek-R1": "deepseek_R1",
+}
+# verdict of an answer saved to the sink before it was judged; a resumed run judges it without regenerating it
+PENDING_VERDICT = "PENDING"
+
+# concurrent requests per provider in a multi-model run; "judge" bounds the OpenAI judge calls
+DEFAULT_CONCURRENCY = {"openai": 8, "anthropic": 4, "gemini": 8, "azure": 2, "judge": 8}
+
+@lru_cache(maxsize=None)
+def get_client(provider):
+    """
+    Build the API client for a provider on first use, importing its SDK only then.
+    Running one model no longer requires the other three SDKs or their API keys.
+    SDK retries are off; generate_single_answer retries through resilience.with_retries.
+    """
+    if provider == "openai":
+        from openai import OpenAI
+        return OpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
+    if provider == "anthropic":
+        import anthropic
+        return anthropic.Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'), max_retries=0)
+    if provider == "gemini":
+        from google import genai
+        if GEMINI_BASE_URL:
+            return genai.Client(api_key=os.getenv('GEMINI_API_KEY'),
+                                http_options=genai.types.HttpOptions(base_url=GEMINI_BASE_URL))
+        return genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
+    if provider == "azure":
+        from azure.ai.inference import ChatCompletionsClient
+        from azure.core.credentials import AzureKeyCredential
+        return ChatCompletionsClient(
+            endpoint=AZURE_INFERENCE_ENDPOINT,
+            credential=AzureKeyCredential(os.getenv('AZURE_API_KEY')),
+            retry_total=0
+        )
+    raise ValueError(f"Unsupported provider: {provider}")
 
 class NonAgentEval:
     def __init__(self, qa_df):
@@ -35,117 +80,288 @@ class NonAgentEval:
         answers = []
 
         for _, row in selected_qa.iterrows():
-            question = row['Question']
-            answer = None
+            answers.append(self.generate_single_answer(row['Question'], model_name))
+            
+        return answers
+
+    def generate_single_answer(self, question, model_name, on_token=None):
+        """
+        Generate the answer to one question using the specified model
+        With `on_token`, the answer is streamed to it as it is generated. Rate limits and
+        transient errors are retried, a streamed answer only until its first text arrived.
+        """
+        answer = None
+        guard = OutputGuard(on_token) if on_token is not None else None
+        prompt = f"please provide a short and concise answer to the following question: {question}"
 
+        with tracer.span("answer", model=model_name) as span:
             if model_name == "gpt-4o":
-                response = oai_client.chat.completions.create(
-                    model="gpt-4o-2024-11-20",
-                    messages=[{"role": "user", 
-                            "content": f"please provide a short and concise answer to the following question: {question}"}],
-                    temperature=0.0,
-                )
-                answer = response.choices[0].message.content
+                params = dict(model="gpt-4o-2024-11-20", messages=[{"role": "user", "content": prompt}], temperature=0.0)
+                if guard is not None:
+                    answer, usage = with_retries("openai", params["model"], lambda: stream_openai(get_client("openai"), guard, **params), guard)
+                else:
+                    response = with_retries("openai", params["model"], lambda: get_client("openai").chat.completions.create(**params))
+                    answer, usage = response.choices[0].message.content, response.usage
 
             elif model_name == "claude-3-7":
-                response = claude_client.messages.create(
-                    model="claude-3-7-sonnet-20250219",
-                    max_tokens=500,
-                    messages=[{"role": "user", 
-                            "content": f"please provide a short and concise answer to the following question: {question}"}],
-                    temperature=0.0,
-                )
-                answer = response.content[0].text
+                params = dict(model="claude-3-7-sonnet-20250219", max_tokens=500,
+                              messages=[{"role": "user", "content": prompt}], temperature=0.0)
+                if guard is not None:
+                    response = with_retries("anthropic", params["model"], lambda: stream_anthropic(get_client("anthropic"), guard, **params), guard)
+                else:
+                    response = with_retries("anthropic", params["model"], lambda: get_client("anthropic").messages.create(**params))
+                answer, usage = response.content[0].text, response.usage
 
             elif model_name == "gemini-2.5-flash":
-                response = gemini_client.models.generate_content(
-                    model="gemini-2.5-flash-preview-04-17",
-                    contents=f"please provide a short and concise answer to the following question: {question}"
-                )
-                answer = response.text
+                params = dict(model="gemini-2.5-flash-preview-04-17", contents=prompt)
+                if guard is not None:
+                    answer, usage = with_retries("gemini", params["model"], lambda: stream_gemini(get_client("gemini"), guard, **params), guard)
+                else:
+                    response = with_retries("gemini", params["model"], lambda: get_client("gemini").models.generate_content(**params))
+                    answer, usage = response.text, response.usage_metadata
 
             elif model_name == "DeepSeek-R1":
-                response = azure_client.complete(
+                from azure.ai.inference.models import SystemMessage, UserMessage
+                params = dict(
                     messages=[
                         SystemMessage(content="You are a helpful assistant."),
-                        UserMessage(content=f"please provide a short and concise answer to the following question: {question}")
+                        UserMessage(content=prompt)
                     ],
                     max_tokens=2048,
                     model="DeepSeek-R1"
                 )
-                answer_raw = response.choices[0].message.content
+                if guard is not None:
+                    # only the text after the reasoning block reaches the caller
+                    answer_raw, usage = with_retries("azure", params["model"], lambda: stream_azure(get_client("azure"), guard, hide_before="</think>", **params), guard)
+                else:
+                    response = with_retries("azure", params["model"], lambda: get_client("azure").complete(**params))
+                    answer_raw, usage = response.choices[0].message.content, response.usage
                 answer = answer_raw.split("</think>")[1].strip()
-            
+        
             else:
                 raise ValueError(f"Unsupported model: {model_name}")
 
-            answers.append(answer)
-            
-        return answers
+            span.set_usage(usage)
+
+        return answer
+
+    def stream_answer(self, question, model_name):
+        """
+        Iterate over the answer of one model as it is generated; the full answer is `.result` afterwards.
+        """
+        return TokenStream(lambda on_token: self.generate_single_answer(question, model_name, on_token=on_token))
 
 
     def evaluate_single_answer(self, question, generated_answer, expected_answer):
         """
         Send the comparison task to Claude to evaluate if the answers match in meaning
         """
-        prompt = f"""
-        Compare these two answers to the question: "{question}"
-        
-        Generated answer: {generated_answer}
-        Expected answer: {expected_answer}
-        
-        Does the generated answer contain the same key information as the expected answer? 
-        Respond with only 'YES' or 'NO'.
-        """
-        
-        response = oai_client.chat.completions.create(
-            model="gpt-4o-2024-11-20",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0
-        )
-        
-        # Extract just the text from the response
-        return response.choices[0].message.content
+        return judge_single(get_client("openai"), question, generated_answer, expected_answer)
     
-    def evaluate_batch(self, start_idx, end_idx, model_name):
+    def evaluate_batch(self, start_idx, end_idx, model_name, resume=None, judge_mode="single",
+                       batch_size=DEFAULT_BATCH_SIZE):
         """
         Evaluate a batch of questions and save results
+        Each result is appended to a JSONL sink as soon as it is judged; `resume` continues an earlier run.
+        With judge_mode 'batch', answers are judged `batch_size` at a time in one request; with
+        'offline', all answers are generated first and judged by one OpenAI batch job. In both modes each
+        answer is saved to the sink as soon as it is generated, so a resumed run only judges it.
         """
         if model_name == "asco_assistant":
             # Load pre-generated answers from CSV file
             df = pd.read_csv('results/asco_assistant_20250528.csv')
             selected_df = df.iloc[start_idx:end_idx]
-            model_answers = selected_df['generated_answer'].tolist()
+            pregenerated_answers = dict(zip(selected_df.index, selected_df['generated_answer']))
             
             # Create a mock qa dataframe with the questions and expected answers from the CSV
             selected_qa = pd.DataFrame({
                 'Question': selected_df['question'].tolist(),
                 'Answer': selected_df['expected_answer'].tolist()
-            })
+            }, index=selected_df.index)
         else:
-            model_answers = self.generate_answer(start_idx, end_idx, model_name)
+            pregenerated_answers = None
             selected_qa = self.qa_df.iloc[start_idx:end_idx]
         
-        results = []
-        for i, (_, row) in enumerate(selected_qa.iterrows()):
-            question = row['Question']
-            expected = row['Answer']
-            
-            match = self.evaluate_single_answer(question, model_answers[i], expected)
-            
-            results.append({
-                'question': question,
-                'expected_answer': expected,
-                f'{model_name}_answer': model_answers[i],
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        output_file, sink_path = result_paths(
+            f'results/non_agent_evaluation_results_{model_name}_{timestamp}.csv', resume
+        )
+        sink = ResultSink(sink_path)
+        done = sink.completed()
+        saved_answers = {idx: record[f'{model_name}_answer'] for idx, record in done.items()
+                         if record.get(f'{model_name}_match') == PENDING_VERDICT}
+        done = {idx: record for idx, record in done.items() if idx not in saved_answers}
+        if done or saved_answers:
+            print(f"Resuming from {sink_path}: {len(done)} questions already evaluated, "
+                  f"{len(saved_answers)} answers waiting for a verdict")
+
+        def append_result(idx, item, match):
+            sink.append({
+                'question_index': int(idx),
+                'question': item["question"],
+                'expected_answer': item["expected_answer"],
+                f'{model_name}_answer': item["generated_answer"],
                 f'{model_name}_match': match
             })
+
+        pending = [(idx, row) for idx, row in selected_qa.iterrows() if idx not in done]
+        if judge_mode == "single":
+            chunk_size = 1
+        elif judge_mode == "batch":
+            chunk_size = batch_size
+        else:
+            chunk_size = max(len(pending), 1)
+
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            items = []
+            for idx, row in chunk:
+                if pregenerated_answers is not None:
+                    answer = pregenerated_answers[idx]
+                elif idx in saved_answers:
+                    answer = saved_answers[idx]
+                else:
+                    with tracer.context(question_index=int(idx)):
+                        answer = self.generate_single_answer(row['Question'], model_name)
+                item = {"question": row['Question'], "generated_answer": answer, "expected_answer": row['Answer']}
+                if judge_mode != "single" and pregenerated_answers is None and idx not in saved_answers:
+                    # the answer is not cached anywhere else; keep it while it waits for its verdict
+                    append_result(idx, item, PENDING_VERDICT)
+                items.append(item)
+
+            if judge_mode == "single":
+                matches = []
+                for (idx, _), item in zip(chunk, items):
+                    with tracer.context(question_index=int(idx)):
+                        matches.append(self.evaluate_single_answer(item["question"], item["generated_answer"], item["expected_answer"]))
+            else:
+                matches = judge_items(get_client("openai"), items, judge_mode, batch_size)
+
+            for (idx, _), item, match in zip(chunk, items, matches):
+                append_result(idx, item, match)
         
-        results_df = pd.DataFrame(results)
+        results = [r for r in sink.records() if r['question_index'] in selected_qa.index]
+        results_df = pd.DataFrame(results).drop(columns=['question_index'])
+        results_df.to_csv(output_file, index=False)
+        print(f"Results saved to {output_file}")
+        return results_df
+
+    def evaluate_models(self, start_idx, end_idx, model_names, concurrency=None, resume=None):
+        """
+        Send every question to every model at once and judge each answer as soon as it arrives.
+        Each provider gets its own thread pool, sized by `concurrency` (provider -> limit, merged
+        over DEFAULT_CONCURRENCY), so a slow or rate-limited provider does not hold up the others.
+        Results go to one wide CSV with `<model>_answer` and `<model>` (YES/NO) columns, named as in
+        significance_test.R.
+        """
+        unknown = [model for model in model_names if model not in MODEL_PROVIDERS]
+        if unknown:
+            raise ValueError(f"Unsupported model(s) for a multi-model run: {', '.join(unknown)}")
+        limits = dict(DEFAULT_CONCURRENCY, **(concurrency or {}))
+        selected_qa = self.qa_df.iloc[start_idx:end_idx]
+
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        output_file = f'results/non_agent_evaluation_results_{model_name}_{timestamp}.csv'
+        output_file, sink_path = result_paths(
+            f'results/non_agent_evaluation_results_multi_{timestamp}.csv', resume
+        )
+        sink = ResultSink(sink_path, key_fields=('question_index', 'model'))
+        # failed answers are retried on resume
+        done = {key for key, record in sink.completed().items()
+                if not str(record['match']).startswith('ERROR')}
+        if done:
+            print(f"Resuming from {sink_path}: {len(done)} answers already evaluated")
+
+        providers = sorted({MODEL_PROVIDERS[model] for model in model_names})
+        pools = {provider: ThreadPoolExecutor(max_workers=limits[provider]) for provider in providers}
+        judge_pool = ThreadPoolExecutor(max_workers=limits["judge"])
+        elapsed = {}
+        run_start = time.perf_counter()
+        try:
+            futures = {}
+            for idx, row in selected_qa.iterrows():
+                for model in model_names:
+                    if (int(idx), model) in done:
+                        continue
+                    generate = tracer.bind(self.generate_single_answer, question_index=int(idx))
+                    future = pools[MODEL_PROVIDERS[model]].submit(generate, row['Question'], model)
+                    futures[future] = ('answer', idx, row, model, None)
+
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, idx, row, model, answer = futures.pop(future)
+                    if stage == 'answer':
+                        try:
+                            answer = future.result()
+                        except Exception as e:
+                            match = f"ERROR - {str(e)}"
+                        else:
+                            evaluate = tracer.bind(self.evaluate_single_answer, question_index=int(idx), answer_model=model)
+                            judge = judge_pool.submit(evaluate, row['Question'], answer, row['Answer'])
+                            futures[judge] = ('judge', idx, row, model, answer)
+                            continue
+                    else:
+                        try:
+                            match = future.result()
+                        except Exception as e:
+                            match = f"ERROR - {str(e)}"
+                    sink.append({
+                        'question_index': int(idx),
+                        'model': model,
+                        'question': row['Question'],
+                        'expected_answer': row['Answer'],
+                        'answer': answer,
+                        'match': match
+                    })
+                    elapsed[model] = time.perf_counter() - run_start
+        finally:
+            for pool in list(pools.values()) + [judge_pool]:
+                pool.shutdown(wait=True, cancel_futures=True)
+
+        wall_time = time.perf_counter() - run_start
+        print(f"\nFan-out finished in {wall_time:.1f}s")
+        for model in model_names:
+            if model in elapsed:
+                print(f"  {model} ({MODEL_PROVIDERS[model]}, {limits[MODEL_PROVIDERS[model]]} concurrent): "
+                      f"last answer after {elapsed[model]:.1f}s")
+
+        results_df = self.to_wide_frame(sink.records(), selected_qa, model_names)
         results_df.to_csv(output_file, index=False)
+        print(f"Results saved to {output_file}")
         return results_df
 
+    @staticmethod
+    def to_wide_frame(records, selected_qa, model_names):
+        """
+        One row per question, with an answer and a YES/NO match column per model.
+        """
+        by_question = {}
+        for record in records:
+            by_question.setdefault(record['question_index'], {})[record['model']] = record
+        rows = []
+        for idx, row in selected_qa.iterrows():
+            wide = {'question': row['Question'], 'expected_answer': row['Answer']}
+            results = by_question.get(int(idx), {})
+            for model in model_names:
+                column = SIGNIFICANCE_COLUMNS[model]
+                wide[f'{column}_answer'] = results.get(model, {}).get('answer')
+                wide[column] = results.get(model, {}).get('match')
+            rows.append(wide)
+        return pd.DataFrame(rows)
+
+
+def parse_concurrency(spec):
+    """
+    Parse "openai=8,anthropic=4" into {"openai": 8, "anthropic": 4}.
+    """
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        provider, _, value = part.partition('=')
+        if provider not in DEFAULT_CONCURRENCY or not value.isdigit() or int(value) < 1:
+            raise argparse.ArgumentTypeError(f"Invalid concurrency limit: {part}")
+        limits[provider] = int(value)
+    return limits
+
 
 if __name__ == "__main__":
     # Set up argument parser
@@ -153,31 +369,57 @@ if __name__ == "__main__":
     parser.add_argument('--start', type=int, default=0, help='Starting index for evaluation')
     parser.add_argument('--end', type=int, help='Ending index for evaluation (defaults to all questions)')
     parser.add_argument('--model', type=str, default="gpt-4o", help='Model to evaluate (gpt-4o, claude-3-7, gemini-2.5-flash, DeepSeek-R1, or asco_assistant)')
+    parser.add_argument('--models', type=str, default=None, help='Comma-separated models to evaluate concurrently into one wide results file (e.g. gpt-4o,claude-3-7,gemini-2.5-flash,DeepSeek-R1)')
+    parser.add_argument('--concurrency', type=parse_concurrency, default=None, help='Per-provider request limits for --models, e.g. openai=8,anthropic=4,gemini=8,azure=2,judge=8')
+    parser.add_argument('--resume', type=str, default=None, help='Results file (.jsonl or .csv) of an interrupted run to continue')
+    parser.add_argument('--judge', type=str, default='single', choices=['single', 'batch', 'offline'], help='Judge one answer per request, many per request, or as an offline batch job (default: single)')
+    parser.add_argument('--judge_batch_size', type=int, default=DEFAULT_BATCH_SIZE, help='Answers per batched judge request (default: 20)')
     args = parser.parse_args()
-    
-    if args.model == "asco_assistant":
-        # For asco_assistant, we don't need to load qa_df, we'll use the CSV file
-        evaluator = NonAgentEval(None)
-        
-        # Load the CSV to get the length for end_idx
-        df = pd.read_csv('results/asco_assistant_20250528.csv')
-        end_idx = args.end if args.end is not None else len(df)
-    else:
-        # Load the QA dataset for other models
+
+    if args.models:
+        model_names = [model.strip() for model in args.models.split(',') if model.strip()]
         qa_df = pd.read_csv('data/q_a.csv')
         evaluator = NonAgentEval(qa_df)
         end_idx = args.end if args.end is not None else len(qa_df)
+        try:
+            print(f"Processing questions from index {args.start} to {end_idx} using {', '.join(model_names)}...")
+            results = evaluator.evaluate_models(args.start, end_idx, model_names,
+                                                concurrency=args.concurrency, resume=args.resume)
+            print(f"\nFinal results:")
+            for model in model_names:
+                column = SIGNIFICANCE_COLUMNS[model]
+                print(f"{model} matches: {(results[column] == 'YES').sum()}/{len(results)}")
+        except Exception as e:
+            print(f"An error occurred: {str(e)}")
+
+    else:
+        if args.model == "asco_assistant":
+            # For asco_assistant, we don't need to load qa_df, we'll use the CSV file
+            evaluator = NonAgentEval(None)
+        
+            # Load the CSV to get the length for end_idx
+            df = pd.read_csv('results/asco_assistant_20250528.csv')
+            end_idx = args.end if args.end is not None else len(df)
+        else:
+            # Load the QA dataset for other models
+            qa_df = pd.read_csv('data/q_a.csv')
+            evaluator = NonAgentEval(qa_df)
+            end_idx = args.end if args.end is not None else len(qa_df)
     
-    try:
-        # Process questions within specified range
-        print(f"Processing questions from index {args.start} to {end_idx} using {args.model}...")
-        results = evaluator.evaluate_batch(args.start, end_idx, args.model)
+        try:
+            # Process questions within specified range
+            print(f"Processing questions from index {args.start} to {end_idx} using {args.model}...")
+            results = evaluator.evaluate_batch(args.start, end_idx, args.model, resume=args.resume,
+                                               judge_mode=args.judge, batch_size=args.judge_batch_size)
         
-        # Print final results
-        print(f"\nFinal results:")
-        print(f"{args.model} matches: {(results[f'{args.model}_match'] == 'YES').sum()}/{len(results)}")
+            # Print final results
+            print(f"\nFinal results:")
+            print(f"{args.model} matches: {(results[f'{args.model}_match'] == 'YES').sum()}/{len(results)}")
             
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
+        except Exception as e:
+            print(f"An error occurred: {str(e)}")
     
-    print(f"\nEvaluation complete. Results saved to results/non_agent_evaluation_results_{args.model}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv")
\ No newline at end of file
+    print_llm_cache_stats()
+    print_retry_stats()
+    tracer.finish(default_trace_path())
+    print(f"\nEvaluation complete.")
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Relevant-Page Slicing
+Builds a page-level BM25 index for each guideline PDF and, for a given prompt, a smaller PDF
+made of the best-scoring pages plus their neighbours. process_pdf sends that PDF instead of the
+whole guideline, and falls back to the full document when the match is weak.
+"""
+
+import base64
+import io
+import os
+import threading
+from pypdf import PdfReader, PdfWriter
+from bm25 import BM25Index
+from text_store import get_text_store
+
+# pages picked by score, plus this many pages before and after each of them
+TOP_PAGES = 2
+NEIGHBOR_PAGES = 1
+# below this score / best-possible-score the full document is sent
+MIN_CONFIDENCE = 0.25
+# slicing is skipped when the selection would keep more than this share of the pages
+MAX_PAGE_FRACTION = 0.6
+
+
+def extract_page_texts(pdf_path: str) -> list:
+    """
+    Text of every page, read from the shared text store (text_store.py), which parses the PDF only once.
+    """
+    return get_text_store().pages_for_file(pdf_path)
+
+
+class PageIndex:
+    """
+    BM25 index over the pages of one guideline PDF.
+    """
+
+    def __init__(self, pdf_path: str, pages: list):
+        self.pdf_path = pdf_path
+        self.pages = pages
+        self.bm25 = BM25Index(pages)
+
+    def select_pages(self, prompt: str, top_pages=TOP_PAGES, neighbor_pages=NEIGHBOR_PAGES):
+        """
+        Pick the pages to send for `prompt`.
+
+        Returns:
+            tuple: (sorted page numbers, confidence between 0 and 1)
+        """
+        scores = self.bm25.scores(prompt)
+        max_score = float(self.bm25.max_scores([prompt])[0])
+        if max_score <= 0 or len(self.pages) == 0:
+            return [], 0.0
+
+        best = scores.argsort()[::-1][:top_pages]
+        confidence = float(scores[best[0]]) / max_score
+
+        # always keep the first page, which carries the title and guideline question
+        selected = {0}
+        for page in best:
+            if scores[page] <= 0:
+                continue
+            for neighbor in range(page - neighbor_pages, page + neighbor_pages + 1):
+                if 0 <= neighbor < len(self.pages):
+                    selected.add(neighbor)
+        return sorted(selected), confidence
+
+    def build_pdf(self, pages: list) -> str:
+        """
+        Write the given pages into a new PDF and return it base64-encoded.
+        """
+        reader = PdfReader(self.pdf_path)
+        writer = PdfWriter()
+        for page in pages:
+            writer.add_page(reader.pages[page])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+_page_indices = {}
+_page_indices_lock = threading.Lock()
+
+
+def get_page_index(pdf_path: str) -> PageIndex:
+    """
+    Process-wide PageIndex for a PDF, rebuilt when the file changes.
+    """
+    path = os.path.abspath(pdf_path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _page_indices_lock:
+        page_index = _page_indices.get(key)
+    if page_index is None:
+        page_index = PageIndex(path, extract_page_texts(path))
+        with _page_indices_lock:
+            _page_indices[key] = page_index
+    return page_index
+
+
+def sliced_pdf_payload(pdf_path: str, prompt: str):
+    """
+    Base64 PDF holding only the pages relevant to `prompt`.
+
+    Returns:
+        tuple: (payload or None when the full document should be sent, selected pages, confidence)
+    """
+    page_index = get_page_index(pdf_path)
+    pages, confidence = page_index.select_pages(prompt)
+    if confidence < MIN_CONFIDENCE or len(pages) > MAX_PAGE_FRACTION * len(page_index.pages):
+        return None, pages, confidence
+    return page_index.build_pdf(pages), pages, confidence
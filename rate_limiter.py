@@ -0,0 +1,88 @@
+"""
+Token-bucket rate limiting for the evaluation runners.
+Requests are admitted against a requests-per-minute budget and an input-tokens-per-minute
+budget, so concurrent workers only wait as long as the provider limits actually require.
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    A bucket that refills continuously at `per_minute` units per minute, up to `capacity`.
+    Not thread-safe on its own; RateLimiter guards it with a lock.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        Seconds until `amount` units are available (0 if they are available now).
+        """
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+class RateLimiter:
+    """
+    Combined requests-per-minute and input-tokens-per-minute limiter shared by worker threads.
+
+    Args:
+        requests_per_minute (float): Request budget, or None for no request limit
+        input_tokens_per_minute (float): Input token budget, or None for no token limit
+    """
+
+    def __init__(self, requests_per_minute=None, input_tokens_per_minute=None):
+        self.buckets = {}
+        if requests_per_minute:
+            self.buckets['requests'] = TokenBucket(requests_per_minute)
+        if input_tokens_per_minute:
+            self.buckets['tokens'] = TokenBucket(input_tokens_per_minute)
+        self.lock = threading.Lock()
+
+    def acquire(self, requests=1, tokens=0):
+        """
+        Block until both budgets can cover the given amounts, then consume them.
+        Amounts larger than a bucket's capacity wait for a full bucket instead of blocking forever.
+
+        Returns:
+            float: Total seconds spent waiting
+        """
+        amounts = {'requests': requests, 'tokens': tokens}
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = 0.0
+                for name, bucket in self.buckets.items():
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_time(amounts[name]))
+                if wait == 0.0:
+                    for name, bucket in self.buckets.items():
+                        bucket.level -= min(amounts[name], bucket.capacity)
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def adjust_tokens(self, delta):
+        """
+        Correct the token budget once the real usage is known.
+        A positive delta means more tokens were used than estimated and puts the bucket into debt.
+        """
+        bucket = self.buckets.get('tokens')
+        if bucket is None:
+            return
+        with self.lock:
+            bucket.refill(time.monotonic())
+            bucket.level = min(bucket.capacity, bucket.level - delta)
@@ -0,0 +1,251 @@
+"""
+Resilient Provider Calls
+Shared retry and concurrency layer for every model API call. Failures are classified: rate limits,
+overload, timeouts, connection errors and 5xx responses are retried with full-jitter exponential
+backoff, waiting at least as long as the response's Retry-After header asks; bad requests and
+authentication errors are raised at once. Each (provider, model) has an AIMD concurrency limit:
+a rate-limit or overload error halves it, and a window of successes raises it by one, so concurrent
+workers settle near the provider's ceiling without a hand-tuned --interval.
+
+    text = with_retries("openai", model, lambda: client.chat.completions.create(...))
+
+The SDK clients are created with their own retries turned off, so every retry goes through here.
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from config import (LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MAX, RETRY_BASE_DELAY, RETRY_MAX_ATTEMPTS,
+                    RETRY_MAX_DELAY)
+from tracing import tracer
+
+# error classes; the first two also shrink the concurrency limit
+RATE_LIMIT = 'rate_limit'
+OVERLOADED = 'overloaded'
+TIMEOUT = 'timeout'
+CONNECTION = 'connection'
+SERVER = 'server'
+
+STATUS_CLASSES = {408: TIMEOUT, 409: SERVER, 429: RATE_LIMIT, 500: SERVER, 502: SERVER, 503: OVERLOADED,
+                  504: TIMEOUT, 529: OVERLOADED}
+TIMEOUT_ERRORS = {'APITimeoutError', 'Timeout', 'TimeoutException', 'ReadTimeout', 'ConnectTimeout'}
+CONNECTION_ERRORS = {'APIConnectionError', 'ConnectError', 'RemoteProtocolError', 'ServiceRequestError',
+                     'ServiceResponseError'}
+
+
+def status_code(error):
+    """
+    HTTP status of an OpenAI, Anthropic, Azure (status_code) or Gemini (code) error, if any.
+    """
+    for attr in ('status_code', 'code'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def classify_error(error):
+    """
+    Retry class of an exception, or None if retrying cannot help.
+    """
+    status = status_code(error)
+    if status is not None:
+        return STATUS_CLASSES.get(status, SERVER if status >= 500 else None)
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & TIMEOUT_ERRORS or isinstance(error, TimeoutError):
+        return TIMEOUT
+    if names & CONNECTION_ERRORS or isinstance(error, ConnectionError):
+        return CONNECTION
+    return None
+
+
+def retry_after(error):
+    """
+    Seconds the provider asked to wait (retry-after-ms or Retry-After in seconds or as an HTTP date), or None.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, wait_hint=None, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """
+    Full-jitter exponential backoff for the given attempt (1 = first retry). With a Retry-After hint,
+    waits at least that long plus up to `base` seconds of jitter, so waiting workers do not return together.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    if wait_hint is not None:
+        delay = max(delay, wait_hint + random.uniform(0, base))
+    return delay
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one provider and model. Calls wait for a free slot; every `limit`
+    successes in a row add one slot, and a rate-limit or overload error halves the limit (once per
+    burst: calls that started before the last decrease do not decrease it again). A Retry-After
+    hint also pauses new calls to this model until it has passed.
+
+    Args:
+        initial (int): Starting limit
+        maximum (int): Upper bound of the limit
+        minimum (int): Lower bound of the limit
+    """
+
+    def __init__(self, initial=LLM_CONCURRENCY_INITIAL, maximum=LLM_CONCURRENCY_MAX, minimum=1):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+        self.stats = {'calls': 0, 'retries': 0, 'rate_limited': 0, 'failed': 0, 'peak_in_flight': 0,
+                      'min_limit': self.limit, 'max_limit': self.limit, 'wait_s': 0.0}
+
+    def acquire(self) -> float:
+        """
+        Wait for a slot and take it. Returns the start time, which `release` needs.
+        """
+        start = time.monotonic()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                elif self.in_flight >= self.limit:
+                    self.condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+            self.stats['calls'] += 1
+            self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.in_flight)
+            self.stats['wait_s'] += now - start
+            return now
+
+    def release(self, started, error_class=None, wait_hint=None):
+        """
+        Free the slot of a call that started at `started` and adapt the limit to its outcome.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if error_class is None:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            elif error_class in (RATE_LIMIT, OVERLOADED):
+                self.stats['rate_limited'] += 1
+                self.successes = 0
+                if started >= self.last_decrease:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.last_decrease = now
+                if wait_hint:
+                    self.paused_until = max(self.paused_until, now + wait_hint)
+            self.stats['min_limit'] = min(self.stats['min_limit'], self.limit)
+            self.stats['max_limit'] = max(self.stats['max_limit'], self.limit)
+            self.condition.notify_all()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(provider, model) -> AdaptiveLimiter:
+    """
+    Process-wide limiter of a provider and model, created on first use.
+    """
+    with _limiters_lock:
+        key = (provider, model)
+        if key not in _limiters:
+            _limiters[key] = AdaptiveLimiter()
+        return _limiters[key]
+
+
+class OutputGuard:
+    """
+    Wraps an `on_token` callback and records whether any text reached it. A streamed call is only
+    retried before that, so the caller never sees the start of an answer twice.
+    """
+
+    def __init__(self, on_token):
+        self.on_token = on_token
+        self.delivered = False
+
+    def __call__(self, text):
+        if text:
+            self.delivered = True
+        self.on_token(text)
+
+
+def with_retries(provider, model, call, guard=None, max_attempts=RETRY_MAX_ATTEMPTS):
+    """
+    Run `call()` under the limiter of (provider, model) and retry it on retryable errors.
+
+    Args:
+        provider (str): Provider name, e.g. "openai" or "anthropic"
+        model (str): Model name
+        call (callable): The API call; it is run again on each attempt
+        guard (OutputGuard): For streamed calls, stops retries once text was delivered
+        max_attempts (int): Attempts before the last error is raised
+    """
+    limiter = limiter_for(provider, model)
+    attempt = 1
+    while True:
+        started = limiter.acquire()
+        try:
+            result = call()
+        except Exception as e:
+            error_class = classify_error(e)
+            hint = retry_after(e) if error_class is not None else None
+            limiter.release(started, error_class, hint)
+            if error_class is None or attempt >= max_attempts or (guard is not None and guard.delivered):
+                with limiter.condition:
+                    limiter.stats['failed'] += 1
+                raise
+            delay = backoff_delay(attempt, hint)
+            with limiter.condition:
+                limiter.stats['retries'] += 1
+            span = tracer.current()
+            if span is not None:
+                span.set(retries=attempt, last_retry_error=error_class)
+            print(f"{provider}/{model}: {error_class} ({type(e).__name__}), "
+                  f"retry {attempt}/{max_attempts - 1} in {delay:.1f}s (concurrency limit {limiter.limit})")
+            time.sleep(delay)
+            attempt += 1
+        else:
+            limiter.release(started)
+            return result
+
+
+def print_retry_stats():
+    """
+    Per-model calls, retries, rate-limit errors and the range of the adaptive concurrency limit.
+    """
+    with _limiters_lock:
+        limiters = sorted(_limiters.items())
+    if not limiters:
+        return
+    print("\nProvider Calls:")
+    print("-" * 50)
+    for (provider, model), limiter in limiters:
+        stats = limiter.stats
+        print(f"{provider}/{model}: {stats['calls']} calls, {stats['retries']} retries, "
+              f"{stats['rate_limited']} rate limited, {stats['failed']} failed; concurrency limit "
+              f"{stats['min_limit']}-{stats['max_limit']} (now {limiter.limit}, peak in flight "
+              f"{stats['peak_in_flight']}), {stats['wait_s']:.1f}s waiting for a slot")
@@ -0,0 +1,91 @@
+"""
+Checkpointed Results
+Append-only JSONL sink that writes each evaluation result as soon as it is produced,
+so an interrupted run can be continued with --resume instead of starting over.
+"""
+
+import json
+import os
+import threading
+
+
+class ResultSink:
+    """
+    JSONL file with one result per line, keyed by the record's `question_index`.
+
+    Args:
+        path (str): Path of the .jsonl file; created on first append
+        key_fields (tuple): Record fields identifying a result; several fields give tuple keys
+            (e.g. ('question_index', 'model') when one run evaluates several models)
+    """
+
+    def __init__(self, path: str, key_fields=('question_index',)):
+        self.path = path
+        self.key_fields = tuple(key_fields)
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._terminate_partial_line()
+
+    def _terminate_partial_line(self):
+        """
+        End a line left incomplete by a crash, so the next record starts on a fresh line.
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb+') as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                file.write(b'\n')
+
+    def completed(self) -> dict:
+        """
+        Records already in the sink, by key. A truncated last line from a crash is ignored.
+        """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[self.key(record)] = record
+        return records
+
+    def key(self, record: dict):
+        if len(self.key_fields) == 1:
+            return record[self.key_fields[0]]
+        return tuple(record[field] for field in self.key_fields)
+
+    def append(self, record: dict):
+        """
+        Write one record and flush it to disk before returning.
+        """
+        line = json.dumps(record, default=str, ensure_ascii=False)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(line + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+
+    def records(self) -> list:
+        """
+        All records in key (question) order.
+        """
+        completed = self.completed()
+        return [completed[idx] for idx in sorted(completed)]
+
+
+def result_paths(default_csv_path: str, resume: str = None):
+    """
+    CSV and JSONL sink paths for a run. With `resume` (either file of an earlier run), the earlier
+    run's paths are reused; otherwise they are derived from `default_csv_path`.
+
+    Returns:
+        tuple: (csv_path, jsonl_path)
+    """
+    stem = os.path.splitext(resume if resume else default_csv_path)[0]
+    return f'{stem}.csv', f'{stem}.jsonl'
@@ -0,0 +1,171 @@
+"""
+Retrieval Benchmark
+Builds the RAG index with each retrieval backend and reports build time, index size on disk,
+resident memory after loading, peak RSS, per-question `query_index` latency and the time per question
+of one batched `retrieve_batch` over all questions. Every backend runs in its own
+process so the memory figures do not mix. The llama_index backend embeds and synthesizes through the
+offline stand-in (llm_standin.py), so no API calls leave the machine.
+
+    python retrieval_bench.py --synthetic_pdfs --questions 50
+    python retrieval_bench.py --backends numpy --embedding local --pdf_folder pdfs
+
+Backends:
+- llama_index: GPTVectorStoreIndex; a query is retrieval plus the query engine's LLM synthesis step
+- numpy: local VectorIndex (vector_index.py) with --embedding local or openai; a query is one
+  matrix-vector product over the memory-mapped vectors
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from llm_standin import add_server_arguments, server_from_args
+from throughput_bench import write_synthetic_pdfs
+
+BACKENDS = ('llama_index', 'numpy')
+RESULT_PREFIX = 'BENCH_RESULT '
+
+
+def current_rss_mb() -> float:
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def run_child(backend, args):
+    """
+    Build, load and query one backend in this process and print its result as one JSON line.
+    """
+    from RAG_eval import build_index_from_pdfs, query_index, retrieve_batch
+    questions = pd.read_csv(args.csv_path)['Question'].iloc[:args.questions].tolist()
+    baseline_rss = current_rss_mb()
+
+    persist_dir = tempfile.mkdtemp(prefix=f'retrieval_{backend}_')
+    start = time.perf_counter()
+    if backend == 'numpy':
+        from vector_index import VectorIndex, load_or_build_vector_index
+        pdf_paths = sorted(os.path.join(args.pdf_folder, f) for f in os.listdir(args.pdf_folder) if f.endswith('.pdf'))
+        load_or_build_vector_index(pdf_paths, persist_dir, args.chunk_size, args.embedding, use_store=False)
+        build_s = time.perf_counter() - start
+        # measure a fresh load, as a later run would see it
+        load_start = time.perf_counter()
+        index = VectorIndex(persist_dir)
+    else:
+        from llama_index.core import StorageContext, load_index_from_storage
+        index = build_index_from_pdfs(args.pdf_folder, args.chunk_size, use_cache=False)
+        index.storage_context.persist(persist_dir=persist_dir)
+        build_s = time.perf_counter() - start
+        del index
+        load_start = time.perf_counter()
+        index = load_index_from_storage(StorageContext.from_defaults(persist_dir=persist_dir))
+    load_s = time.perf_counter() - load_start
+    loaded_rss = current_rss_mb()
+
+    latencies = []
+    for question in questions:
+        query_start = time.perf_counter()
+        query_index(index, question)
+        latencies.append(time.perf_counter() - query_start)
+    batch_start = time.perf_counter()
+    retrieve_batch(index, questions)
+    batch_s = time.perf_counter() - batch_start
+
+    result = {
+        'backend': backend if backend != 'numpy' else f'numpy/{args.embedding}',
+        'questions': len(questions),
+        'build_s': round(build_s, 3),
+        'load_s': round(load_s, 4),
+        'index_mb': round(directory_bytes(persist_dir) / 1024 / 1024, 2),
+        'loaded_rss_delta_mb': round(loaded_rss - baseline_rss, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'query_p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 2) if latencies else None,
+        'query_p95_ms': round(float(np.percentile(latencies, 95)) * 1000, 2) if latencies else None,
+        'batch_ms_per_question': round(batch_s / len(questions) * 1000, 3) if questions else None,
+    }
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory and query latency of the RAG retrieval backends')
+    parser.add_argument('--backends', type=str, default=','.join(BACKENDS), help='Comma-separated backends (default: llama_index,numpy)')
+    parser.add_argument('--embedding', type=str, default='local', choices=['local', 'openai'], help='Embedder of the numpy backend (default: local)')
+    parser.add_argument('--csv_path', type=str, default='data/q_a.csv', help='Path to questions CSV')
+    parser.add_argument('--questions', type=int, default=50, help='Questions to query (default: 50)')
+    parser.add_argument('--pdf_folder', type=str, default='pdfs', help='Guideline PDFs to index')
+    parser.add_argument('--synthetic_pdfs', action='store_true', help='Generate text PDFs for every guideline in a temporary folder')
+    parser.add_argument('--chunk_size', type=int, default=1024, help='Chunk size in tokens (default: 1024)')
+    parser.add_argument('--output', type=str, default=None, help='JSON report path (default: results/retrieval_<timestamp>.json)')
+    parser.add_argument('--child', type=str, default=None, help=argparse.SUPPRESS)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args)
+        return
+
+    backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown:
+        parser.error(f"Unknown backend(s): {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory(prefix='retrieval_') as workdir, server_from_args(args) as server:
+        if args.synthetic_pdfs:
+            args.pdf_folder = os.path.join(workdir, 'pdfs')
+            print(f"Wrote {write_synthetic_pdfs(args.pdf_folder)} synthetic guideline PDFs to {args.pdf_folder}")
+        env = dict(os.environ, **server.env())
+        env['LLM_CACHE'] = '0'
+        # stand-in embeddings and the extracted text of the bench PDFs go to stores of their own, never the real ones
+        env['EMBEDDING_CACHE_PATH'] = os.path.join(workdir, 'embeddings.sqlite')
+        env['TEXT_STORE_DIR'] = os.path.join(workdir, 'text')
+        for key in ('OPENAI_API_KEY', 'ANTHROPIC_API_KEY'):
+            if not env.get(key):
+                env[key] = 'standin'
+
+        results = []
+        for backend in backends:
+            print(f"Running {backend} ({args.questions} questions)...")
+            command = [sys.executable, os.path.abspath(__file__), '--child', backend,
+                       '--embedding', args.embedding, '--csv_path', args.csv_path, '--questions', str(args.questions),
+                       '--pdf_folder', args.pdf_folder, '--chunk_size', str(args.chunk_size)]
+            process = subprocess.run(command, env=env, capture_output=True, text=True)
+            lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+            if process.returncode != 0 or not lines:
+                print(f"{backend} failed:\n{process.stderr[-2000:]}")
+                results.append({'backend': backend, 'failed': True})
+                continue
+            results.append(json.loads(lines[-1][len(RESULT_PREFIX):]))
+
+    print(f"\n{'backend':<16}{'build (s)':>10}{'load (s)':>10}{'index (MB)':>12}{'RSS +load (MB)':>16}"
+          f"{'peak RSS (MB)':>15}{'p50 (ms)':>10}{'p95 (ms)':>10}{'batch (ms/q)':>14}")
+    print("-" * 113)
+    for result in results:
+        if result.get('failed'):
+            print(f"{result['backend']:<16}  FAILED")
+            continue
+        print(f"{result['backend']:<16}{result['build_s']:>10.2f}{result['load_s']:>10.3f}{result['index_mb']:>12.2f}"
+              f"{result['loaded_rss_delta_mb']:>16.1f}{result['peak_rss_mb']:>15.1f}"
+              f"{result['query_p50_ms'] or 0:>10.2f}{result['query_p95_ms'] or 0:>10.2f}"
+              f"{result['batch_ms_per_question'] or 0:>14.3f}")
+
+    output = args.output or f"results/retrieval_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'args': {k: v for k, v in vars(args).items() if k != 'child'}, 'results': results}, file, indent=2)
+    print(f"Report saved to {output}")
+
+    if any(result.get('failed') for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Guideline-Grouped Scheduling
+Orders evaluation questions so that questions on the same guideline run close together in time.
+process_pdf marks the guideline PDF for Anthropic's prompt cache, whose entries expire after about
+five minutes without use; a question asked while its guideline is still cached reads the PDF at a
+tenth of the input price instead of paying for it again. Page slices (PDF_PAGE_SLICING) are not
+cached, so the CLI drivers turn slicing off when a grouped order is chosen (evaluate_answers.configure_page_slicing).
+
+Orders:
+- row: dataset order, every question on its own (the original behaviour)
+- expected: grouped by the dataset's Guideline column
+- routed: grouped by the local BM25 router's top guideline, i.e. the PDF the coordinator is likely to open
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+ORDERS = ('row', 'expected', 'routed')
+
+
+def group_by_key(indices, keys) -> list:
+    """
+    Group indices by keys[index]; groups are ordered by their first index and keep the index order within.
+    """
+    groups = {}
+    for idx in indices:
+        groups.setdefault(keys[idx], []).append(idx)
+    return list(groups.values())
+
+
+def guideline_groups(qa_df, indices, order='row', summaries_for=None) -> list:
+    """
+    Question indices grouped for scheduling.
+
+    Args:
+        qa_df (pd.DataFrame): QA dataset with Question and Guideline columns
+        indices (list): Question indices to schedule
+        order (str): One of ORDERS
+        summaries_for (callable): summaries_for(idx) -> guideline summaries the coordinator sees for
+            that question (e.g. with the correct one masked); routing uses all summaries if None
+
+    Returns:
+        list: Lists of question indices; running them group after group keeps each guideline warm
+    """
+    indices = list(indices)
+    if order == 'row':
+        return [[idx] for idx in indices]
+    if order == 'expected':
+        return group_by_key(indices, {idx: qa_df.loc[idx, 'Guideline'] for idx in indices})
+    if order == 'routed':
+        from guideline_router import GuidelineRouter
+        if summaries_for is None:
+            router = GuidelineRouter()
+            ranked = router.route_batch(qa_df.loc[indices, 'Question'].tolist(), k=1)
+            keys = {idx: (r[0][0] if r else None) for idx, r in zip(indices, ranked)}
+        else:
+            keys = {}
+            for idx in indices:
+                ranked = GuidelineRouter(summaries_for(idx)).route(qa_df.loc[idx, 'Question'], k=1)
+                keys[idx] = ranked[0][0] if ranked else None
+        return group_by_key(indices, keys)
+    raise ValueError(f"Unknown order: {order} (expected one of {', '.join(ORDERS)})")
+
+
+def describe_groups(groups) -> str:
+    sizes = [len(group) for group in groups]
+    return f"{sum(sizes)} questions in {len(groups)} groups (largest {max(sizes, default=0)})"
+
+
+def run_grouped(groups, task, max_workers, on_done):
+    """
+    Run task(idx) for every index with up to `max_workers` in flight. The first question of a group
+    runs alone and writes the cache; the rest of its group is released when it finishes and goes ahead
+    of questions from groups that have not started, so each group completes within a short window.
+
+    Args:
+        groups (list): Lists of indices, as returned by guideline_groups
+        task (callable): task(idx), run on the worker threads
+        max_workers (int): Number of tasks in flight
+        on_done (callable): on_done(idx, future), called on this thread as each task finishes
+    """
+    leaders = deque(groups)
+    released = deque()
+    followers = {}
+    in_flight = {}
+
+    def next_index():
+        if released:
+            return released.popleft()
+        if leaders:
+            group = leaders.popleft()
+            followers[group[0]] = group[1:]
+            return group[0]
+        return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(in_flight) < max_workers:
+                idx = next_index()
+                if idx is None:
+                    break
+                in_flight[executor.submit(task, idx)] = idx
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                idx = in_flight.pop(future)
+                released.extend(followers.pop(idx, []))
+                on_done(idx, future)
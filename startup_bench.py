@@ -0,0 +1,73 @@
+"""
+Startup Benchmark
+Measures the cold-start time of each CLI (`python <script> --help` in a fresh interpreter)
+and compares it with a target, so heavy eager imports do not creep back in.
+
+    python startup_bench.py --repeats 5
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# target cold-start time in seconds for each entry point
+TARGETS = {
+    'agent_eval.py': 1.0,
+    'evaluate_answers.py': 1.0,
+    'leave_one_out_eval.py': 1.0,
+    'non_agent_eval.py': 1.0,
+    'RAG_eval.py': 1.0,
+    'PDF_viewer_eval.py': 1.0,
+    'guideline_router.py': 1.0,
+    'sync_guidelines.py': 0.5,
+    'ask.py': 1.0,
+}
+
+
+def time_startup(script, repeats):
+    """
+    Wall-clock times of `python <script> --help`, one fresh process per run.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, script, '--help'], capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"{script} --help failed:\n{result.stderr}")
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CLI cold-start times')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs per script (default: 5)')
+    parser.add_argument('--scripts', type=str, default=None, help='Comma-separated subset of scripts to time')
+    args = parser.parse_args()
+
+    scripts = args.scripts.split(',') if args.scripts else list(TARGETS)
+    failures = 0
+    print(f"{'script':<24}{'median (s)':>12}{'min (s)':>10}{'target (s)':>12}  status")
+    print("-" * 66)
+    for script in scripts:
+        try:
+            times = time_startup(script, args.repeats)
+        except RuntimeError as e:
+            print(f"{script:<24}{'-':>12}{'-':>10}{TARGETS.get(script, 0):>12.2f}  ERROR")
+            print(e)
+            failures += 1
+            continue
+        median = statistics.median(times)
+        target = TARGETS.get(script)
+        status = 'ok' if target is None or median <= target else 'SLOW'
+        failures += status != 'ok'
+        target_text = f"{target:.2f}" if target is not None else '-'
+        print(f"{script:<24}{median:>12.3f}{min(times):>10.3f}{target_text:>12}  {status}")
+
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
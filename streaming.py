@@ -0,0 +1,184 @@
+"""
+Streaming Responses
+Incremental delivery of model output through an `on_token(text)` callback or a TokenStream iterator.
+Each streamed call records its time to first token and output tokens per second on the current
+tracing span, next to the span's total duration.
+"""
+
+import queue
+import threading
+import time
+from token_ledger import usage_to_counts
+from tracing import tracer
+
+_DONE = object()
+
+
+class StreamMetrics:
+    """
+    Timing of one streamed response. Time to first token is measured to the first text delivered to the
+    caller, i.e. what the user sees (hidden reasoning before it counts as waiting time).
+    """
+
+    def __init__(self, on_token=None):
+        self.on_token = on_token
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.chunks = []
+
+    def emit(self, text):
+        if not text:
+            return
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.chunks.append(text)
+        if self.on_token is not None:
+            self.on_token(text)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def finish(self, usage=None) -> dict:
+        """
+        Compute the metrics and add them to the current tracing span.
+        Output tokens come from the response usage, or are estimated from the text (4 characters per token).
+        """
+        end = time.perf_counter()
+        output_tokens = usage_to_counts(usage)['output_tokens'] if usage is not None else 0
+        if not output_tokens:
+            output_tokens = max(1, len(self.text) // 4) if self.chunks else 0
+        ttft = (self.first_token - self.start) if self.first_token is not None else None
+        generation = end - self.first_token if self.first_token is not None else 0.0
+        metrics = {
+            'streamed': True,
+            'ttft_s': ttft,
+            'stream_total_s': end - self.start,
+            'tokens_per_s': output_tokens / generation if generation > 0 else None,
+        }
+        span = tracer.current()
+        if span is not None:
+            span.set(**metrics)
+        return metrics
+
+
+def visible_after(marker, emit):
+    """
+    Wrap `emit` so text is only passed on after `marker` (e.g. "</think>" of reasoning models) has been seen.
+    """
+    state = {'buffer': '', 'open': False}
+
+    def filtered(text):
+        if state['open']:
+            emit(text)
+            return
+        state['buffer'] += text
+        if marker in state['buffer']:
+            state['open'] = True
+            emit(state['buffer'].split(marker, 1)[1].lstrip())
+    return filtered
+
+
+def stream_openai(client, on_token, **params):
+    """
+    Streamed chat completion. Returns (text, usage).
+    """
+    metrics = StreamMetrics(on_token)
+    usage = None
+    stream = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **params)
+    for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if chunk.choices:
+            metrics.emit(chunk.choices[0].delta.content)
+    metrics.finish(usage)
+    return metrics.text, usage
+
+
+def stream_anthropic(client, on_token, **params):
+    """
+    Streamed Messages API call. Returns the final Message, the same object messages.create returns.
+    """
+    metrics = StreamMetrics(on_token)
+    params.pop("stream", None)
+    with client.messages.stream(**params) as stream:
+        for text in stream.text_stream:
+            metrics.emit(text)
+        message = stream.get_final_message()
+    metrics.finish(message.usage)
+    return message
+
+
+def stream_gemini(client, on_token, **params):
+    """
+    Streamed generate_content. Returns (text, usage_metadata).
+    """
+    metrics = StreamMetrics(on_token)
+    usage = None
+    for chunk in client.models.generate_content_stream(**params):
+        if chunk.usage_metadata is not None:
+            usage = chunk.usage_metadata
+        metrics.emit(chunk.text)
+    metrics.finish(usage)
+    return metrics.text, usage
+
+
+def stream_azure(client, on_token, hide_before=None, **params):
+    """
+    Streamed Azure AI Inference completion. Returns (full text, usage); with `hide_before`, only the text
+    after that marker reaches `on_token`.
+    """
+    metrics = StreamMetrics(on_token)
+    emit = visible_after(hide_before, metrics.emit) if hide_before else metrics.emit
+    raw = []
+    usage = None
+    for update in client.complete(stream=True, **params):
+        if getattr(update, "usage", None) is not None:
+            usage = update.usage
+        if update.choices:
+            text = update.choices[0].delta.content
+            if text:
+                raw.append(text)
+                emit(text)
+    metrics.finish(usage)
+    return "".join(raw), usage
+
+
+class TokenStream:
+    """
+    Iterator over the text deltas of a callback-style call `run(on_token)`, which runs on a background
+    thread with the caller's tracing context. After iteration, `result` holds run's return value;
+    an exception raised by run is re-raised by the iterator.
+
+    Example:
+        stream = TokenStream(lambda on_token: claude_chat.chat(question, on_token=on_token))
+        for text in stream:
+            print(text, end="", flush=True)
+    """
+
+    def __init__(self, run):
+        self.run = tracer.bind(run, **tracer.context_attrs())
+        self.result = None
+        self.error = None
+
+    def __iter__(self):
+        deltas = queue.Queue()
+
+        def worker():
+            try:
+                self.result = self.run(deltas.put)
+            except BaseException as e:
+                self.error = e
+            finally:
+                deltas.put(_DONE)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        while True:
+            text = deltas.get()
+            if text is _DONE:
+                break
+            yield text
+        thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,34 @@
+"""
+Guideline Corpus Sync
+Explicit step that downloads (or verifies) every ASCO guideline PDF into pdfs/.
+Run this once before the evaluations; importing the agents no longer touches the network.
+
+    python sync_guidelines.py --workers 4
+"""
+
+import argparse
+from data.asco_guidelines import guideline_urls
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download and verify all ASCO guideline PDFs')
+    parser.add_argument('--pdf_folder', type=str, default='pdfs', help='Destination directory (default: pdfs)')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent downloads (default: 4)')
+    parser.add_argument('--no_browser', action='store_true', help='Do not fall back to Selenium for URLs that need a browser')
+    args = parser.parse_args()
+
+    from downloader import download_guidelines
+    statuses = download_guidelines(
+        guideline_urls,
+        pdf_folder=args.pdf_folder,
+        max_workers=args.workers,
+        use_browser_fallback=not args.no_browser
+    )
+    failed = sorted(key for key, status in statuses.items() if status.startswith('error'))
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Guideline Text Store
+One-time text extraction for the guideline PDFs. Every PDF is parsed once into a columnar store of
+page text, page offsets and section headings, keyed by guideline key and content hash; the pipelines
+read slices of it through memory-mapped arrays instead of parsing the PDFs again.
+
+    python text_store.py --pdf_folder pdfs
+
+Layout of one store generation (index_cache/text/<generation>/, or under TEXT_STORE_DIR):
+- text.bin: UTF-8 text of all pages, concatenated
+- page_offsets.npy: int64 byte offsets of each page in text.bin (one more entry than pages)
+- headings.bin / heading_offsets.npy: section heading text, concatenated, and its offsets
+- heading_pages.npy: int32 store-wide page number of each heading
+- manifest.json: one entry per document with its key, file path, SHA-256 and page/heading ranges
+The CURRENT file names the live generation. Updates write a new generation and then switch CURRENT,
+so readers in other processes always see a consistent store. Writers hold an flock on <store>/LOCK and
+build on the latest CURRENT, so concurrent processes never drop each other's documents; a replaced
+generation is only deleted once it has been out of date for GENERATION_GRACE_S.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from config import TEXT_STORE_DIR
+from index_cache import file_sha256
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = 'LOCK'
+# seconds a replaced generation is kept for processes that read CURRENT just before it changed
+GENERATION_GRACE_S = 300
+
+SECTION_NAMES = {
+    'abstract', 'introduction', 'background', 'purpose', 'methods', 'results', 'discussion', 'conclusion',
+    'conclusions', 'recommendations', 'guideline questions', 'target population', 'target audience',
+    'clinical interpretation', 'literature review', 'summary', 'references', 'patient and clinician communication',
+    'health disparities', 'cost implications', 'external review', 'limitations of the research',
+}
+NUMBERED_HEADING = re.compile(r'^\d+(\.\d+)*\.?\s+[A-Z][^.]{2,}$')
+GUIDELINE_KEY = re.compile(r'^([a-z]+(?:_[a-z]+)*_\d+)')
+
+
+def guideline_key(pdf_path: str) -> str:
+    """
+    Guideline key of a PDF named `<key>.pdf` or `<key>_*.pdf`.
+    """
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    match = GUIDELINE_KEY.match(stem)
+    return match.group(1) if match else stem
+
+
+def find_headings(page_text: str) -> list:
+    """
+    Section headings on a page: numbered headings ("2.1 Recommendations"), known section names
+    and short all-caps lines.
+    """
+    headings = []
+    for line in page_text.splitlines():
+        line = ' '.join(line.split())
+        if not 3 <= len(line) <= 80:
+            continue
+        letters = [c for c in line if c.isalpha()]
+        if (NUMBERED_HEADING.match(line)
+                or line.rstrip(':').lower() in SECTION_NAMES
+                or (len(letters) >= 4 and line.isupper() and not line.endswith('.'))):
+            headings.append(line)
+    return headings
+
+
+def extract_pages(pdf_path: str) -> list:
+    from pypdf import PdfReader
+    return [page.extract_text() or '' for page in PdfReader(pdf_path).pages]
+
+
+class _Generation:
+    """
+    One immutable, memory-mapped store generation.
+    """
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, 'manifest.json'), 'r') as file:
+            manifest = json.load(file)
+        self.documents = {entry['key']: entry for entry in manifest['documents']}
+        self.by_path = {entry['path']: entry for entry in manifest['documents']}
+        self.text = self._map_bytes(os.path.join(path, 'text.bin'))
+        self.heading_text = self._map_bytes(os.path.join(path, 'headings.bin'))
+        self.page_offsets = np.load(os.path.join(path, 'page_offsets.npy'), mmap_mode='r')
+        self.heading_offsets = np.load(os.path.join(path, 'heading_offsets.npy'), mmap_mode='r')
+        self.heading_pages = np.load(os.path.join(path, 'heading_pages.npy'), mmap_mode='r')
+
+    @staticmethod
+    def _map_bytes(path):
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode='r')
+
+    def pages(self, entry, start=0, end=None) -> list:
+        end = entry['page_count'] if end is None else end
+        if not 0 <= start <= end <= entry['page_count']:
+            raise IndexError(f"{entry['file']} has {entry['page_count']} pages, not [{start}, {end})")
+        offsets = self.page_offsets[entry['first_page'] + start:entry['first_page'] + end + 1]
+        return [bytes(self.text[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in range(len(offsets) - 1)]
+
+    def headings(self, entry) -> list:
+        first = entry['first_heading']
+        offsets = self.heading_offsets[first:first + entry['heading_count'] + 1]
+        pages = self.heading_pages[first:first + entry['heading_count']]
+        return [(int(pages[i]) - entry['first_page'], bytes(self.heading_text[offsets[i]:offsets[i + 1]]).decode('utf-8'))
+                for i in range(entry['heading_count'])]
+
+
+class TextStore:
+    """
+    Memory-mapped reader (and incremental writer) of the guideline text store.
+
+    Args:
+        directory (str): Store root; generations live in subdirectories of it
+    """
+
+    def __init__(self, directory=TEXT_STORE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.current = None
+        self._load()
+
+    def _load(self, attempts=5):
+        """
+        Open the generation named by CURRENT, if it changed since the last load.
+        """
+        current_path = os.path.join(self.directory, CURRENT_FILE)
+        for attempt in range(attempts):
+            if not os.path.exists(current_path):
+                return
+            with open(current_path, 'r') as file:
+                name = file.read().strip()
+            if not name or (self.current is not None and self.current.name == name):
+                return
+            try:
+                self.current = _Generation(os.path.join(self.directory, name))
+                return
+            except FileNotFoundError:
+                # the generation was replaced and collected between reading CURRENT and opening it
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+
+    @contextmanager
+    def _exclusive(self):
+        """
+        Hold the store's write lock, against other threads and other processes.
+        """
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def generation(self):
+        return self.current.name if self.current is not None else None
+
+    def __contains__(self, key):
+        return self.current is not None and key in self.current.documents
+
+    def keys(self):
+        return list(self.current.documents) if self.current is not None else []
+
+    def _lookup(self, key):
+        current = self.current
+        entry = current.documents.get(key) if current is not None else None
+        if entry is None:
+            raise KeyError(f"No extracted text for guideline: {key}")
+        return current, entry
+
+    def page_count(self, key) -> int:
+        return self._lookup(key)[1]['page_count']
+
+    def page_text(self, key, page) -> str:
+        current, entry = self._lookup(key)
+        return current.pages(entry, page, page + 1)[0]
+
+    def pages(self, key, start=0, end=None) -> list:
+        """
+        Text of pages [start, end) of a guideline.
+        """
+        current, entry = self._lookup(key)
+        return current.pages(entry, start, end)
+
+    def document_text(self, key, separator='\n\n') -> str:
+        return separator.join(self.pages(key))
+
+    def headings(self, key) -> list:
+        """
+        Section headings of a guideline as (page, heading) pairs, in reading order.
+        """
+        current, entry = self._lookup(key)
+        return current.headings(entry)
+
+    def pages_for_file(self, pdf_path: str) -> list:
+        """
+        Page texts of a PDF, extracting it into the store first if it is new or has changed.
+        """
+        self.update([pdf_path])
+        current = self.current
+        return current.pages(current.by_path[os.path.abspath(pdf_path)])
+
+    def is_current(self, pdf_path: str) -> bool:
+        """
+        True if the store holds this file's current contents. File size and mtime are checked first,
+        so unchanged files are not hashed again.
+        """
+        entry = self.current.by_path.get(os.path.abspath(pdf_path)) if self.current is not None else None
+        if entry is None:
+            return False
+        stat = os.stat(pdf_path)
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        return entry['size'] == stat.st_size and entry['sha256'] == file_sha256(pdf_path)
+
+    def update(self, pdf_paths) -> list:
+        """
+        Extract the PDFs that are not in the store (or changed) and write a new generation holding
+        them plus every current document. Returns the files that were parsed.
+        """
+        with self.lock:
+            self._load()
+            if all(self.is_current(path) for path in pdf_paths):
+                return []
+        with self._exclusive():
+            # another process may have published a generation since; build on the latest one
+            self._load()
+            stale = [path for path in pdf_paths if not self.is_current(path)]
+            if not stale:
+                return []
+
+            documents = {}  # absolute path -> (entry, page texts)
+            if self.current is not None:
+                # documents whose file is gone (e.g. a temporary benchmark folder) are dropped
+                for path, entry in self.current.by_path.items():
+                    if os.path.exists(path):
+                        documents[path] = (entry, self.current.pages(entry))
+            for path in stale:
+                path = os.path.abspath(path)
+                stat = os.stat(path)
+                entry = {'key': guideline_key(path), 'file': os.path.basename(path), 'path': path,
+                         'sha256': file_sha256(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+                print(f"Extracting text of {entry['file']}")
+                documents[path] = (entry, extract_pages(path))
+            self._write(documents)
+            self._load()
+            return [os.path.basename(path) for path in stale]
+
+    def _write(self, documents):
+        generation = f"{time.time_ns():x}"
+        directory = os.path.join(self.directory, generation)
+        os.makedirs(directory)
+
+        page_offsets = [0]
+        heading_offsets = [0]
+        heading_pages = []
+        entries = []
+        with open(os.path.join(directory, 'text.bin'), 'wb') as text_file, \
+                open(os.path.join(directory, 'headings.bin'), 'wb') as heading_file:
+            for path in sorted(documents):
+                entry, pages = documents[path]
+                entry = dict(entry, first_page=len(page_offsets) - 1, page_count=len(pages),
+                             first_heading=len(heading_pages))
+                for page_text in pages:
+                    encoded = page_text.encode('utf-8')
+                    text_file.write(encoded)
+                    page_offsets.append(page_offsets[-1] + len(encoded))
+                    for heading in find_headings(page_text):
+                        encoded = heading.encode('utf-8')
+                        heading_file.write(encoded)
+                        heading_offsets.append(heading_offsets[-1] + len(encoded))
+                        heading_pages.append(len(page_offsets) - 2)
+                entry['heading_count'] = len(heading_pages) - entry['first_heading']
+                entries.append(entry)
+        np.save(os.path.join(directory, 'page_offsets.npy'), np.array(page_offsets, dtype=np.int64))
+        np.save(os.path.join(directory, 'heading_offsets.npy'), np.array(heading_offsets, dtype=np.int64))
+        np.save(os.path.join(directory, 'heading_pages.npy'), np.array(heading_pages, dtype=np.int32))
+        with open(os.path.join(directory, 'manifest.json'), 'w') as file:
+            json.dump({'documents': entries}, file, indent=2)
+
+        current_path = os.path.join(self.directory, CURRENT_FILE)
+        tmp_path = current_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(generation)
+        os.replace(tmp_path, current_path)
+
+        self._collect(generation)
+
+    def _collect(self, current):
+        """
+        Delete generations that were replaced more than GENERATION_GRACE_S ago. Generation names are
+        creation times, so a generation went out of date when the next newer one was written.
+        """
+        generations = []
+        for name in os.listdir(self.directory):
+            if os.path.isdir(os.path.join(self.directory, name)):
+                try:
+                    generations.append((int(name, 16), name))
+                except ValueError:
+                    continue
+        generations.sort()
+        cutoff = time.time_ns() - GENERATION_GRACE_S * 1_000_000_000
+        for (_, name), (replaced_at, _) in zip(generations, generations[1:]):
+            if name != current and replaced_at < cutoff:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def stats(self) -> dict:
+        current = self.current
+        if current is None:
+            return {'documents': 0, 'pages': 0, 'headings': 0, 'text_bytes': 0}
+        return {
+            'documents': len(current.by_path),
+            'pages': int(len(current.page_offsets) - 1),
+            'headings': int(len(current.heading_pages)),
+            'text_bytes': int(len(current.text)),
+        }
+
+
+_text_store = None
+_text_store_lock = threading.Lock()
+
+
+def get_text_store() -> TextStore:
+    """
+    Process-wide text store, opened on first use.
+    """
+    global _text_store
+    with _text_store_lock:
+        if _text_store is None:
+            _text_store = TextStore()
+        return _text_store
+
+
+def pdf_files(pdf_folder: str) -> list:
+    return sorted(
+        os.path.join(pdf_folder, filename)
+        for filename in os.listdir(pdf_folder)
+        if filename.endswith('.pdf')
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract the text of every guideline PDF into the shared text store')
+    parser.add_argument('--pdf_folder', type=str, default='pdfs', help='Directory containing PDF guidelines')
+    args = parser.parse_args()
+
+    store = get_text_store()
+    start = time.perf_counter()
+    parsed = store.update(pdf_files(args.pdf_folder))
+    stats = store.stats()
+    print(f"Parsed {len(parsed)} PDFs in {time.perf_counter() - start:.1f}s; store holds {stats['documents']} "
+          f"guidelines, {stats['pages']} pages, {stats['headings']} headings, "
+          f"{stats['text_bytes'] / 1024 / 1024:.1f} MB of text in '{os.path.join(store.directory, store.generation or '')}'")
+
+
+if __name__ == "__main__":
+    main()
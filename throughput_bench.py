@@ -0,0 +1,269 @@
+"""
+Throughput Benchmark
+Runs the evaluation pipelines end to end against the offline stand-in (llm_standin.py) and reports
+questions per minute, p50/p95 per-question latency and peak RSS for each, plus time to first token
+for the streamed pipeline. Every pipeline runs in
+its own process so the RSS figures do not mix, and the response cache is disabled so every call
+reaches the stand-in.
+
+    python throughput_bench.py --pipelines non_agent,rag,agent --questions 20 --workers 4 --latency_ms 800
+
+Pipelines:
+- non_agent: NonAgentEval answer (--model) + GPT-4o judge
+- non_agent_stream: the same with the answer streamed (on_token), reporting TTFT p50/p95 from the tracing spans
+- rag: RAG_eval retrieval + answer + judge (index build time is reported separately)
+- agent: ClaudeChat conversation via AnswerEvaluator.evaluate_question (with the local router) + judge
+
+--synthetic_pdfs writes small text PDFs for every guideline into a temporary folder, so the rag and
+agent pipelines also run where the real guideline PDFs have not been downloaded (e.g. in CI).
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from llm_standin import add_server_arguments, server_from_args
+
+PIPELINES = ('non_agent', 'non_agent_stream', 'rag', 'agent')
+RESULT_PREFIX = 'BENCH_RESULT '
+
+
+def write_text_pdf(path, title, text, words_per_line=12, lines_per_page=45):
+    """
+    Write a minimal multi-page PDF (Helvetica text) without any PDF library.
+    """
+    words = f"{title} {text}".split()
+    lines = [' '.join(words[i:i + words_per_line]) for i in range(0, len(words), words_per_line)] or ['']
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+
+    objects = []
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{' '.join(f'{pid} 0 R' for pid in page_ids)}] /Count {len(pages)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for page_id, page_lines in zip(page_ids, pages):
+        escaped = [line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') for line in page_lines]
+        stream = "BT /F1 10 Tf 14 TL 50 760 Td " + ' '.join(f"({line}) '" for line in escaped) + " ET"
+        stream = stream.encode('latin-1', 'replace')
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {page_id + 1} 0 R >>".encode())
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += b''.join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, 'wb') as file:
+        file.write(output)
+
+
+def write_synthetic_pdfs(folder):
+    """
+    One text PDF per guideline, built from its summary, so every routed key resolves to a file.
+    """
+    from data.asco_guidelines import guideline_summaries
+    os.makedirs(folder, exist_ok=True)
+    for key, summary in guideline_summaries.items():
+        write_text_pdf(os.path.join(folder, f'{key}.pdf'), key.replace('_', ' '), f"{summary} " * 20)
+    return len(guideline_summaries)
+
+
+def run_questions(answer_one, rows, workers):
+    """
+    Run `answer_one(row)` for every row on a thread pool and time each question.
+    """
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+
+    def timed(row):
+        question_start = time.perf_counter()
+        answer_one(row)
+        return time.perf_counter() - question_start
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(timed, row): idx for idx, row in rows.iterrows()}
+        for future in as_completed(futures):
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors.append(f"question {futures[future]}: {e}")
+    wall_time = time.perf_counter() - start
+    return latencies, errors, wall_time
+
+
+def pipeline_runner(pipeline, args):
+    """
+    Set up `pipeline` and return (answer_one(row), setup seconds).
+    """
+    setup_start = time.perf_counter()
+    if pipeline in ('non_agent', 'non_agent_stream'):
+        from non_agent_eval import NonAgentEval
+        evaluator = NonAgentEval(None)
+        # streaming records ttft_s on the answer span; the tokens themselves are not needed here
+        on_token = (lambda text: None) if pipeline == 'non_agent_stream' else None
+
+        def answer_one(row):
+            answer = evaluator.generate_single_answer(row['Question'], args.model, on_token=on_token)
+            return evaluator.evaluate_single_answer(row['Question'], answer, row['Answer'])
+
+    elif pipeline == 'rag':
+        from RAG_eval import answer_question, build_index_from_pdfs, create_client, evaluate_answer
+        client, model = create_client(args.rag_model)
+        eval_client, eval_model = create_client("gpt-4o")
+        # never persist stand-in embeddings into the real index cache or embedding store
+        index = build_index_from_pdfs(args.pdf_folder, args.chunk_size, use_cache=False)
+
+        def answer_one(row):
+            _, answer = answer_question(index, client, model, row['Question'])
+            return evaluate_answer(eval_client, eval_model, row['Question'], answer, row['Answer'])
+
+    elif pipeline == 'agent':
+        from evaluate_answers import AnswerEvaluator
+        # cache_seed=None disables the autogen disk cache so every turn reaches the stand-in
+        evaluator = AnswerEvaluator(cache_seed=None, use_router=True, speaker_mode=args.speaker_mode)
+        evaluator.chat_pool.prebuild(args.workers)
+
+        def answer_one(row):
+            return evaluator.evaluate_question(row)
+
+    else:
+        raise ValueError(f"Unknown pipeline: {pipeline}")
+    return answer_one, time.perf_counter() - setup_start
+
+
+def run_child(pipeline, args):
+    """
+    Benchmark one pipeline in this process and print its result as one JSON line.
+    """
+    rows = pd.read_csv(args.csv_path).iloc[args.start:args.start + args.questions]
+    answer_one, setup_time = pipeline_runner(pipeline, args)
+    latencies, errors, wall_time = run_questions(answer_one, rows, args.workers)
+    from tracing import tracer
+    ttfts = [span['ttft_s'] for span in tracer.spans if span.get('ttft_s') is not None]
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    result = {
+        'pipeline': pipeline,
+        'questions': len(rows),
+        'completed': len(latencies),
+        'errors': len(errors),
+        'error_samples': errors[:3],
+        'workers': args.workers,
+        'setup_s': round(setup_time, 3),
+        'wall_s': round(wall_time, 3),
+        'questions_per_min': round(len(latencies) / wall_time * 60, 2) if wall_time else 0.0,
+        'p50_s': round(float(np.percentile(latencies, 50)), 3) if latencies else None,
+        'p95_s': round(float(np.percentile(latencies, 95)), 3) if latencies else None,
+        'streamed': len(ttfts),
+        'ttft_p50_s': round(float(np.percentile(ttfts, 50)), 3) if ttfts else None,
+        'ttft_p95_s': round(float(np.percentile(ttfts, 95)), 3) if ttfts else None,
+        'peak_rss_mb': round(peak_rss_mb, 1),
+    }
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+def child_command(pipeline, args):
+    command = [sys.executable, os.path.abspath(__file__), '--child', pipeline,
+               '--csv_path', args.csv_path, '--start', str(args.start), '--questions', str(args.questions),
+               '--workers', str(args.workers), '--model', args.model, '--rag_model', args.rag_model,
+               '--pdf_folder', args.pdf_folder, '--chunk_size', str(args.chunk_size),
+               '--speaker_mode', args.speaker_mode]
+    return command
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end throughput benchmark against the offline LLM stand-in')
+    parser.add_argument('--pipelines', type=str, default=','.join(PIPELINES), help='Comma-separated pipelines (default: non_agent,non_agent_stream,rag,agent)')
+    parser.add_argument('--csv_path', type=str, default='data/q_a.csv', help='Path to questions CSV')
+    parser.add_argument('--start', type=int, default=0, help='First question index (default: 0)')
+    parser.add_argument('--questions', type=int, default=20, help='Questions per pipeline (default: 20)')
+    parser.add_argument('--workers', type=int, default=4, help='Questions in flight per pipeline (default: 4)')
+    parser.add_argument('--model', type=str, default='gpt-4o', help='Model for the non_agent pipelines (default: gpt-4o)')
+    parser.add_argument('--rag_model', type=str, default='claude', help='Answer model for the rag pipeline (default: claude)')
+    parser.add_argument('--pdf_folder', type=str, default='pdfs', help='Guideline PDFs for the rag and agent pipelines')
+    parser.add_argument('--synthetic_pdfs', action='store_true', help='Generate text PDFs for every guideline in a temporary folder')
+    parser.add_argument('--chunk_size', type=int, default=1024, help='Chunk size for the rag index')
+    parser.add_argument('--speaker_mode', type=str, default='groupchat', choices=['groupchat', 'state_machine'], help='Speaker selection for the agent pipeline (default: groupchat)')
+    parser.add_argument('--output', type=str, default=None, help='JSON report path (default: results/throughput_<timestamp>.json)')
+    parser.add_argument('--child', type=str, default=None, help=argparse.SUPPRESS)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args)
+        return
+
+    pipelines = [p.strip() for p in args.pipelines.split(',') if p.strip()]
+    unknown = [p for p in pipelines if p not in PIPELINES]
+    if unknown:
+        parser.error(f"Unknown pipeline(s): {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory(prefix='throughput_') as workdir, server_from_args(args) as server:
+        if args.synthetic_pdfs:
+            args.pdf_folder = os.path.join(workdir, 'pdfs')
+            print(f"Wrote {write_synthetic_pdfs(args.pdf_folder)} synthetic guideline PDFs to {args.pdf_folder}")
+
+        env = dict(os.environ, **server.env())
+        # the embedding and text stores live in workdir, so nothing from the bench reaches index_cache/
+        env.update({'LLM_CACHE': '0', 'PDF_FOLDER': args.pdf_folder,
+                    'EMBEDDING_CACHE_PATH': os.path.join(workdir, 'embeddings.sqlite'),
+                    'TEXT_STORE_DIR': os.path.join(workdir, 'text')})
+        # replay needs no real keys, but the SDKs refuse to start without one
+        for key in ('OPENAI_API_KEY', 'ANTHROPIC_API_KEY', 'GEMINI_API_KEY', 'AZURE_API_KEY'):
+            if not env.get(key):
+                env[key] = 'standin'
+        print(f"Stand-in at {server.url} ({args.mode} mode, {args.latency_ms:g}+{args.jitter_ms:g} ms latency, "
+              f"{args.error_rate:.0%} 429s)")
+
+        results = []
+        for pipeline in pipelines:
+            print(f"Running {pipeline} ({args.questions} questions, {args.workers} workers)...")
+            process = subprocess.run(child_command(pipeline, args), env=env, capture_output=True, text=True)
+            lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+            if process.returncode != 0 or not lines:
+                print(f"{pipeline} failed:\n{process.stderr[-2000:]}")
+                results.append({'pipeline': pipeline, 'failed': True})
+                continue
+            results.append(json.loads(lines[-1][len(RESULT_PREFIX):]))
+        standin_stats = server.stats()
+
+    print(f"\n{'pipeline':<18}{'done':>6}{'errors':>8}{'q/min':>9}{'p50 (s)':>9}{'p95 (s)':>9}{'TTFT p50 (s)':>14}"
+          f"{'setup (s)':>11}{'peak RSS (MB)':>15}")
+    print("-" * 99)
+    for result in results:
+        if result.get('failed'):
+            print(f"{result['pipeline']:<18}  FAILED")
+            continue
+        ttft = f"{result['ttft_p50_s']:.2f}" if result.get('ttft_p50_s') is not None else '-'
+        print(f"{result['pipeline']:<18}{result['completed']:>6}{result['errors']:>8}{result['questions_per_min']:>9.1f}"
+              f"{result['p50_s'] or 0:>9.2f}{result['p95_s'] or 0:>9.2f}{ttft:>14}{result['setup_s']:>11.2f}{result['peak_rss_mb']:>15.1f}")
+        for sample in result['error_samples']:
+            print(f"  {sample}")
+    print(f"\nStand-in requests: {standin_stats}")
+
+    output = args.output or f"results/throughput_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'args': {k: v for k, v in vars(args).items() if k != 'child'},
+                   'results': results, 'standin': standin_stats}, file, indent=2)
+    print(f"Report saved to {output}")
+
+    if any(result.get('failed') or result.get('errors') for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
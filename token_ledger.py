@@ -0,0 +1,196 @@
+"""
+Token Ledger
+Per-run record of token usage taken from the `usage` block of model responses,
+so token accounting needs no extra count_tokens round trips.
+"""
+
+import json
+import threading
+import time
+
+# USD per million tokens: input, output, cache write, cache read; matched by model-name prefix
+MODEL_PRICES = {
+    'claude-3-7-sonnet': (3.00, 15.00, 3.75, 0.30),
+    'claude-3-5-sonnet': (3.00, 15.00, 3.75, 0.30),
+    'gpt-4o': (2.50, 10.00, 2.50, 1.25),
+}
+
+
+def model_prices(model: str):
+    """
+    Prices of a model from MODEL_PRICES, or None if it is not listed.
+    """
+    for prefix, prices in MODEL_PRICES.items():
+        if model and model.startswith(prefix):
+            return prices
+    return None
+
+
+def usage_to_counts(usage) -> dict:
+    """
+    Normalize an Anthropic, OpenAI, Gemini or Azure usage object (or dict) into one set of token counts.
+    """
+    if usage is None:
+        usage = {}
+    if not isinstance(usage, dict):
+        if hasattr(usage, 'model_dump'):
+            usage = usage.model_dump()
+        elif hasattr(usage, 'as_dict'):  # Azure AI Inference
+            usage = usage.as_dict()
+        else:
+            usage = vars(usage)
+
+    if 'prompt_token_count' in usage:  # Gemini usage_metadata
+        cache_read = usage.get('cached_content_token_count') or 0
+        return {
+            'input_tokens': (usage.get('prompt_token_count') or 0) - cache_read,
+            'output_tokens': usage.get('candidates_token_count') or 0,
+            'cache_creation_input_tokens': 0,
+            'cache_read_input_tokens': cache_read,
+        }
+
+    if 'prompt_tokens' in usage:  # OpenAI
+        details = usage.get('prompt_tokens_details') or {}
+        cache_read = details.get('cached_tokens') or 0
+        return {
+            'input_tokens': (usage.get('prompt_tokens') or 0) - cache_read,
+            'output_tokens': usage.get('completion_tokens') or 0,
+            'cache_creation_input_tokens': 0,
+            'cache_read_input_tokens': cache_read,
+        }
+
+    return {
+        'input_tokens': usage.get('input_tokens') or 0,
+        'output_tokens': usage.get('output_tokens') or 0,
+        'cache_creation_input_tokens': usage.get('cache_creation_input_tokens') or 0,
+        'cache_read_input_tokens': usage.get('cache_read_input_tokens') or 0,
+    }
+
+
+class TokenLedger:
+    """
+    Thread-safe list of token usage entries, one per model call.
+    """
+
+    COUNT_FIELDS = ['input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens']
+
+    def __init__(self):
+        self.entries = []
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, model: str, usage, **extra) -> dict:
+        """
+        Record the usage of one call.
+
+        Args:
+            stage (str): Pipeline stage that made the call (e.g. 'process_pdf')
+            model (str): Model name
+            usage: The response's usage object or dict
+            **extra: Additional fields to keep with the entry (e.g. key, question_index)
+        """
+        entry = {'time': time.time(), 'stage': stage, 'model': model}
+        entry.update(usage_to_counts(usage))
+        entry.update(extra)
+        with self.lock:
+            self.entries.append(entry)
+        return entry
+
+    def rate_limited_input_tokens(self, **match) -> int:
+        """
+        Input tokens of the entries whose fields match (e.g. question_index=3) that count against an
+        input-tokens-per-minute limit: uncached input and cache writes, but not cache reads.
+        """
+        with self.lock:
+            entries = [e for e in self.entries if all(e.get(k) == v for k, v in match.items())]
+        return sum(e['input_tokens'] + e['cache_creation_input_tokens'] for e in entries)
+
+    def totals(self, stage: str = None) -> dict:
+        with self.lock:
+            entries = [e for e in self.entries if stage is None or e['stage'] == stage]
+        totals = {field: sum(e[field] for e in entries) for field in self.COUNT_FIELDS}
+        totals['calls'] = len(entries)
+        return totals
+
+    def summary(self) -> dict:
+        """
+        Token totals per stage.
+        """
+        with self.lock:
+            stages = sorted({e['stage'] for e in self.entries})
+        return {stage: self.totals(stage) for stage in stages}
+
+    @staticmethod
+    def cache_ratios(totals: dict) -> dict:
+        """
+        Share of prompt tokens read from and written to the provider's prompt cache.
+        """
+        prompt = totals['input_tokens'] + totals['cache_creation_input_tokens'] + totals['cache_read_input_tokens']
+        return {
+            'cache_read_ratio': totals['cache_read_input_tokens'] / prompt if prompt else 0.0,
+            'cache_write_ratio': totals['cache_creation_input_tokens'] / prompt if prompt else 0.0,
+        }
+
+    def cost(self) -> dict:
+        """
+        Estimated cost of the recorded calls, and what they would have cost with every cached prompt
+        token billed as regular input. Calls to models without a price are counted in `unpriced_calls`.
+        """
+        with self.lock:
+            entries = list(self.entries)
+        cost = {'cost_usd': 0.0, 'uncached_cost_usd': 0.0, 'unpriced_calls': 0}
+        for e in entries:
+            prices = model_prices(e['model'])
+            if prices is None:
+                cost['unpriced_calls'] += 1
+                continue
+            input_price, output_price, write_price, read_price = prices
+            output = e['output_tokens'] * output_price
+            cost['cost_usd'] += (e['input_tokens'] * input_price + e['cache_creation_input_tokens'] * write_price
+                                 + e['cache_read_input_tokens'] * read_price + output) / 1e6
+            prompt = e['input_tokens'] + e['cache_creation_input_tokens'] + e['cache_read_input_tokens']
+            cost['uncached_cost_usd'] += (prompt * input_price + output) / 1e6
+        cost['saved_usd'] = cost['uncached_cost_usd'] - cost['cost_usd']
+        return cost
+
+    def print_summary(self):
+        print("\nToken Usage:")
+        print("-" * 50)
+        with self.lock:
+            read_calls = {}
+            for e in self.entries:
+                read_calls[e['stage']] = read_calls.get(e['stage'], 0) + (e['cache_read_input_tokens'] > 0)
+        for stage, totals in self.summary().items():
+            ratios = self.cache_ratios(totals)
+            print(f"{stage}: {totals['calls']} calls ({read_calls[stage]} read from cache), "
+                  f"input {totals['input_tokens']}, output {totals['output_tokens']}, "
+                  f"cache write {totals['cache_creation_input_tokens']}, "
+                  f"cache read {totals['cache_read_input_tokens']} "
+                  f"(prompt tokens read from cache {ratios['cache_read_ratio']*100:.1f}%, "
+                  f"written {ratios['cache_write_ratio']*100:.1f}%)")
+        overall = self.totals()
+        if overall['calls']:
+            ratios = self.cache_ratios(overall)
+            print(f"All stages: cache read ratio {ratios['cache_read_ratio']*100:.1f}%, "
+                  f"cache write ratio {ratios['cache_write_ratio']*100:.1f}%")
+            cost = self.cost()
+            print(f"Cache read tokens {overall['cache_read_input_tokens']}; estimated cost ${cost['cost_usd']:.2f}, "
+                  f"${cost['uncached_cost_usd']:.2f} without prompt caching (saved ${cost['saved_usd']:.2f})"
+                  + (f"; {cost['unpriced_calls']} calls to unpriced models not included" if cost['unpriced_calls'] else ""))
+
+    def save(self, path: str):
+        """
+        Write all entries to `path` as JSON lines.
+        """
+        with self.lock:
+            entries = list(self.entries)
+        with open(path, 'w') as file:
+            for entry in entries:
+                file.write(json.dumps(entry) + '\n')
+
+    def reset(self):
+        with self.lock:
+            self.entries = []
+
+
+# shared ledger for the current run
+ledger = TokenLedger()
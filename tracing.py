@@ -0,0 +1,306 @@
+"""
+Pipeline Tracing
+Timing spans for agent turns, speaker selection, tool calls, retrieval queries and judge calls.
+Each span carries its stage, duration, model, token counts and the question it belongs to; spans
+nest per thread, are exported to JSONL and summarized as a per-stage latency breakdown.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+from token_ledger import usage_to_counts
+
+TOKEN_FIELDS = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+
+
+class Span:
+    """
+    One timed operation. Token counts and other attributes can be added while it is open.
+    """
+
+    def __init__(self, stage, parent_id=None, **attrs):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.stage = stage
+        self.attrs = attrs
+        self.start = time.time()
+        self.start_perf = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def set_usage(self, usage):
+        """
+        Add the token counts of a response usage object (Anthropic or OpenAI); repeated calls accumulate.
+        """
+        for field, count in usage_to_counts(usage).items():
+            self.attrs[field] = self.attrs.get(field, 0) + count
+
+    def to_dict(self) -> dict:
+        record = {
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'stage': self.stage,
+            'start': self.start,
+            'duration_s': self.duration,
+        }
+        record.update(self.attrs)
+        if self.error is not None:
+            record['error'] = self.error
+        return record
+
+
+class Tracer:
+    """
+    Thread-safe collector of finished spans. The open spans and the ambient attributes
+    (e.g. question_index) are tracked per thread.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+            self.local.context = {}
+        return self.local.stack
+
+    @contextmanager
+    def context(self, **attrs):
+        """
+        Attach attributes (e.g. question_index) to every span opened by this thread inside the block.
+        """
+        self._stack()
+        previous = self.local.context
+        self.local.context = dict(previous, **attrs)
+        try:
+            yield
+        finally:
+            self.local.context = previous
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        """
+        Time the enclosed block as a span of `stage`, nested under this thread's open span.
+        """
+        stack = self._stack()
+        span = Span(stage, parent_id=stack[-1].span_id if stack else None, **dict(self.local.context, **attrs))
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start_perf
+            stack.pop()
+            with self.lock:
+                self.spans.append(span.to_dict())
+
+    def context_attrs(self) -> dict:
+        """
+        This thread's ambient attributes, e.g. to bind them to work handed to another thread.
+        """
+        self._stack()
+        return dict(self.local.context)
+
+    def current(self):
+        """
+        This thread's innermost open span, or None.
+        """
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def record_usage(self, usage):
+        """
+        Add token usage to the innermost open span, if any.
+        """
+        span = self.current()
+        if span is not None:
+            span.set_usage(usage)
+
+    def traced(self, stage, func, **attrs):
+        """
+        Wrap `func` so every call runs inside a span of `stage`.
+        """
+        def wrapper(*args, **kwargs):
+            with self.span(stage, **attrs):
+                return func(*args, **kwargs)
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def bind(self, func, **attrs):
+        """
+        Wrap `func` so it runs with the given context attributes, e.g. when submitted to a thread pool.
+        """
+        def wrapper(*args, **kwargs):
+            with self.context(**attrs):
+                return func(*args, **kwargs)
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def summary(self) -> dict:
+        """
+        Latency statistics per stage (seconds).
+        """
+        with self.lock:
+            spans = list(self.spans)
+        by_stage = {}
+        streamed = {}
+        for span in spans:
+            by_stage.setdefault(span['stage'], []).append(span['duration_s'])
+            if span.get('ttft_s') is not None:
+                streamed.setdefault(span['stage'], []).append((span['ttft_s'], span.get('tokens_per_s')))
+        summary = {}
+        for stage, durations in sorted(by_stage.items()):
+            durations = np.array(durations)
+            summary[stage] = {
+                'count': len(durations),
+                'total_s': float(durations.sum()),
+                'mean_s': float(durations.mean()),
+                'p50_s': float(np.percentile(durations, 50)),
+                'p95_s': float(np.percentile(durations, 95)),
+                'max_s': float(durations.max()),
+            }
+            if stage in streamed:
+                ttfts = np.array([ttft for ttft, _ in streamed[stage]])
+                rates = [rate for _, rate in streamed[stage] if rate is not None]
+                summary[stage].update({
+                    'streamed': len(ttfts),
+                    'ttft_p50_s': float(np.percentile(ttfts, 50)),
+                    'ttft_p95_s': float(np.percentile(ttfts, 95)),
+                    'tokens_per_s_mean': float(np.mean(rates)) if rates else None,
+                })
+        return summary
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        print("\nLatency by Stage:")
+        print(f"{'stage':<28}{'count':>7}{'total (s)':>11}{'mean (s)':>10}{'p50 (s)':>9}{'p95 (s)':>9}{'max (s)':>9}")
+        print("-" * 83)
+        for stage, stats in summary.items():
+            print(f"{stage:<28}{stats['count']:>7}{stats['total_s']:>11.2f}{stats['mean_s']:>10.2f}"
+                  f"{stats['p50_s']:>9.2f}{stats['p95_s']:>9.2f}{stats['max_s']:>9.2f}")
+        streamed = {stage: stats for stage, stats in summary.items() if 'streamed' in stats}
+        if streamed:
+            print("\nStreamed Responses:")
+            print(f"{'stage':<28}{'streamed':>9}{'TTFT p50 (s)':>14}{'TTFT p95 (s)':>14}{'tokens/s':>10}")
+            print("-" * 75)
+            for stage, stats in streamed.items():
+                rate = f"{stats['tokens_per_s_mean']:.1f}" if stats['tokens_per_s_mean'] is not None else "-"
+                print(f"{stage:<28}{stats['streamed']:>9}{stats['ttft_p50_s']:>14.2f}{stats['ttft_p95_s']:>14.2f}{rate:>10}")
+
+    def save(self, path: str):
+        """
+        Write all finished spans to `path` as JSON lines.
+        """
+        with self.lock:
+            spans = list(self.spans)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as file:
+            for span in spans:
+                file.write(json.dumps(span, default=str) + '\n')
+
+    def finish(self, path: str):
+        """
+        End-of-run report: print the per-stage breakdown and export the spans.
+        """
+        self.print_summary()
+        self.save(path)
+        print(f"Trace saved to: {path}")
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+
+
+# shared tracer for the current run
+tracer = Tracer()
+
+
+def default_trace_path() -> str:
+    return f"results/trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+
+
+def load_spans(path: str) -> list:
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def conversation_costs(spans) -> dict:
+    """
+    Per question: agent conversation latency and the tokens of every span nested under the conversation.
+    """
+    children = {}
+    for span in spans:
+        children.setdefault(span.get('parent_id'), []).append(span)
+    costs = {}
+    for span in spans:
+        if span['stage'] != 'conversation' or span.get('question_index') is None:
+            continue
+        cost = costs.setdefault(span['question_index'], dict({'latency_s': 0.0, 'llm_spans': 0},
+                                                             **{field: 0 for field in TOKEN_FIELDS}))
+        cost['latency_s'] += span['duration_s'] or 0.0
+        pending = [span]
+        while pending:
+            current = pending.pop()
+            pending.extend(children.get(current['span_id'], []))
+            if any(current.get(field) for field in TOKEN_FIELDS):
+                cost['llm_spans'] += 1
+            for field in TOKEN_FIELDS:
+                cost[field] += current.get(field, 0)
+    return costs
+
+
+def compare_traces(baseline_path: str, candidate_path: str):
+    """
+    Print the per-question latency and token difference between two traced runs over the same questions
+    (e.g. --speaker_mode groupchat vs state_machine).
+    """
+    baseline = conversation_costs(load_spans(baseline_path))
+    candidate = conversation_costs(load_spans(candidate_path))
+    questions = sorted(set(baseline) & set(candidate))
+    if not questions:
+        print("No questions with a conversation span in both traces")
+        return
+
+    def tokens(cost):
+        return sum(cost[field] for field in TOKEN_FIELDS)
+
+    print(f"{'question':>9}{'latency A (s)':>15}{'latency B (s)':>15}{'saved (s)':>11}"
+          f"{'tokens A':>10}{'tokens B':>10}{'saved':>8}{'spans A':>9}{'spans B':>9}")
+    print("-" * 96)
+    for idx in questions:
+        a, b = baseline[idx], candidate[idx]
+        print(f"{idx:>9}{a['latency_s']:>15.2f}{b['latency_s']:>15.2f}{a['latency_s'] - b['latency_s']:>11.2f}"
+              f"{tokens(a):>10}{tokens(b):>10}{tokens(a) - tokens(b):>8}{a['llm_spans']:>9}{b['llm_spans']:>9}")
+    latency_a = sum(baseline[idx]['latency_s'] for idx in questions)
+    latency_b = sum(candidate[idx]['latency_s'] for idx in questions)
+    tokens_a = sum(tokens(baseline[idx]) for idx in questions)
+    tokens_b = sum(tokens(candidate[idx]) for idx in questions)
+    print("-" * 96)
+    print(f"{len(questions)} questions: latency {latency_a:.1f}s -> {latency_b:.1f}s "
+          f"({(latency_a - latency_b) / len(questions):.2f}s saved per question), "
+          f"tokens {tokens_a} -> {tokens_b} ({(tokens_a - tokens_b) / len(questions):.0f} saved per question)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare per-question conversation latency and tokens of two traces')
+    parser.add_argument('baseline', type=str, help='Trace JSONL of the baseline run (A)')
+    parser.add_argument('candidate', type=str, help='Trace JSONL of the candidate run (B)')
+    args = parser.parse_args()
+    compare_traces(args.baseline, args.candidate)
@@ -1,119 +1,214 @@
-
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
 import os
-import time
 import base64
 import anthropic
 import glob
+import mmap
+import threading
+from collections import OrderedDict
+from config import COUNT_PDF_TOKENS, PDF_FOLDER, PDF_PAGE_SLICING
+from token_ledger import ledger
+from tracing import tracer
+from resilience import with_retries
+from page_slicer import sliced_pdf_payload
+from downloader import ChecksumManifest, download_guideline
+import httpx
 
 # download all the pdfs
 
 def download_and_rename_pdf(pdf_url, new_filename):
-    # Create pdfs directory if it doesn't exist
-    if not os.path.exists('pdfs'):
-        os.makedirs('pdfs')
-
-    if os.path.exists(os.path.join('pdfs', f'{new_filename}.pdf')):
-        print(f"File already exists for {new_filename}")
-        return
-    
-    # Set up Chrome options
-    chrome_options = Options()
-    prefs = {
-        "download.default_directory": os.path.abspath("pdfs"),
-        "download.prompt_for_download": False,
-        "plugins.always_open_pdf_externally": True
-    }
-    chrome_options.add_experimental_option("prefs", prefs)
-    driver = webdriver.Chrome(options=chrome_options)
-    
+    """
+    Download a single guideline to pdfs/<new_filename>.pdf.
+    Uses plain HTTP and only falls back to a Selenium browser when the URL does not serve a PDF.
+    To download many guidelines at once, use downloader.download_guidelines.
+    """
+    os.makedirs('pdfs', exist_ok=True)
     try:
-        before_download = set(os.listdir('pdfs'))
-        driver.get(pdf_url)
-        
-        # Wait for download to complete
-        time.sleep(5)
-        
-        after_download = set(os.listdir('pdfs'))
-        
-        # Find the new file
-        new_files = after_download - before_download
-        if new_files:
-            downloaded_file = os.path.join('pdfs', list(new_files)[0])
-            new_file_path = os.path.join('pdfs', f"{new_filename}.pdf")
-            
-            if os.path.exists(downloaded_file):
-                os.rename(downloaded_file, new_file_path)
-                print(f"File renamed to: {new_filename}.pdf")
+        with httpx.Client(timeout=60, follow_redirects=True) as client:
+            status = download_guideline(client, ChecksumManifest('pdfs'), new_filename, pdf_url)
+        if status == 'cached':
+            print(f"File already exists for {new_filename}")
         else:
-            print("No new files were downloaded")
-            
+            print(f"File saved to: {new_filename}.pdf")
     except Exception as e:
         print(f"An error occurred: {str(e)}")
-    
-    finally:
-        driver.quit()
 
 
+PDF_MODEL = "claude-3-7-sonnet-20250219"
+
+# cache of base64-encoded pdf payloads shared by all process_pdf calls
+PDF_PAYLOAD_CACHE_BYTES = 256 * 1024 * 1024
+
+class PDFPayloadCache:
+    """
+    Process-wide LRU cache of base64-encoded PDF payloads keyed by path, size and mtime.
+    Least recently used payloads are evicted once the cached text exceeds max_bytes.
+    """
+    def __init__(self, max_bytes=PDF_PAYLOAD_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # abspath -> (size, mtime_ns, payload)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def encode(pdf_path):
+        """
+        Base64-encode a PDF through mmap, so the raw bytes stay in the page cache instead of the heap.
+        """
+        if os.path.getsize(pdf_path) == 0:
+            return ''
+        with open(pdf_path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return base64.b64encode(mapped).decode('ascii')
+
+    def get(self, pdf_path):
+        path = os.path.abspath(pdf_path)
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        payload = self.encode(path)
+
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.total_bytes -= len(old[2])
+            self.entries[path] = (stat.st_size, stat.st_mtime_ns, payload)
+            self.total_bytes += len(payload)
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+                self.evictions += 1
+        return payload
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+            }
+
+pdf_payload_cache = PDFPayloadCache()
+
+
+def resolve_pdf_path(key: str) -> str:
+    """
+    Find the PDF for a guideline key, either pdfs/<key>.pdf or pdfs/<key>_*.pdf (pdfs/ is PDF_FOLDER).
+    """
+    pdf_path = os.path.join(PDF_FOLDER, f'{key}.pdf')
+    if not os.path.exists(pdf_path):
+        matching_files = glob.glob(os.path.join(PDF_FOLDER, f'{key}_*.pdf'))
+        if matching_files:
+            pdf_path = matching_files[0]
+        else:
+            raise FileNotFoundError(f"No PDF file found for key: {key}")
+    return pdf_path
+
+
+# page slicing is on unless PDF_PAGE_SLICING=0; the CLI drivers turn it off for grouped orders (see set_page_slicing)
+_page_slicing = PDF_PAGE_SLICING
+
+def set_page_slicing(enabled: bool):
+    """
+    Turn page slicing on or off for later process_pdf calls in this process. Only the full document is
+    prompt-cached, so runs that group questions by guideline send full PDFs to reuse the cache.
+    """
+    global _page_slicing
+    _page_slicing = enabled
+
 # pdf read tool
 def process_pdf(key: str, prompt: str) -> str:
-    try:
-        pdf_path = os.path.join('pdfs', f'{key}.pdf')
-        if not os.path.exists(pdf_path):
-            matching_files = glob.glob(os.path.join('pdfs', f'{key}_*.pdf'))
-            if matching_files:
-                pdf_path = matching_files[0]
-            else:
-                raise FileNotFoundError(f"No PDF file found for key: {key}")
+    with tracer.span('process_pdf', model=PDF_MODEL, key=key) as span:
+        try:
+            pdf_path = resolve_pdf_path(key)
 
-        with open(pdf_path, 'rb') as file:
-            pdf_data = base64.b64encode(file.read()).decode('utf-8')
-
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "document",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "application/pdf",
-                            "data": pdf_data
-                        },
-                        "cache_control": {"type": "ephemeral"}
-                    },
-                    {
-                        "type": "text",
-                        "text": f"{prompt}"
-                    }
-                ],
+            # send only the relevant pages when they can be identified with confidence
+            pdf_data, pages = None, None
+            if _page_slicing:
+                try:
+                    pdf_data, selected_pages, confidence = sliced_pdf_payload(pdf_path, prompt)
+                except Exception as e:
+                    # slicing only saves tokens; a PDF it cannot read is sent whole
+                    print(f'study: {key} page selection failed ({type(e).__name__}: {e}), sending full document')
+                else:
+                    if pdf_data is not None:
+                        pages = selected_pages
+                    print(f'study: {key} page selection {selected_pages} (confidence {confidence:.2f})'
+                          + ('' if pdf_data is not None else ', sending full document'))
+            if pdf_data is None:
+                pdf_data = pdf_payload_cache.get(pdf_path)
+
+            document = {
+                "type": "document",
+                "source": {
+                    "type": "base64",
+                    "media_type": "application/pdf",
+                    "data": pdf_data
+                }
             }
-        ]
+            # the full document is the same prefix for every question on this guideline, so it is worth
+            # a cache write; a page slice is specific to one prompt and would only pay the write premium
+            if pages is None:
+                document["cache_control"] = {"type": "ephemeral"}
 
-        client = anthropic.Anthropic()
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
+                        document,
+                        {
+                            "type": "text",
+                            "text": f"{prompt}"
+                        }
+                    ],
+                }
+            ]
 
-        message = client.messages.create(
-            model="claude-3-7-sonnet-20250219",
-            max_tokens=1024,
-            messages=messages
-        )
+            client = anthropic.Anthropic(max_retries=0)
 
+            message = with_retries("anthropic", PDF_MODEL, lambda: client.messages.create(
+                model=PDF_MODEL,
+                max_tokens=1024,
+                messages=messages
+            ))
 
-        # count the tokens
-        response = client.beta.messages.count_tokens(
-            betas=["pdfs-2024-09-25"],
-            model="claude-3-7-sonnet-20250219",
-            messages=messages
-        )
+            # account tokens from the response itself; exact pre-counting is opt-in
+            entry = ledger.record('process_pdf', PDF_MODEL, message.usage, key=key, pages=pages, **tracer.context_attrs())
+            span.set_usage(message.usage)
+            span.set(pages=pages)
 
-        print ('study:', key, '\nprompt:', prompt, '\nresponse:', response.json())
-        return message.content[0].text
+            if COUNT_PDF_TOKENS:
+                # diagnostic only: the answer is already in, so a failure here is logged, not raised
+                try:
+                    response = with_retries("anthropic", PDF_MODEL, lambda: client.beta.messages.count_tokens(
+                        betas=["pdfs-2024-09-25"],
+                        model=PDF_MODEL,
+                        messages=messages
+                    ))
+                    print('study:', key, '\ncount_tokens:', response.json())
+                except Exception as e:
+                    print(f'study: {key} count_tokens failed ({type(e).__name__}: {e})')
 
-    except FileNotFoundError as e:
-        return f"Error: {str(e)}"
-    except anthropic.APIError as e:
-        return f"API Error: {str(e)}"
-    except Exception as e:
-        return f"Unexpected error: {str(e)}"
\ No newline at end of file
+            print('study:', key, '\nprompt:', prompt,
+                  '\nusage: input', entry['input_tokens'], 'output', entry['output_tokens'],
+                  'cache write', entry['cache_creation_input_tokens'], 'cache read', entry['cache_read_input_tokens'])
+            return message.content[0].text
+
+        except FileNotFoundError as e:
+            # an unknown key is the agent's mistake; tell it, so it can pick another guideline
+            span.error = f"{type(e).__name__}: {e}"
+            return f"Error: {str(e)}"
+        # API errors left after the retries propagate and fail the question, instead of reaching
+        # the agents as if they were PDF content
\ No newline at end of file
@@ -0,0 +1,289 @@
+"""
+Local Vector Retrieval
+NumPy retrieval engine for the RAG baselines: chunk vectors are kept in one float32 matrix saved as a
+memory-mapped .npy, and the top-k chunks for a question come from a single matrix-vector product.
+Text comes from the shared text store, and the `local` embedder (hashed TF-IDF) needs no network,
+so an index can be built and queried fully offline.
+
+Layout of a persisted index directory:
+- vectors.npy: float32 chunk vectors, one row per chunk, L2-normalized
+- chunks.bin / chunk_offsets.npy: chunk text, concatenated, and its byte offsets
+- chunk_pages.npy: int32 page number (0-based, within its PDF) where each chunk starts
+- idf.npy: hashed-term IDF weights of the local embedder
+- manifest.json: embedder, chunking parameters and the files with their SHA-256 and chunk ranges
+Indices of several chunk sizes and overlaps can be built from the same extracted text; OpenAI
+chunk embeddings go through the shared embedding store, so chunks they have in common are embedded once;
+question embeddings are never stored.
+"""
+
+import json
+import os
+import zlib
+import numpy as np
+from bm25 import tokenize
+from index_cache import (DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE, DEFAULT_TOP_K, embedding_key, file_sha256,
+                         get_embedding_cache)
+from resilience import with_retries
+from text_store import get_text_store
+
+# chunk_size is given in tokens like llama_index's; whitespace words are counted at 0.75 words per token
+WORDS_PER_TOKEN = 0.75
+EMBEDDINGS = ('openai', 'local')
+
+
+class LocalEmbedder:
+    """
+    Hashed TF-IDF embedder: unigrams and bigrams are hashed into `dim` buckets, weighted by
+    log term frequency times IDF (fitted on the indexed chunks) and L2-normalized. Runs offline.
+    """
+
+    name = 'local'
+
+    def __init__(self, dim=4096, idf=None):
+        self.dim = dim
+        self.idf = idf
+
+    def _counts(self, text) -> np.ndarray:
+        tokens = tokenize(text)
+        terms = tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+        buckets = np.fromiter((zlib.crc32(term.encode('utf-8')) % self.dim for term in terms),
+                              dtype=np.int64, count=len(terms))
+        return np.bincount(buckets, minlength=self.dim).astype(np.float32)
+
+    def fit(self, texts):
+        df = np.zeros(self.dim, dtype=np.float32)
+        for text in texts:
+            df += self._counts(text) > 0
+        self.idf = np.log1p((len(texts) + 1) / (df + 1)).astype(np.float32)
+
+    def embed(self, texts) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vectors[row] = np.log1p(self._counts(text))
+        if self.idf is not None:
+            vectors *= self.idf
+        return normalize(vectors)
+
+    embed_queries = embed
+
+
+class OpenAIEmbedder:
+    """
+    OpenAI embeddings, the same model llama_index uses by default, cached in the shared embedding store
+    unless `use_store` is False.
+    """
+
+    name = 'openai'
+    idf = None
+
+    def __init__(self, model='text-embedding-ada-002', batch_size=100, use_store=True):
+        self.model = model
+        self.batch_size = batch_size
+        self.use_store = use_store
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(max_retries=0)
+        return self._client
+
+    def fit(self, texts):
+        pass
+
+    def _embed_batch(self, texts) -> list:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = list(texts[start:start + self.batch_size])
+            response = with_retries('openai', self.model, lambda: self.client.embeddings.create(model=self.model, input=batch))
+            vectors.extend(item.embedding for item in response.data)
+        return vectors
+
+    def embed(self, texts) -> np.ndarray:
+        if not self.use_store:
+            return self.embed_queries(texts)
+        # the client reads its endpoint from OPENAI_BASE_URL, as embedding_key does
+        return normalize(get_embedding_cache().embed(embedding_key(f'openai/{self.model}'), list(texts), self._embed_batch))
+
+    def embed_queries(self, texts) -> np.ndarray:
+        """
+        Embed texts directly, without the embedding store: used for questions, as the store only holds chunks.
+        """
+        return normalize(np.asarray(self._embed_batch(list(texts)), dtype=np.float32).reshape(len(texts), -1))
+
+
+def make_embedder(embedding: str, use_store: bool = True):
+    if embedding == 'local':
+        return LocalEmbedder()
+    if embedding == 'openai':
+        return OpenAIEmbedder(use_store=use_store)
+    raise ValueError(f"Unknown embedding: {embedding} (expected one of {', '.join(EMBEDDINGS)})")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def chunk_pages(pages, chunk_size: int = DEFAULT_CHUNK_SIZE, chunk_overlap: int = 0) -> list:
+    """
+    Split a document's pages into chunks of about `chunk_size` tokens, each starting `chunk_overlap`
+    tokens before the end of the previous one.
+
+    Returns:
+        list: (chunk text, page the chunk starts on)
+    """
+    words_per_chunk = max(1, int(chunk_size * WORDS_PER_TOKEN))
+    stride = max(1, words_per_chunk - int(chunk_overlap * WORDS_PER_TOKEN))
+    words = [(word, page) for page, text in enumerate(pages) for word in text.split()]
+    chunks = []
+    for start in range(0, len(words), stride):
+        chunks.append((' '.join(word for word, _ in words[start:start + words_per_chunk]), words[start][1]))
+        if start + words_per_chunk >= len(words):
+            break
+    return chunks
+
+
+class VectorIndex:
+    """
+    Memory-mapped chunk index over one or more guideline PDFs.
+    """
+
+    def __init__(self, persist_dir: str, embedder=None):
+        self.persist_dir = persist_dir
+        with open(os.path.join(persist_dir, 'manifest.json'), 'r') as file:
+            self.manifest = json.load(file)
+        self.vectors = np.load(os.path.join(persist_dir, 'vectors.npy'), mmap_mode='r')
+        self.chunk_offsets = np.load(os.path.join(persist_dir, 'chunk_offsets.npy'), mmap_mode='r')
+        self.chunk_pages = np.load(os.path.join(persist_dir, 'chunk_pages.npy'), mmap_mode='r')
+        size = os.path.getsize(os.path.join(persist_dir, 'chunks.bin'))
+        self.chunk_text = (np.memmap(os.path.join(persist_dir, 'chunks.bin'), dtype=np.uint8, mode='r')
+                           if size else np.zeros(0, dtype=np.uint8))
+        if embedder is None:
+            embedder = make_embedder(self.manifest['embedding'])
+        if self.manifest['embedding'] == 'local':
+            embedder.idf = np.load(os.path.join(persist_dir, 'idf.npy'))
+        self.embedder = embedder
+        # chunk row -> file name, for the metadata of search results
+        self.chunk_files = []
+        for name, entry in sorted(self.manifest['files'].items(), key=lambda item: item[1]['first_chunk']):
+            self.chunk_files.extend([name] * entry['chunk_count'])
+
+    def __len__(self):
+        return len(self.chunk_offsets) - 1
+
+    def chunk(self, row: int) -> str:
+        return bytes(self.chunk_text[self.chunk_offsets[row]:self.chunk_offsets[row + 1]]).decode('utf-8')
+
+    def search(self, question: str, top_k: int = DEFAULT_TOP_K) -> list:
+        """
+        Top-k chunks by cosine similarity, best first.
+
+        Returns:
+            list: dicts with score, text, file_name and page_label
+        """
+        return self.search_batch([question], top_k)[0]
+
+    def search_batch(self, questions: list, top_k: int = DEFAULT_TOP_K) -> list:
+        """
+        Top-k chunks for every question: the questions are embedded in one call and scored against
+        all chunks in a single matrix product.
+
+        Returns:
+            list: one list of hits per question, as returned by `search`
+        """
+        if len(self) == 0 or not questions:
+            return [[] for _ in questions]
+        queries = self.embedder.embed_queries(list(questions))
+        scores = queries @ self.vectors.T
+        top_k = min(top_k, scores.shape[1])
+        best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        return [
+            [{'score': float(scores[i, row]), 'text': self.chunk(row), 'file_name': self.chunk_files[row],
+              'page_label': str(int(self.chunk_pages[row]) + 1)}
+             for row in rows]
+            for i, rows in enumerate(best)
+        ]
+
+    def context(self, question: str, top_k: int = DEFAULT_TOP_K) -> str:
+        """
+        The retrieved chunks joined into one context string.
+        """
+        return self.contexts([question], top_k)[0]
+
+    def contexts(self, questions: list, top_k: int = DEFAULT_TOP_K) -> list:
+        """
+        Context string of every question, from one batched search.
+        """
+        return ['\n\n'.join(hit['text'] for hit in hits) for hits in self.search_batch(questions, top_k)]
+
+
+def load_or_build_vector_index(pdf_paths: list, persist_dir: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                               embedding: str = 'local', chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                               use_store: bool = True) -> VectorIndex:
+    """
+    Load the index in `persist_dir`, or (re)build it when the PDFs, chunking or embedder differ.
+    With the OpenAI embedder, only chunks missing from the shared embedding store are embedded
+    (every chunk, and nothing is stored, without `use_store`); the local embedder is refitted and
+    re-embeds everything, which is fast.
+    """
+    hashes = {os.path.basename(path): file_sha256(path) for path in pdf_paths}
+    manifest_path = os.path.join(persist_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+        if (manifest['embedding'] == embedding and manifest['chunk_size'] == chunk_size
+                and manifest.get('chunk_overlap', 0) == chunk_overlap
+                and {name: entry['sha256'] for name, entry in manifest['files'].items()} == hashes):
+            print(f"Loaded cached vector index for {len(hashes)} PDFs from '{persist_dir}'")
+            return VectorIndex(persist_dir, make_embedder(embedding, use_store))
+
+    store = get_text_store()
+    store.update(pdf_paths)
+    embedder = make_embedder(embedding, use_store)
+    chunks, pages, files = [], [], {}
+    for path in sorted(pdf_paths, key=os.path.basename):
+        name = os.path.basename(path)
+        file_chunks = chunk_pages(store.pages_for_file(path), chunk_size, chunk_overlap)
+        files[name] = {'sha256': hashes[name], 'first_chunk': len(chunks), 'chunk_count': len(file_chunks)}
+        chunks.extend(text for text, _ in file_chunks)
+        pages.extend(page for _, page in file_chunks)
+
+    embedder.fit(chunks)
+    # only a stored embedder may open the embedding store; local and store-less builds never touch it
+    counted = embedding != 'local' and use_store
+    misses = get_embedding_cache().misses if counted else 0
+    vectors = embedder.embed(chunks) if chunks else np.zeros((0, 1), dtype=np.float32)
+    reused = ''
+    if counted:
+        reused = f", {misses + len(chunks) - get_embedding_cache().misses} reused from the embedding store"
+    print(f"Embedded {len(chunks)} chunks of {len(files)} PDFs with the {embedding} embedder{reused} into '{persist_dir}'")
+
+    os.makedirs(persist_dir, exist_ok=True)
+    offsets = [0]
+    with open(os.path.join(persist_dir, 'chunks.bin.tmp'), 'wb') as file:
+        for text in chunks:
+            encoded = text.encode('utf-8')
+            file.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    arrays = {
+        'vectors.npy': vectors,
+        'chunk_offsets.npy': np.array(offsets, dtype=np.int64),
+        'chunk_pages.npy': np.array(pages, dtype=np.int32),
+        'idf.npy': embedder.idf if embedder.idf is not None else np.zeros(0, dtype=np.float32),
+    }
+    for filename, array in arrays.items():
+        with open(os.path.join(persist_dir, filename + '.tmp'), 'wb') as file:
+            np.save(file, array)
+    # the manifest goes last, so an interrupted build is rebuilt on the next run
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    for filename in ['chunks.bin', *arrays]:
+        os.replace(os.path.join(persist_dir, filename + '.tmp'), os.path.join(persist_dir, filename))
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump({'embedding': embedding, 'chunk_size': chunk_size, 'chunk_overlap': chunk_overlap, 'files': files}, file, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return VectorIndex(persist_dir, embedder)